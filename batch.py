@@ -0,0 +1,338 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+import chess
+from chess import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK
+
+"""
+Legality of many positions at once with NumPy, for analysis jobs over tens of thousands of boards where a
+ChessBoard per position would take too long.
+
+The boards come in as an (N, 64) int8 array of the characters of ChessBoard.string (see encode) and become one
+uint64 bitboard per piece code, an array of N numbers. Every piece moves by shifting its bitboard by the step
+between the squares, with a mask so nothing wraps around the edge of the board, and sliding pieces are filled out
+along their lines with Kogge-Stone shifts. All N positions are worked on by each shift together.
+
+Moves are counted without being listed: a step or a line in one direction takes each piece to a different
+square (a line stops at the first piece in the way, so two pieces never share one), so the count is the number
+of bits of every shifted bitboard added up. The pinned pieces and the squares that stop a check are worked out
+first, as ChessBoard.legal_moves does.
+
+The results match a ChessBoard(string, team) of each position: check_checker, checkmate_checker (without loaded
+tablebases) and the length of generate_moves. Like such a board, the positions have no en passant square and
+every king and rook counts as not moved yet.
+
+Run this file to check the results against ChessBoard and time both: python batch.py [--positions N]
+"""
+
+FULL = np.uint64((1 << 64) - 1)
+
+KNIGHT_STEPS = (6, 10, 15, 17, -6, -10, -15, -17)
+KING_STEPS = (1, -1, 8, -8, 7, -7, 9, -9)
+ROOK_STEPS = (1, -1, 8, -8)
+BISHOP_STEPS = (7, -7, 9, -9)
+# Pawns of the own team go up the board, towards index 0 (see bitboard.pawn_push)
+PUSH = {chess.UP: -8, chess.DOWN: 8}
+CAPTURES = {chess.UP: (-7, -9), chess.DOWN: (7, 9)}
+
+
+def columns(first, last):
+    mask = 0
+    for index in range(64):
+        if first <= index % 8 <= last:
+            mask |= 1 << index
+    return np.uint64(mask)
+
+def rows(*numbers):
+    mask = 0
+    for index in range(64):
+        if index // 8 in numbers:
+            mask |= 1 << index
+    return np.uint64(mask)
+
+"""
+The squares a step can land on without having wrapped around the edge of the board. The column changes by
+((step + 4) % 8) - 4, so a step of 9 goes one column up and can not land on column 0.
+"""
+def build_wraps():
+    wraps = {}
+    for step in set(KNIGHT_STEPS + KING_STEPS):
+        change = (step + 4) % 8 - 4
+        if change >= 0:
+            wraps[step] = columns(change, 7)
+        else:
+            wraps[step] = columns(0, 7 + change)
+    return wraps
+
+WRAPS = build_wraps()
+# The row a pawn of either direction lands on with its first push, and the last row
+DOUBLE = {chess.UP: rows(5), chess.DOWN: rows(2)}
+LAST = {chess.UP: rows(0), chess.DOWN: rows(7)}
+COLUMN_FIRST = columns(0, 0)
+COLUMN_LAST = columns(7, 7)
+
+# Piece codes of the characters of ChessBoard.string, by their byte
+CODES = np.zeros(256, dtype = np.uint8)
+for char, code in chess.string_to_code.items():
+    CODES[ord(char)] = code
+
+
+"""
+Turns boards into the (N, 64) int8 array the batch functions take.
+
+Parameters: boards -> ChessBoards or their 64 character strings
+"""
+def encode(boards):
+    strings = []
+    for board in boards:
+        if isinstance(board, chess.ChessBoard):
+            board = board.convert_to_string()
+        strings.append(board)
+    return np.frombuffer("".join(strings).encode("ascii"), dtype = np.int8).reshape(-1, 64)
+
+"""
+Builds the bitboards of the boards, one array of N numbers for every piece code.
+
+Returns: list of 16 uint64 arrays, indexed like ChessBoard.bitboards (BLACK and WHITE hold all pieces of a colour)
+"""
+def piece_bitboards(boards):
+    codes = CODES[np.asarray(boards).view(np.uint8)]
+    bitboards = [np.zeros(len(codes), dtype = np.uint64) for code in range(16)]
+    for colour in (BLACK, WHITE):
+        for type in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            # Bit i of the packed bytes is square i, which is the bit order of the bitboards
+            packed = np.packbits(codes == (type | colour), axis = 1, bitorder = "little")
+            bitboards[type | colour] = np.ascontiguousarray(packed).view("<u8").ravel().astype(np.uint64)
+            bitboards[colour] |= bitboards[type | colour]
+    return bitboards
+
+def raw_shift(bitboards, step):
+    if step > 0:
+        return bitboards << np.uint64(step)
+    return bitboards >> np.uint64(-step)
+
+def shift(bitboards, step):
+    return raw_shift(bitboards, step) & WRAPS[step]
+
+"""
+Gets the squares the sliding pieces attack in the direction of the step, up to and with the first piece in the way
+(Kogge-Stone fill: the pieces are spread over the empty squares 1, 2 and 4 steps at a time).
+"""
+def slide(sliders, empty, step):
+    wrap = WRAPS[step]
+    empty = empty & wrap
+    sliders = sliders | (empty & raw_shift(sliders, step))
+    empty = empty & raw_shift(empty, step)
+    sliders = sliders | (empty & raw_shift(sliders, 2 * step))
+    empty = empty & raw_shift(empty, 2 * step)
+    sliders = sliders | (empty & raw_shift(sliders, 4 * step))
+    return raw_shift(sliders, step) & wrap
+
+if hasattr(np, "bitwise_count"):
+    def popcount(bitboards):
+        return np.bitwise_count(bitboards).astype(np.int64)
+else:
+    def popcount(bitboards):
+        return np.unpackbits(bitboards.view(np.uint8)).reshape(-1, 64).sum(axis = 1, dtype = np.int64)
+
+"""
+Gets the squares attacked by the pieces of one colour.
+
+Parameters: colour -> the colour code of the attacking side
+            direction -> the direction its pawns move in
+            occupied -> the squares that block the sliding pieces
+"""
+def attack_map(bitboards, colour, direction, occupied):
+    empty = ~occupied
+    attacks = np.zeros_like(occupied)
+    for step in KNIGHT_STEPS:
+        attacks |= shift(bitboards[KNIGHT | colour], step)
+    for step in KING_STEPS:
+        attacks |= shift(bitboards[KING | colour], step)
+    for step in CAPTURES[direction]:
+        attacks |= shift(bitboards[PAWN | colour], step)
+    rooks = bitboards[ROOK | colour] | bitboards[QUEEN | colour]
+    bishops = bitboards[BISHOP | colour] | bitboards[QUEEN | colour]
+    for step in ROOK_STEPS:
+        attacks |= slide(rooks, empty, step)
+    for step in BISHOP_STEPS:
+        attacks |= slide(bishops, empty, step)
+    return attacks
+
+"""
+Counts the moves of pawns, each promotion counting once for every piece it can become.
+
+Parameters: pawns -> the pawns to move
+            targets -> the squares they may end on
+"""
+def count_pawn_moves(pawns, targets, enemies, empty, direction):
+    last = LAST[direction]
+    single = shift(pawns, PUSH[direction]) & empty
+    double = shift(single & DOUBLE[direction], PUSH[direction]) & empty
+    ends = single & targets
+    count = popcount(ends & ~last) + 4 * popcount(ends & last) + popcount(double & targets)
+    for step in CAPTURES[direction]:
+        ends = shift(pawns, step) & enemies & targets
+        count += popcount(ends & ~last) + 4 * popcount(ends & last)
+    return count
+
+"""
+Works out the attack maps, checks and number of legal moves of one side in every position.
+
+Parameters: boards -> (N, 64) int8 array of board strings (see encode)
+            team -> the team of the boards, whose pawns go up the board
+            colour -> the side to look at, the team if not given
+Returns: dictionary of arrays of N:
+         "attacks"   -> the squares the side attacks (uint64 bitboards)
+         "attacked"  -> the squares the other side attacks
+         "in_check"  -> whether the king of the side is attacked (check_checker)
+         "moves"     -> the number of legal moves (len(generate_moves(colour)))
+         "checkmate" -> whether the side has no legal moves, so is mated or stalemated (checkmate_checker)
+"""
+def evaluate(boards, team = "white", colour = None):
+    if colour == None:
+        colour = team
+    own = chess.colour_to_code[colour]
+    enemy = own ^ WHITE
+    direction = chess.UP if colour == team else chess.DOWN
+    enemy_direction = 1 - direction
+
+    bitboards = piece_bitboards(boards)
+    occupied = bitboards[BLACK] | bitboards[WHITE]
+    empty = ~occupied
+    king = bitboards[KING | own]
+    has_king = king != 0
+
+    attacked = attack_map(bitboards, enemy, enemy_direction, occupied)
+    # The king does not block the attacks on the squares behind it
+    danger = attack_map(bitboards, enemy, enemy_direction, occupied & ~king)
+    in_check = (attacked & king) != 0
+
+    # The pieces giving check, the squares between a checking slider and the king, and the pins
+    checkers = bitboards[PAWN | enemy] & (shift(king, CAPTURES[direction][0]) | shift(king, CAPTURES[direction][1]))
+    for step in KNIGHT_STEPS:
+        checkers |= shift(king, step) & bitboards[KNIGHT | enemy]
+    blocks = np.zeros_like(king)
+    pinned = np.zeros_like(king)
+    pins = []
+    for steps, type in ((ROOK_STEPS, ROOK), (BISHOP_STEPS, BISHOP)):
+        snipers = bitboards[type | enemy] | bitboards[QUEEN | enemy]
+        movers = bitboards[type | own] | bitboards[QUEEN | own]
+        for step in steps:
+            line = slide(king, empty, step)
+            hits = line & snipers
+            checkers |= hits
+            blocks |= np.where(hits != 0, line, 0)
+            # Looking through the first piece of our own on the line, for a sniper behind it
+            first = line & bitboards[own]
+            beyond = slide(king, empty | first, step)
+            piece = np.where((beyond & snipers) != 0, first, 0)
+            pinned |= piece
+            pins.append((piece, beyond, movers))
+
+    count = popcount(checkers)
+    allowed = np.where(count == 0, FULL, np.where(count == 1, checkers | blocks, 0)).astype(np.uint64)
+    targets = ~bitboards[own] & allowed
+    enemies = bitboards[enemy]
+
+    moves = np.zeros(len(king), dtype = np.int64)
+    for step in KING_STEPS:
+        moves += popcount(shift(king, step) & ~bitboards[own] & ~danger)
+
+    free = ~pinned
+    for step in KNIGHT_STEPS:
+        moves += popcount(shift(bitboards[KNIGHT | own] & free, step) & targets)
+    rooks = (bitboards[ROOK | own] | bitboards[QUEEN | own]) & free
+    bishops = (bitboards[BISHOP | own] | bitboards[QUEEN | own]) & free
+    for step in ROOK_STEPS:
+        moves += popcount(slide(rooks, empty, step) & targets)
+    for step in BISHOP_STEPS:
+        moves += popcount(slide(bishops, empty, step) & targets)
+    moves += count_pawn_moves(bitboards[PAWN | own] & free, targets, enemies, empty, direction)
+
+    # A pinned piece only moves along its pin: a slider of the kind of the line anywhere on it, a pawn if its move
+    # stays on it and a knight never
+    for piece, line, movers in pins:
+        moves += np.where((piece & movers) != 0, popcount(line & targets), 0)
+        moves += count_pawn_moves(piece & bitboards[PAWN | own], targets & line, enemies, empty, direction)
+
+    # Castling with the rook in the corner of the king's row, with nothing between them, out of check and not through
+    # or into an attacked square, as ChessBoard.castling_possible_positions
+    rooks = bitboards[ROOK | own]
+    safe = (count == 0) & has_king
+    for step, corner, room in ((-1, COLUMN_FIRST, columns(3, 7)), (1, COLUMN_LAST, columns(0, 4))):
+        can = safe & ((slide(king, empty, step) & rooks & corner) != 0) & ((king & room) != 0)
+        can &= ((raw_shift(king, step) | raw_shift(king, 2 * step)) & danger) == 0
+        moves += can
+
+    # In double check only the king moves, which is all allowed leaves out already
+    return {
+        "attacks": attack_map(bitboards, own, direction, occupied),
+        "attacked": attacked,
+        "in_check": in_check,
+        "moves": moves,
+        "checkmate": moves == 0
+    }
+
+
+"""
+Plays random games on ChessBoards to get positions for the benchmark, with some of each team.
+
+Returns: the board strings and their teams
+"""
+def random_positions(count, seed = 1):
+    rng = random.Random(seed)
+    strings = []
+    teams = []
+    while len(strings) < count:
+        team = rng.choice(["white", "black"])
+        board = chess.ChessBoard(team = team)
+        for ply in range(rng.randrange(1, 160)):
+            moves = board.generate_moves(board.turn)
+            if len(moves) == 0:
+                break
+            board.make_move(rng.choice(moves))
+        strings.append(board.convert_to_string())
+        teams.append(team)
+    return strings, teams
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "check the batch legality against ChessBoard and time both")
+    parser.add_argument("--positions", type = int, default = 5000)
+    args = parser.parse_args()
+
+    strings, teams = random_positions(args.positions)
+    mismatches = 0
+    batch_time = 0
+    scalar_time = 0
+    for team in ("white", "black"):
+        chosen = [string for string, string_team in zip(strings, teams) if string_team == team]
+        boards = encode(chosen)
+        for colour in ("white", "black"):
+            start = time.perf_counter()
+            results = evaluate(boards, team, colour)
+            batch_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for i, string in enumerate(chosen):
+                board = chess.ChessBoard(string, team)
+                moves = len(board.generate_moves(colour))
+                if colour == team:
+                    expected = (board.check_checker(), board.checkmate_checker())
+                    found = (bool(results["in_check"][i]), bool(results["checkmate"][i]))
+                    if expected != found:
+                        mismatches += 1
+                if moves != results["moves"][i]:
+                    mismatches += 1
+                    if mismatches <= 5:
+                        print(f"[MISMATCH] {team} {colour} {string}: {moves} moves, batch {results['moves'][i]}")
+            scalar_time += time.perf_counter() - start
+
+    checks = 2 * len(strings)
+    print(f"[BATCH] {checks} positions in {batch_time:.3f}s, {checks / batch_time:.0f} positions/sec")
+    print(f"[SCALAR] {checks} positions in {scalar_time:.3f}s, {checks / scalar_time:.0f} positions/sec")
+    print(f"[CHECK] {mismatches} mismatches")
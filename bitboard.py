@@ -0,0 +1,149 @@
+"""
+Bitboards used by the ChessBoard move generation. A bitboard is a 64 bit integer where bit i stands for
+square i of the array board (the index in the board string), so bit 0 is (8,8) and bit 63 is (1,1).
+
+The knight, king and pawn attacks are read from tables that are built once at import. Sliding pieces look up
+their attacks by the occupancy of each line running through their square (a kindergarten style lookup), with a
+dict keyed by the masked occupancy taking the place of the magic multiplication.
+"""
+
+FULL = (1 << 64) - 1
+
+# Pawns of the ChessBoard's own team move up the board (towards (x,8)), the other team's pawns move down.
+UP = 0
+DOWN = 1
+
+
+def bit(x, y):
+    return 1 << ((8 - y) * 8 + 8 - x)
+
+def on_board(x, y):
+    return 0 < x < 9 and 0 < y < 9
+
+"""
+Yields the index of every set bit of the bitboard, from the lowest index to the highest.
+"""
+def squares(bitboard):
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+def count(bitboard):
+    return bin(bitboard).count("1")
+
+
+"""
+Builds the table of one line (e.g. the rank) through the square at (x, y). The edge squares of the line never
+block anything behind them, so only the inner squares are part of the occupancy mask.
+
+Returns: the occupancy mask and a dict of the attacks for every subset of that mask
+"""
+def build_line(x, y, directions):
+    mask = 0
+    for dx, dy in directions:
+        i = x + dx
+        j = y + dy
+        while on_board(i + dx, j + dy):
+            mask |= bit(i, j)
+            i += dx
+            j += dy
+
+    table = {}
+    occupied = 0
+    while True:
+        attacks = 0
+        for dx, dy in directions:
+            i = x + dx
+            j = y + dy
+            while on_board(i, j):
+                attacks |= bit(i, j)
+                if occupied & bit(i, j):
+                    break
+                i += dx
+                j += dy
+        table[occupied] = attacks
+        # Steps through every subset of the mask
+        occupied = (occupied - mask) & mask
+        if occupied == 0:
+            break
+    return mask, table
+
+def build_steps(x, y, offsets):
+    attacks = 0
+    for dx, dy in offsets:
+        if on_board(x + dx, y + dy):
+            attacks |= bit(x + dx, y + dy)
+    return attacks
+
+
+# The eight directions as (dx, dy) steps, the first two along the row
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+"""
+Builds the rays of the square at (x, y): for every one of the DIRECTIONS the squares from the square to the edge
+of the board, nearest first.
+"""
+def build_rays(x, y):
+    rays = []
+    for dx, dy in DIRECTIONS:
+        ray = []
+        i = x + dx
+        j = y + dy
+        while on_board(i, j):
+            ray.append((8 - j) * 8 + 8 - i)
+            i += dx
+            j += dy
+        rays.append(tuple(ray))
+    return tuple(rays)
+
+
+# RAYS[index] holds the squares of the eight rays of the square (see build_rays), so lines are walked by index
+RAYS = []
+KNIGHT_ATTACKS = []
+KING_ATTACKS = []
+PAWN_ATTACKS = ([], [])
+ROOK_LINES = []
+BISHOP_LINES = []
+# BETWEEN[a][b] holds the squares strictly between two squares on the same line, or 0 if they are not on one
+BETWEEN = [[0] * 64 for i in range(64)]
+RANKS = [0] * 9
+FILES = [0] * 9
+
+for index in range(64):
+    x = 8 - index % 8
+    y = 8 - index // 8
+    RANKS[y] |= 1 << index
+    FILES[x] |= 1 << index
+    KNIGHT_ATTACKS.append(build_steps(x, y, ((1, 2), (-1, 2), (2, 1), (2, -1), (-2, 1), (-2, -1), (-1, -2), (1, -2))))
+    KING_ATTACKS.append(build_steps(x, y, ((1, 1), (1, -1), (-1, 1), (-1, -1), (1, 0), (-1, 0), (0, 1), (0, -1))))
+    PAWN_ATTACKS[UP].append(build_steps(x, y, ((1, 1), (-1, 1))))
+    PAWN_ATTACKS[DOWN].append(build_steps(x, y, ((1, -1), (-1, -1))))
+    ROOK_LINES.append(build_line(x, y, ((1, 0), (-1, 0))) + build_line(x, y, ((0, 1), (0, -1))))
+    BISHOP_LINES.append(build_line(x, y, ((1, 1), (-1, -1))) + build_line(x, y, ((1, -1), (-1, 1))))
+    RAYS.append(build_rays(x, y))
+    for ray in RAYS[index]:
+        between = 0
+        for i in ray:
+            BETWEEN[index][i] = between
+            between |= 1 << i
+
+
+def rook_attacks(square, occupied):
+    mask, table, mask2, table2 = ROOK_LINES[square]
+    return table[occupied & mask] | table2[occupied & mask2]
+
+def bishop_attacks(square, occupied):
+    mask, table, mask2, table2 = BISHOP_LINES[square]
+    return table[occupied & mask] | table2[occupied & mask2]
+
+def queen_attacks(square, occupied):
+    return rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+
+"""
+Pushes every pawn of the bitboard one row in the given direction.
+"""
+def pawn_push(pawns, direction):
+    if direction == UP:
+        return pawns >> 8
+    return (pawns << 8) & FULL
@@ -0,0 +1,191 @@
+import argparse
+import mmap
+import random
+import struct
+from collections import Counter
+
+import chess
+import zobrist
+
+"""
+Opening book: the moves played from common positions, in a file sorted by the Zobrist key of the position, in the
+manner of Polyglot books. The file is memory-mapped and searched by bisection, so a lookup reads a handful of
+entries whatever the size of the book, and nothing is loaded up front.
+
+Every entry is 16 bytes: the key (8 bytes), the move (2 bytes), its weight (2 bytes, how often it was played) and
+4 bytes that are not used. Keys and moves are those of a board from the white team's perspective, boards of the
+black team are turned around to look them up (see book_key).
+
+Build a book with: python book.py book.bin [games.pgn ...] [--plies 16]
+The main lines in OPENINGS are always added, so a book can be built without any games.
+"""
+
+entry_format = struct.Struct("<QHHI")
+
+OPENINGS = [
+    "e4 e5 Nf3 Nc6 Bb5 a6 Ba4 Nf6 O-O Be7 Re1 b5 Bb3 d6 c3 O-O",
+    "e4 e5 Nf3 Nc6 Bc4 Bc5 c3 Nf6 d4 exd4 cxd4 Bb4+",
+    "e4 e5 Nf3 Nf6 Nxe5 d6 Nf3 Nxe4 d4 d5",
+    "e4 c5 Nf3 d6 d4 cxd4 Nxd4 Nf6 Nc3 a6",
+    "e4 c5 Nf3 Nc6 d4 cxd4 Nxd4 Nf6 Nc3 e5",
+    "e4 e6 d4 d5 Nc3 Nf6 Bg5 Be7 e5 Nfd7",
+    "e4 c6 d4 d5 Nc3 dxe4 Nxe4 Bf5 Ng3 Bg6",
+    "d4 d5 c4 e6 Nc3 Nf6 Bg5 Be7 e3 O-O",
+    "d4 d5 c4 c6 Nf3 Nf6 Nc3 dxc4 a4 Bf5",
+    "d4 Nf6 c4 e6 Nc3 Bb4 e3 O-O Bd3 d5",
+    "d4 Nf6 c4 g6 Nc3 Bg7 e4 d6 Nf3 O-O",
+    "c4 e5 Nc3 Nf6 Nf3 Nc6 g3 d5",
+    "Nf3 d5 g3 Nf6 Bg2 e6 O-O Be7"
+]
+
+
+"""
+Gets the key of the position as seen from the white team, which is the board's own key for the white team. For
+the black team the key is made from the squares turned around (index i is 63 - i for the other team).
+"""
+def book_key(board):
+    if board.team == "white":
+        return board.key
+    castling = 0
+    for i in range(4):
+        if board.castling & 1 << i:
+            # The corner at index c is the corner at 63 - c for the white team, which is the corner 3 - i
+            castling |= 1 << (3 - i)
+    key = zobrist.CASTLING[castling]
+    bitboards = board.bitboards
+    for index in chess.squares(bitboards[chess.WHITE] | bitboards[chess.BLACK]):
+        key ^= zobrist.PIECES[board.board[index] & 15][63 - index]
+    if board.turn == "black":
+        key ^= zobrist.SIDE
+    if board.en_passant != None:
+        key ^= zobrist.EN_PASSANT[chess.coords_of(63 - board.en_passant)[0]]
+    return key
+
+"""
+Turns a move around between the board's perspective and the white team's, which is the same both ways.
+"""
+def turn_move(board, move):
+    if board.team == "white":
+        return move
+    start, end, promotion = chess.decode_move(move)
+    return chess.encode_move(63 - start, 63 - end, promotion)
+
+
+"""
+Book class looks positions up in a book file.
+
+Parameters:
+path -> the book file
+"""
+class Book():
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can not be mapped
+            self.data = b""
+        self.size = len(self.data) // entry_format.size
+
+    def __len__(self):
+        return self.size
+
+    """
+    Finds the first entry with a key of at least the given key, by bisection.
+    """
+    def find(self, key):
+        low = 0
+        high = self.size
+        while low < high:
+            middle = (low + high) // 2
+            if entry_format.unpack_from(self.data, middle * entry_format.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    """
+    Gets the book moves of the side to move that are legal on the board.
+
+    Returns: list of (move, weight), empty if the position is not in the book
+    """
+    def moves(self, board):
+        key = book_key(board)
+        legal = None
+        moves = []
+        i = self.find(key)
+        while i < self.size:
+            entry_key, move, weight, learn = entry_format.unpack_from(self.data, i * entry_format.size)
+            if entry_key != key:
+                break
+            # Keys can collide, so only moves that are legal here count
+            if legal == None:
+                legal = set(board.generate_moves(board.turn))
+            move = turn_move(board, move)
+            if move in legal:
+                moves.append((move, weight))
+            i += 1
+        return moves
+
+    """
+    Picks a book move at random, each move as likely as its weight.
+
+    Returns: the move, or None if the position is not in the book
+    """
+    def choose(self, board, rng = random):
+        moves = self.moves(board)
+        if len(moves) == 0:
+            return None
+        return rng.choices([move for move, weight in moves], [weight for move, weight in moves])[0]
+
+    def close(self):
+        if self.size != 0:
+            self.data.close()
+        self.file.close()
+
+
+"""
+Counts the moves of the games in the first plies half moves.
+
+Parameters: lines -> the games as lists of SAN moves
+Returns: Counter of (key, move) from the white team's perspective
+"""
+def count_moves(lines, plies):
+    counts = Counter()
+    board = chess.ChessBoard(team = "white")
+    for line in lines:
+        board.load_fen(chess.start_fen)
+        for san in line[:plies]:
+            move = board.parse_san(san)
+            if move == None:
+                break
+            counts[(board.key, move)] += 1
+            board.make_move(move)
+    return counts
+
+"""
+Writes the counted moves as a book file, sorted by key.
+"""
+def write(path, counts):
+    with open(path, "wb") as file:
+        for (key, move), weight in sorted(counts.items()):
+            file.write(entry_format.pack(key, move, min(weight, 0xFFFF), 0))
+    return len(counts)
+
+
+if __name__ == "__main__":
+    import ingest
+
+    parser = argparse.ArgumentParser(description = "build an opening book from PGN files")
+    parser.add_argument("path", help = "the book file to write")
+    parser.add_argument("games", nargs = "*", help = "PGN files (optionally gzipped) to take the openings from")
+    parser.add_argument("--plies", type = int, default = 16, help = "the half moves of each game to keep")
+    args = parser.parse_args()
+
+    lines = [opening.split() for opening in OPENINGS]
+    counts = count_moves(lines, args.plies)
+    for path in args.games:
+        games = ingest.read_games(ingest.read_lines(path))
+        counts.update(count_moves((ingest.san_moves(movetext)[0] for tags, movetext in games), args.plies))
+    print(f"[BOOK] {write(args.path, counts)} entries written to {args.path}")
@@ -1,7 +1,13 @@
 from cmath import pi
+from enum import Enum
 from operator import index
 from PIL import Image, ImageTk
-import copy
+import re
+import bitboard
+import evaluation
+import metrics
+import zobrist
+from bitboard import squares, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, UP, DOWN
 
 piece_to_string = {
     ("black", "rook"): "r",
@@ -23,30 +29,170 @@ team = {
     "white": "black"
 }
 
+"""
+Piece codes of the array board. Every square of ChessBoard.board is a single byte:
+the lower three bits hold the piece type, bit 3 holds the colour and bit 4 is set once the piece has moved
+(the inverse of the Piece "untouched" flag). An empty square is 0.
+"""
+EMPTY = 0
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+
+BLACK = 0
+WHITE = 8
+MOVED = 16
+
+type_to_code = {
+    "pawn": PAWN,
+    "knight": KNIGHT,
+    "bishop": BISHOP,
+    "rook": ROOK,
+    "queen": QUEEN,
+    "king": KING
+}
+code_to_type = {code: type for type, code in type_to_code.items()}
+
+colour_to_code = {
+    "black": BLACK,
+    "white": WHITE
+}
+code_to_colour = {code: colour for colour, code in colour_to_code.items()}
+
+string_to_code = {"~": EMPTY}
+for (colour, type), char in piece_to_string.items():
+    string_to_code[char] = type_to_code[type] | colour_to_code[colour]
+code_to_string = {code: char for char, code in string_to_code.items()}
+
+"""
+Translation tables of the board codec, so a whole board is converted by one bytes.translate call. BOARD_TO_STRING
+gives the letter of every byte of an array board (the moved flag is dropped) and STRING_TO_BOARD the piece code of
+every letter, or INVALID for bytes that are not a letter of the board string.
+"""
+INVALID = 255
+BOARD_TO_STRING = bytes(ord(code_to_string.get(i & ~MOVED, "~")) for i in range(256))
+STRING_TO_BOARD = bytes(string_to_code.get(chr(i), INVALID) for i in range(256))
+
+"""
+Converts an array board into the board string, and back. With flip the board is turned around for the other
+perspective (index i becomes 63 - i), which is a reverse of the bytes.
+
+Raises: ValueError if the string is not 64 letters of a board string
+"""
+def encode_board(board, flip = False):
+    if flip:
+        board = board[::-1]
+    return board.translate(BOARD_TO_STRING).decode("ascii")
+
+def decode_board(string, flip = False):
+    board = bytearray(string.encode("ascii").translate(STRING_TO_BOARD))
+    if len(board) != 64 or INVALID in board:
+        raise ValueError(f"invalid board string {string!r}")
+    if flip:
+        board.reverse()
+    return board
+
+"""
+Turns an array board around for the other team's perspective, without making any objects but the new array.
+"""
+def flip_board(board):
+    return board[::-1]
+
+promotions = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+# Entries of the move cache of boards that opt in to it (see ChessBoard.generate_moves)
+MOVE_TABLE_SIZE = 1 << 14
+
+# The piece letters of Standard Algebraic Notation
+san_pieces = {"N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING}
+
+# The start position from the white team's perspective
+start_string = "rkbqlbkrpppppppp~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PPPPPPPPRKBQLBKR"
+start_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+fen_to_string = {
+    "r": "r", "n": "k", "b": "b", "q": "q", "k": "l", "p": "p",
+    "R": "R", "N": "K", "B": "B", "Q": "Q", "K": "L", "P": "P"
+}
+# str.translate tables between the board field of a FEN and the board string: digits become that many empty squares
+FEN_TO_STRING = str.maketrans({**fen_to_string, "/": "", **{str(n): "~" * n for n in range(1, 9)}})
+STRING_TO_FEN = str.maketrans({value: key for key, value in fen_to_string.items()})
+EMPTY_RUN = re.compile("~+")
+
+
+"""
+Converts between the (x, y) coordinates used by the Piece objects and the index of the square
+in the board string and array board. Index 0 is (8,8) and index 63 is (1,1).
+"""
+def square(coords):
+    return (8 - coords[1]) * 8 + 8 - coords[0]
+
+def coords_of(square):
+    return (8 - square % 8, 8 - square // 8)
+
+# The coordinates of every square by its index, made once so the Piece objects and positions share the tuples
+COORDS = tuple(coords_of(i) for i in range(64))
+
+"""
+Moves are stored as integers: the start square in bits 0-5, the end square in bits 6-11
+and the type the pawn is promoted to (or EMPTY) in bits 12-14.
+"""
+def encode_move(start, end, promotion = EMPTY):
+    return start | end << 6 | promotion << 12
+
+def decode_move(move):
+    return move & 63, move >> 6 & 63, move >> 12
+
+
+"""
+Piece types and colours of the Piece objects, as enums of the old names ("knight", "black"). They are str
+subclasses, so ==, != and hash are those of the names and they still work wherever the names did (e.g. as keys of
+type_to_code and colour_to_code, or p.get_colour() == board.team), and there is one shared object for each.
+"""
+class PieceType(str, Enum):
+    PAWN = "pawn"
+    KNIGHT = "knight"
+    BISHOP = "bishop"
+    ROOK = "rook"
+    QUEEN = "queen"
+    KING = "king"
+
+    def __str__(self):
+        return self.value
+
+class Colour(str, Enum):
+    BLACK = "black"
+    WHITE = "white"
+
+    def __str__(self):
+        return self.value
+
+# Looked up by the bits of the piece code, which is quicker than PieceType(code)
+code_to_piece_type = (None,) + tuple(PieceType)
+code_to_piece_colour = (Colour.BLACK,) * 8 + (Colour.WHITE,)
 
 """
 Piece Class covers the chess pieces of the board.
 Parameters:
 position -> the x and y coordiantes of the chess piece
-type -> the type of chess piece (e.g. knight, rook queen)
-colour -> the colour of the chess piece (black or white)
+type -> the PieceType of chess piece (e.g. knight, rook queen)
+colour -> the Colour of the chess piece (black or white)
 """
 class Piece():
     """
-    Pieces have an "untouched" flag to cater for special rules in the chessboard such as Castling 
+    Pieces have an "untouched" flag to cater for special rules in the chessboard such as Castling
     and the pawn moving 2 spaces ahead if untouched.
     """
+    __slots__ = ("position", "type", "colour", "untouched")
 
     def __init__(self, position, type, colour):
         self.position = position
-        self.id = "Piece"
         self.type = type
         self.colour = colour
         self.untouched = True
-        if type == "Entity":
-            self.piece = False
-        else:
-            self.piece = True
 
 
     def get_position(self):
@@ -57,28 +203,113 @@ class Piece():
 
     def get_type(self):
         return self.type
-    
+
     def get_colour(self):
         return self.colour
 
     def get_id(self):
-        return self.id
+        return "Piece"
 
     def get_untouched(self):
         return self.untouched
 
     def set_untouched(self):
         self.untouched = False
-    
+
     def is_piece(self):
-        return self.piece
-    
+        return True
+
     def __repr__(self):
-        return "Piece(" + str(self.position) + ", " + self.type + ", " + self.colour + ")"
-    
+        return "Piece(" + str(self.position) + ", " + str(self.type) + ", " + str(self.colour) + ")"
+
     def __hash__(self) -> int:
         return hash((self.position, self.type, self.colour, self.untouched))
 
+"""
+Empty class is the "Entity" placeholder of an empty square. It holds nothing, so every empty square shares the
+one EMPTY_SQUARE object.
+"""
+class Empty():
+    __slots__ = ()
+
+    def get_position(self):
+        return None
+
+    def get_type(self):
+        return "Entity"
+
+    def get_colour(self):
+        return "neutral"
+
+    def get_id(self):
+        return "Piece"
+
+    def get_untouched(self):
+        return True
+
+    def is_piece(self):
+        return False
+
+    def __repr__(self):
+        return "Empty()"
+
+EMPTY_SQUARE = Empty()
+
+"""
+PiecePool class keeps Piece objects to be filled in again for every board decoded into it (see list_from_board),
+so redrawing a board makes no new objects. The Piece objects given out are only valid until the next board.
+"""
+class PiecePool():
+
+    def __init__(self):
+        self.pieces = []
+
+    """
+    Fills in the nth Piece object of the pool with the code on the square, making it the first time.
+    """
+    def get(self, n, index, code):
+        if n == len(self.pieces):
+            self.pieces.append(Piece(None, None, None))
+        piece = self.pieces[n]
+        piece.position = COORDS[index]
+        piece.type = code_to_piece_type[code & 7]
+        piece.colour = code_to_piece_colour[code & WHITE]
+        piece.untouched = not code & MOVED
+        return piece
+
+"""
+Pins class holds the pinned pieces of one side, with the squares each of them can still move to (along the line
+between its king and the pinning piece). Squares that are not pinned can move anywhere.
+"""
+class Pins():
+
+    def __init__(self):
+        self.masks = {}
+        self.keys_mask = 0
+
+    def add(self, index, mask):
+        self.masks[index] = mask
+        self.keys_mask |= 1 << index
+
+    def get(self, index):
+        return self.masks.get(index, bitboard.FULL)
+
+"""
+PieceMoves class holds the legal moves of one side by the square of the piece that makes them, with the position
+they were generated in (its key, bitboards and en passant square), so ChessBoard.update_piece_moves can tell which
+pieces a change could affect and only those are generated again.
+"""
+class PieceMoves():
+
+    def __init__(self):
+        self.key = None
+        self.bitboards = None
+        self.en_passant = None
+        self.in_check = False
+        # The squares whose moves are not in moves, as they may have changed since
+        self.stale = bitboard.FULL
+        self.moves = {}
+
 """
 ChessBoard class covers the board and the tiles on it
 """
@@ -88,127 +319,433 @@ class ChessBoard:
     The reason for this compact representation is for ease of transmitting the information to the server and other players.
     It also makes it easy for both players having different perspecitves of the board, where they are "facing" each other.
 
-    Client-side, the board is represented as a list of Piece objects. From the Client's perspective, all the objects on the left corner
-    start from (8,1) and the objects on the right corner are (1,1). This is the same for every client, and the board just gets inverted
-    whenever it is sent.
+    Client-side, the board is a 64 byte array of piece codes in the same order as the string, so every square is
+    looked up directly by its index. Piece objects are only created on demand (get_piece, list_from_board) for the GUI.
+    Next to it the board is kept as bitboards, one per piece code, which the move generation works on.
+    From the Client's perspective, all the objects on the left corner start from (8,1) and the objects on the right
+    corner are (1,1). This is the same for every client, and the board just gets inverted whenever it is sent.
+
+    Parameters:
+    string -> the board string to start from, the start position (inverted for the black team) if not given
+    team -> the colour of this client, which plays up the board
     """
-    def __init__(self):
-        #self.string = "rkbqlbkrpppppppp~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~PPPPPPPPRKBqLBKR"
-        self.string = "~~~rr~l~~pqk~pp~~~~~~~~p~~p~~~~~p~~kKK~QP~~P~~~~PPP~~~PP~L~r~~~~"
-        self.board = []
-        self.team = "white"
+    def __init__(self, string = None, team = "white"):
+        if string == None:
+            string = start_string
+            if team == "black":
+                string = string[::-1]
+        self.string = string
+        self.team = team
+        self.turn = "white"
+        self.move_table = None
+        self.piece_moves = {BLACK: PieceMoves(), WHITE: PieceMoves()}
+        self.board = bytearray(64)
         self.selected = None
         self.check = False
         self.checkmate = False
-        self.pieces = []
         self.convert_from_string()
 
-    def hash_index(self, code, board = None):
-        if board == None:
-            board = self.board
-        count = 0
-        for i in board:
-            if hash(i) == code:
-                return count
-            count += 1
+    """
+    The bitboards are derived from the array board, so they are rebuilt whenever a new board is assigned.
+    A new board also starts a new history for make_move/unmake_move. The square of each king is cached in
+    self.kings (-1 when there is no king), the Zobrist key of the position in self.key and the number of each
+    piece and the evaluation (see build_evaluation). They are all kept up to date by make_move/unmake_move.
+    """
+    @property
+    def board(self):
+        return self._board
+
+    @board.setter
+    def board(self, board):
+        self._board = board
+        self.bitboards = self.build_bitboards(board)
+        self.kings = {
+            BLACK: self.bitboards[KING | BLACK].bit_length() - 1,
+            WHITE: self.bitboards[KING | WHITE].bit_length() - 1
+        }
+        self.history = []
+        self.en_passant = None
+        self.castling = self.castling_rights(board)
+        self.key = self.build_key()
+        self.build_evaluation()
+
+    """
+    Builds the bitboards of the array board. They are indexed by piece code without the moved flag, the unused
+    codes BLACK and WHITE (a colour without a type) hold all the pieces of that colour.
+
+    Returns: list of 16 bitboards
+    """
+    def build_bitboards(self, board):
+        bitboards = [0] * 16
+        for i in range(64):
+            if board[i] != EMPTY:
+                bitboards[board[i] & 15] |= 1 << i
+                bitboards[board[i] & WHITE] |= 1 << i
+        return bitboards
+
+    def bitboards_for(self, board):
+        if board is self.board:
+            return self.bitboards
+        return self.build_bitboards(board)
+
+    """
+    Gets the castling rights of the board from the untouched flags: bit i is set when the rook on
+    zobrist.CORNERS[i] and the king on the same row have not moved yet.
+    """
+    def castling_rights(self, board):
+        rights = 0
+        for i in range(4):
+            rook = board[zobrist.CORNERS[i]]
+            if rook & ~WHITE == ROOK:
+                row = zobrist.CORNERS[i] - zobrist.CORNERS[i] % 8
+                if (KING | (rook & WHITE)) in board[row:row + 8]:
+                    rights |= 1 << i
+        return rights
+
+    """
+    Computes the Zobrist key of the position from scratch, make_move/unmake_move update it as they go.
+    """
+    def build_key(self):
+        key = zobrist.CASTLING[self.castling]
+        for i in range(64):
+            if self._board[i] != EMPTY:
+                key ^= zobrist.PIECES[self._board[i] & 15][i]
+        if self.turn == "black":
+            key ^= zobrist.SIDE
+        if self.team == "black":
+            key ^= zobrist.BLACK_TEAM
+        if self.en_passant != None:
+            key ^= zobrist.EN_PASSANT[COORDS[self.en_passant][0]]
+        return key
+
+    """
+    Counts the pieces by code and adds up their middlegame and endgame values and the phase of the game,
+    which put_piece and remove_piece then keep up to date.
+    """
+    def build_evaluation(self):
+        self.mg_table, self.eg_table = evaluation.TABLES[self.team]
+        self.counts = [0] * 16
+        self.mg = 0
+        self.eg = 0
+        self.phase = 0
+        for i in range(64):
+            if self._board[i] != EMPTY:
+                piece = self._board[i] & 15
+                self.counts[piece] += 1
+                self.mg += self.mg_table[piece][i]
+                self.eg += self.eg_table[piece][i]
+                self.phase += evaluation.PHASES[piece & 7]
+
+    """
+    Evaluates the position by material and piece placement.
 
+    Returns: the score in centipawns for the side to move
+    """
+    def evaluate(self):
+        score = evaluation.taper(self.mg, self.eg, self.phase)
+        if self.turn == "black":
+            return -score
+        return score
 
     """
-    Convert the string to a list of Entity and Piece Objects
+    Gets the number of pieces of the type and colour on the board.
+    """
+    def piece_count(self, type, colour):
+        return self.counts[type_to_code[type] | colour_to_code[colour]]
+
+    """
+    Gets the direction the pawns of the given colour code move in, the own team always plays up the board.
+    """
+    def direction(self, colour):
+        if colour == colour_to_code[self.team]:
+            return UP
+        return DOWN
+
+    """
+    Convert the string to the array board
     """
     def convert_from_string(self):
-        x = 8
-        y = 8
-        colour = "black"
-        type = "Entity"
-        board = []
-        for i in self.string:
-            if i.isupper():
-                colour = "white"
-            else:
-                colour = "black"
-            if i.lower() == "r":
-                type = "rook"
-            elif i.lower() == "k":
-                type = "knight"
-            elif i.lower() == "b":
-                type = "bishop"
-            elif i.lower() == "q":
-                type = "queen"
-            elif i.lower() == "l":
-                type = "king"
-            elif i.lower() == "p":
-                type = "pawn"
-            else:
-                type = "Entity"
-                colour = "neutral"
-            if colour == self.team:
-                self.pieces.append(Piece((x,y), type, colour))
-            board.append(Piece((x,y), type, colour))
-            x -= 1
-
-            if x < 1:
-                x = 8
-                y -= 1
+        self.board = decode_board(self.string)
+
+    """
+    Loads a position in Forsyth-Edwards Notation, seen from the perspective of this team. The side to move,
+    castling rights and en passant square of the FEN are kept: kings and rooks without castling rights and pawns
+    off their starting row are marked as moved.
+
+    Parameters: fen -> the FEN string, the fields after the board are optional
+    """
+    def load_fen(self, fen):
+        fields = fen.split()
+        board = decode_board(fields[0].translate(FEN_TO_STRING), self.team == "black")
+        string = encode_board(board)
+        for i in range(64):
+            type = board[i] & 7
+            if type == KING or type == ROOK:
+                board[i] |= MOVED
+            elif type == PAWN and not (8 <= i < 16 or 48 <= i < 56):
+                board[i] |= MOVED
+        castling = "-"
+        if len(fields) > 2:
+            castling = fields[2]
+        for i in castling.replace("-", ""):
+            corner = self.square_index({"K": "h1", "Q": "a1", "k": "h8", "q": "a8"}[i])
+            board[corner] &= ~MOVED
+            row = corner - corner % 8
+            for j in range(row, row + 8):
+                if board[j] & 7 == KING:
+                    board[j] &= ~MOVED
+
+        self.string = string
+        if len(fields) > 1 and fields[1] == "b":
+            self.turn = "black"
+        else:
+            self.turn = "white"
         self.board = board
+        if len(fields) > 3 and fields[3] != "-":
+            self.en_passant = self.square_index(fields[3])
+            self.key = self.build_key()
+
+    """
+    Gets the position in Forsyth-Edwards Notation, the opposite of load_fen. The move counters are not kept,
+    so they are always 0 1.
+    """
+    def to_fen(self):
+        string = encode_board(self.board, self.team == "black").translate(STRING_TO_FEN)
+        # Runs of empty squares are written as their length
+        rows = [EMPTY_RUN.sub(lambda run: str(len(run.group())), string[y * 8:y * 8 + 8]) for y in range(8)]
+
+        castling = ""
+        for name, letter in (("h1", "K"), ("a1", "Q"), ("h8", "k"), ("a8", "q")):
+            if self.castling & 1 << zobrist.CORNERS.index(self.square_index(name)):
+                castling += letter
+        en_passant = "-"
+        if self.en_passant != None:
+            en_passant = self.square_name(self.en_passant)
+        return f"{'/'.join(rows)} {self.turn[0]} {castling or '-'} {en_passant} 0 1"
+
+    """
+    Pickles the board as its array board and the state that goes with it, instead of the derived bitboards
+    and caches, so it is cheap to send to another process.
+    """
+    def __getstate__(self):
+        return {
+            "board": bytes(self.board),
+            "team": self.team,
+            "turn": self.turn,
+            "en_passant": self.en_passant,
+            "string": self.string
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["string"], state["team"])
+        self.turn = state["turn"]
+        self.board = bytearray(state["board"])
+        self.en_passant = state["en_passant"]
+        self.key = self.build_key()
+
+    """
+    Sets the side to move, keeping the Zobrist key in step.
+    """
+    def set_turn(self, turn):
+        if turn != self.turn:
+            self.turn = turn
+            self.key ^= zobrist.SIDE
+
+    """
+    Converts between the index of a square and its name in algebraic notation (e.g. e4), which depends on
+    the perspective of this team.
+    """
+    def square_name(self, index):
+        if self.team == "black":
+            index = 63 - index
+        return "abcdefgh"[index % 8] + str(8 - index // 8)
+
+    def square_index(self, name):
+        index = (8 - int(name[1])) * 8 + "abcdefgh".index(name[0])
+        if self.team == "black":
+            index = 63 - index
+        return index
 
     """
-    Converts the list of Piece and Entity Objects into string format
+    Gets the move in coordinate notation (e.g. e2e4, or e7e8q for a promotion).
+    """
+    def move_name(self, move):
+        start, end, promotion = decode_move(move)
+        name = self.square_name(start) + self.square_name(end)
+        if promotion != EMPTY:
+            name += "nbrq"[promotion - KNIGHT]
+        return name
+
+    """
+    Finds the legal move of the side to move from its coordinate notation (see move_name). A pawn reaching
+    the last row without a promotion letter is promoted to a queen.
+
+    Returns: the move, or None if it is not a legal move
+    """
+    @metrics.timed("chess_parse_move_seconds", "parsing and checking the moves sent by the players")
+    def parse_move(self, name):
+        if len(name) not in (4, 5) or name[0] not in "abcdefgh" or name[2] not in "abcdefgh" \
+            or name[1] not in "12345678" or name[3] not in "12345678":
+            return None
+        start = self.square_index(name[0:2])
+        end = self.square_index(name[2:4])
+        promotion = QUEEN
+        if len(name) == 5:
+            if name[4] not in "nbrq":
+                return None
+            promotion = "nbrq".index(name[4]) + KNIGHT
+        if self.board[start] & WHITE != colour_to_code[self.turn]:
+            return None
+        for move in self.moves_from(start):
+            if move & 63 == start and move >> 6 & 63 == end and move >> 12 in (EMPTY, promotion):
+                return move
+        return None
+
+    """
+    Finds the legal move of the side to move from its Standard Algebraic Notation (e.g. Nf3, exd5, e8=Q, O-O),
+    as used by PGN files. Check and annotation marks at the end are ignored.
+
+    Returns: the move, or None if it is not a legal move or not SAN
+    """
+    def parse_san(self, san):
+        san = san.rstrip("+#!?")
+        moves = self.generate_moves(self.turn)
+        board = self.board
+        if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            file = "g" if len(san) == 3 else "c"
+            for move in moves:
+                name = self.move_name(move)
+                if board[move & 63] & 7 == KING and name[2] == file and abs(ord(name[0]) - ord(name[2])) == 2:
+                    return move
+            return None
+
+        promotion = EMPTY
+        if len(san) > 2 and san[-2] == "=":
+            promotion = san_pieces.get(san[-1], EMPTY)
+            san = san[:-2]
+        elif len(san) > 2 and san[-1] in "NBRQ" and san[-2] in "18":
+            promotion = san_pieces[san[-1]]
+            san = san[:-1]
+        type = PAWN
+        if len(san) > 0 and san[0] in san_pieces:
+            type = san_pieces[san[0]]
+            san = san[1:]
+        san = san.replace("x", "")
+        if len(san) < 2 or san[-2] not in "abcdefgh" or san[-1] not in "12345678":
+            return None
+        end = self.square_index(san[-2:])
+        # What is left are the file and/or rank of the start square, when the move needs them
+        hint = san[:-2]
+
+        for move in moves:
+            if move >> 6 & 63 != end or board[move & 63] & 7 != type:
+                continue
+            if move >> 12 != promotion and not (promotion == EMPTY and move >> 12 == QUEEN):
+                continue
+            start = self.square_name(move & 63)
+            if all(char in start for char in hint):
+                return move
+        return None
+
+    """
+    Counts the leaf nodes of the move tree of the side to move down to the given depth.
+    The counts of standard positions are well known, which makes this a check of the move generation.
+
+    Parameters: depth -> the number of half moves to play
+    Returns: the number of positions at that depth
+    """
+    def perft(self, depth):
+        moves = self.generate_moves(self.turn)
+        if depth <= 1:
+            if depth == 1:
+                return len(moves)
+            return 1
+        nodes = 0
+        for move in moves:
+            self.make_move(move)
+            nodes += self.perft(depth - 1)
+            self.unmake_move()
+        return nodes
+
+    """
+    Splits the perft count over the moves of the side to move, to find which move a wrong count comes from.
+
+    Returns: dictionary of the move names and their perft counts at depth - 1
+    """
+    def divide(self, depth):
+        counts = {}
+        for move in self.generate_moves(self.turn):
+            self.make_move(move)
+            counts[self.move_name(move)] = self.perft(depth - 1)
+            self.unmake_move()
+        return counts
+
+    """
+    Converts the array board into string format
     """
     def convert_to_string(self, board = None):
         if board == None:
             board = self.board
-        string = ""
-        for i in board:
-            if i.get_type() == "Entity":
-                string += "~"
-            else:
-                string += piece_to_string[(i.get_colour(), i.get_type())]
-
-        return string
+        return encode_board(board)
 
     def convert_to_readable(self, board = None):
         if board == None:
             board = self.board
-        string = ""
-        count = 1
-        for i in board:
-            if (count-1)%8 == 0:
-                string+= "\n"
-            if i.get_type() == "Entity":
-                string += "~"
-            else:
-                string += piece_to_string[(i.get_colour(), i.get_type())]
-            count += 1
+        string = encode_board(board)
+        return "".join(["\n" + string[i:i+8] for i in range(0, 64, 8)])
+
+    """
+    Creates the Piece object for the code stored at the given square.
 
-        return string
+    Parameters: index -> the index of the square in the array board
+                code -> the piece code on that square
+    Returns: the shared EMPTY_SQUARE or a Piece object
+    """
+    def piece_from_code(self, index, code):
+        if code == EMPTY:
+            return EMPTY_SQUARE
+        piece = Piece(COORDS[index], code_to_piece_type[code & 7], code_to_piece_colour[code & WHITE])
+        if code & MOVED:
+            piece.set_untouched()
+        return piece
 
-    def list_from_board(self, board = None):
+    """
+    The Piece objects of this team, made when they are asked for rather than kept up to date with every move.
+    """
+    @property
+    def pieces(self):
+        return self.list_from_board()
+
+    """
+    Gets the Piece objects of this team on the board. With a PiecePool the pool's objects are filled in instead of
+    making new ones.
+    """
+    def list_from_board(self, board = None, pool = None):
         pieces = []
         if board == None:
             board = self.board
+        colour = colour_to_code[self.team]
 
-        for i in board:
-            if i.colour == self.team:
-                pieces.append(i)
+        for i in range(64):
+            if board[i] != EMPTY and board[i] & WHITE == colour:
+                if pool == None:
+                    pieces.append(self.piece_from_code(i, board[i]))
+                else:
+                    pieces.append(pool.get(len(pieces), i, board[i]))
 
         return pieces
 
     """
     Gets the specific Entity or Piece Object from the coordinates specified.
-    
+
     Parameters: coords -> the coordinates in tuple form
     Returns: Entity or Piece object
     """
     def get_piece(self, coords, board = None):
         if board == None:
             board = self.board
-        x = coords[0]
-        y = coords[1]
-
-        for i in board:
-            if i.get_position()[0] == x and i.get_position()[1] == y:
-                return i
+        index = square(coords)
+        return self.piece_from_code(index, board[index])
 
     """
     Gets Piece objects by type
@@ -219,338 +756,689 @@ class ChessBoard:
     def get_pieces_by_type(self, type, colour, board = None):
         if board == None:
             board = self.board
+        code = type_to_code[type] | colour_to_code[colour]
         pieces = []
-        for i in board:
-            if i.get_type() == type and i.get_colour() == colour:
-                pieces.append(i)
+        for i in squares(self.bitboards_for(board)[code]):
+            pieces.append(self.piece_from_code(i, board[i]))
 
         return pieces
-        
+
     """
-    Gets all the possible movable positions of the specified position. Bad positions
-    are pruned out using prune_possible_positions().
+    Gets all the possible movable positions of the specified position. With prune the positions
+    are taken from the legal moves (moves_from for this board, generate_moves for others), so moves that leave
+    the king in check are left out.
     Special rules such as Castling and Pawn diagonal piece taking are covered here.
 
     Parameters: piece -> A Piece Object of the Chess board
     Returns: a list of the possible positions that the piece can go.
     """
+    @metrics.timed("chess_get_positions_seconds", "the squares a clicked piece can move to")
     def get_positions(self, piece, board = None, prune = False):
         if board == None:
             board = self.board
-        type = piece.get_type()
-        coords = piece.get_position()
-        possible = []
-
-        if type == "knight":
-            possible.append((coords[0]+1, coords[1]+2))
-            possible.append((coords[0]-1, coords[1]+2))
-            possible.append((coords[0]+2, coords[1]+1))
-            possible.append((coords[0]+2, coords[1]-1))
-            possible.append((coords[0]-2, coords[1]+1))
-            possible.append((coords[0]-2, coords[1]-1))
-            possible.append((coords[0]-1, coords[1]-2))
-            possible.append((coords[0]+1, coords[1]-2))
-        elif type == "bishop":
-            possible += self.diagonal_expansion(piece, board)
-        elif type == "rook":
-            possible += self.perpendicular_expansion(piece, board)
-        elif type == "queen":
-            possible += self.perpendicular_expansion(piece, board)
-            possible += self.diagonal_expansion(piece, board)
-        elif type == "king":
-            possible.append((coords[0]+1, coords[1]+1))
-            possible.append((coords[0]+1, coords[1]-1))
-            possible.append((coords[0]-1, coords[1]+1))
-            possible.append((coords[0]-1, coords[1]-1))
-            possible.append((coords[0]+1, coords[1]))
-            possible.append((coords[0]-1, coords[1]))
-            possible.append((coords[0], coords[1]+1))
-            possible.append((coords[0], coords[1]-1))
-
-            # Conditions for the "Castling" special move.
-            
-            if self.check == False and self.get_pieces_by_type("king", self.team, board)[0].get_untouched() == True:
-                    possible += self.castling_possible_positions(coords, board)
-            
-        elif type == "pawn":
-            if self.team != piece.get_colour():
-                if self.get_piece((coords[0], coords[1]-1)).piece == False:
-                    possible.append((coords[0], coords[1]-1))
-                    if piece.get_untouched() == True:
-                        possible.append((coords[0], coords[1]-2))
-
-                #Check if the future coords are out of bounds or not
-                if 0 < coords[0]+1 < 9 and 0 < coords[1]-1 < 9 and self.get_piece((coords[0]+1, coords[1]-1), board).is_piece():
-                    if team[self.get_piece((coords[0]+1, coords[1]-1), board).get_colour()] == piece.get_colour():
-                        possible.append((coords[0]+1, coords[1]-1))
-                if 0 < coords[0]-1 < 9 and 0 < coords[1]-1 < 9 and self.get_piece((coords[0]-1, coords[1]-1), board).is_piece():
-                    if team[self.get_piece((coords[0]-1, coords[1]-1), board).get_colour()] == piece.get_colour():
-                        possible.append((coords[0]-1, coords[1]-1))
-            else:
-                if self.get_piece((coords[0], coords[1]+1), board).piece == False:
-                    possible.append((coords[0], coords[1]+1))
-                    if piece.get_untouched() == True:
-                        possible.append((coords[0], coords[1]+2))
-
-                if 0 < coords[0]+1 < 9 and 0 < coords[1]+1 < 9 and self.get_piece((coords[0]+1, coords[1]+1), board).is_piece():
-                    if team[self.get_piece((coords[0]+1, coords[1]+1), board).get_colour()] == piece.get_colour():
-                        possible.append((coords[0]+1, coords[1]+1))
-                if 0 < coords[0]-1 < 9 and 0 < coords[1]+1 < 9 and self.get_piece((coords[0]-1, coords[1]+1), board).is_piece():
-                    if team[self.get_piece((coords[0]-1, coords[1]+1), board).get_colour()] == piece.get_colour():
-                        possible.append((coords[0]-1, coords[1]+1))
-
-
-        if len(possible) != 0:
-            pruned_possible = []
-            
-            for i in possible:
-                if 0 < i[0] < 9 and 0 < i[1] < 9 and self.get_piece(i, board).get_colour() != piece.get_colour():
-                    pruned_possible.append(i)
-            possible = pruned_possible
+        # An empty square has no moves
+        if piece is EMPTY_SQUARE:
+            return []
+        start = square(piece.get_position())
         if prune == True:
-            possible = self.prune_checks(piece, possible, board)
+            possible = []
+            if board is self.board:
+                moves = self.moves_from(start)
+            else:
+                moves = self.generate_moves(code_to_colour[board[start] & WHITE], board)
+            for move in moves:
+                if move & 63 == start and COORDS[move >> 6 & 63] not in possible:
+                    possible.append(COORDS[move >> 6 & 63])
+        else:
+            possible = [COORDS[i] for i in self.get_targets(start, board)]
+
+        return possible
+
+    """
+    Gets the squares that the piece on the given square can move to, ignoring checks.
+
+    Parameters: index -> the index of the square in the array board
+                board -> the array board in question
+    Returns: a list of square indexes
+    """
+    def get_targets(self, index, board):
+        bitboards = self.bitboards_for(board)
+        code = board[index]
+        type = code & 7
+        colour = code & WHITE
+        occupied = bitboards[BLACK] | bitboards[WHITE]
+
+        if type == KNIGHT:
+            attacks = KNIGHT_ATTACKS[index]
+        elif type == BISHOP:
+            attacks = bitboard.bishop_attacks(index, occupied)
+        elif type == ROOK:
+            attacks = bitboard.rook_attacks(index, occupied)
+        elif type == QUEEN:
+            attacks = bitboard.queen_attacks(index, occupied)
+        elif type == KING:
+            attacks = KING_ATTACKS[index]
+        elif type == PAWN:
+            direction = self.direction(colour)
+            attacks = PAWN_ATTACKS[direction][index] & bitboards[colour ^ WHITE]
+            single = bitboard.pawn_push(1 << index, direction) & ~occupied
+            attacks |= single
+            if not code & MOVED:
+                attacks |= bitboard.pawn_push(single, direction) & ~occupied
+        else:
+            return []
+
+        possible = list(squares(attacks & ~bitboards[colour]))
+
+        # Conditions for the "Castling" special move.
+
+        if type == KING and self.check == False and not code & MOVED:
+            possible += self.castling_possible_positions(index, board)
 
         return possible
-        
 
+    """
+    Generates every legal move of one side in a single pass over its bitboards.
+    Pawns reaching the last row get one move for each piece they can be promoted to.
+
+    Instead of playing every move to see if it leaves the king in check, the pinned pieces and the squares
+    that stop a check are worked out once: a pinned piece may only move along its pin, in check the other
+    pieces may only take the checking piece or block it, and the king may only go to squares not attacked.
+
+    Boards that search the same positions many times (search.Search, perft.py) cache their moves in
+    self.move_table by the Zobrist key, so a position that comes up again is not generated twice. The cache is
+    opt-in: it is a zobrist.TranspositionTable of MOVE_TABLE_SIZE entries (about half a megabyte) set by the caller,
+    so the short lived boards of the workers and the one board of every game on the server stay small.
 
+    Parameters: colour -> the side to generate the moves for, this team if not given
+                board -> the array board in question
+    Returns: a list of moves (see encode_move)
     """
-    Gets all the possible positions if the castling special move is movable. Specified for both teams.
+    def generate_moves(self, colour = None, board = None):
+        if colour == None:
+            colour = self.team
+        if board == None:
+            board = self.board
+        if board is self.board and self.move_table != None:
+            key = self.key
+            if colour != self.turn:
+                key ^= zobrist.SIDE
+            moves = self.move_table.probe(key)
+            if moves == None:
+                moves = self.legal_moves(colour, board)
+                self.move_table.store(key, 0, moves)
+            return list(moves)
+        return self.legal_moves(colour, board)
 
-    Parameters: coords -> the coordinates of the piece in question
-    Returns: the possible castling positions of the king
     """
-    def castling_possible_positions(self, coords, board):
-        possible = []
-        castling_flag_left = True
-        castling_flag_right = True
-        if self.team == "black":
-            for i in [2,3,4]:
-                if self.get_piece((i,1), board).get_type() != "Entity":
-                    castling_flag_left = False
-            for i in [6,7]:
-                if self.get_piece((i,1), board).get_type() != "Entity":
-                    castling_flag_right = False
-                
+    Brings the cached moves of one side up to the position on the board: the pieces whose moves a change could
+    affect (see stale_pieces) are marked stale and their moves dropped. They are only generated again when they
+    are asked for, by moves_by_piece, moves_from or has_moves.
+
+    Returns: the PieceMoves of the side
+    """
+    def update_piece_moves(self, own):
+        cache = self.piece_moves[own]
+        if cache.key == self.key and cache.en_passant == self.en_passant:
+            return cache
+        bitboards = self.bitboards
+        occupied = bitboards[BLACK] | bitboards[WHITE]
+        king = self.kings[own]
+        in_check = king != -1 and self.attacked(king, own ^ WHITE, bitboards, occupied)
+        # A check limits every piece, so then (and on the way out of one) all of them are stale
+        if cache.bitboards == None or in_check or cache.in_check:
+            cache.stale = bitboard.FULL
+            cache.moves = {}
+        else:
+            stale = self.stale_pieces(own, cache, occupied)
+            for start in squares(stale & ~cache.stale):
+                cache.moves.pop(start, None)
+            cache.stale |= stale
+        cache.key = self.key
+        cache.bitboards = list(bitboards)
+        cache.en_passant = self.en_passant
+        cache.in_check = in_check
+        return cache
+
+    """
+    Generates the moves of the stale pieces on the squares of starts and puts them in the cache.
+    """
+    def fill_piece_moves(self, own, cache, starts):
+        starts &= cache.stale
+        if starts == 0:
+            return
+        moves = cache.moves
+        for move in self.legal_moves(code_to_colour[own], self._board, starts & self.bitboards[own]):
+            moves.setdefault(move & 63, []).append(move)
+        cache.stale ^= starts
+
+    """
+    Gets the legal moves of one side grouped by the square of the piece. The moves are kept between calls: asking
+    again in the same position costs nothing, and after moves only the pieces that a changed square could affect
+    are generated again.
+
+    Parameters: colour -> the side to get the moves of, this team if not given
+    Returns: dictionary of square index -> list of moves, without the pieces that have no moves
+    """
+    def moves_by_piece(self, colour = None):
+        if colour == None:
+            colour = self.team
+        own = colour_to_code[colour]
+        cache = self.update_piece_moves(own)
+        self.fill_piece_moves(own, cache, bitboard.FULL)
+        return cache.moves
+
+    """
+    Gets the legal moves of the piece on the square from the cache of moves_by_piece, generating only that piece
+    if it is stale. This is what the GUI asks for when a piece is clicked.
+
+    Returns: list of moves, empty for an empty square
+    """
+    def moves_from(self, start):
+        code = self._board[start]
+        if code == EMPTY:
+            return []
+        own = code & WHITE
+        cache = self.update_piece_moves(own)
+        self.fill_piece_moves(own, cache, 1 << start)
+        return cache.moves.get(start, [])
+
+    """
+    Checks if the side has any legal move. Pieces whose cached moves are still good are looked at first, so after
+    a move the stale pieces are usually not generated at all.
+    """
+    def has_moves(self, colour = None):
+        if colour == None:
+            colour = self.team
+        own = colour_to_code[colour]
+        cache = self.update_piece_moves(own)
+        if len(cache.moves) != 0:
+            return True
+        self.fill_piece_moves(own, cache, bitboard.FULL)
+        return len(cache.moves) != 0
+
+    """
+    Finds the pieces of a side whose moves may have changed since they were put in the cache. A piece is stale if it
+    stands on a changed square, if a changed square is one it attacks or could push to (sliding pieces are blocked
+    by the pieces there now, so a piece that moved out of their way counts too), or if it stands on a line from its
+    king with a changed square on that line, which can make or break a pin. The king is always stale, as the
+    squares attacked around it can change from anywhere. Only a few squares change in a move, so the pieces are
+    found by looking outwards from the changed squares, as attackers does.
+
+    Returns: bitboard of the squares of the stale pieces (all squares if the king moved)
+    """
+    def stale_pieces(self, own, cache, occupied):
+        bitboards = self.bitboards
+        changed = 0
+        for code in range(16):
+            changed |= bitboards[code] ^ cache.bitboards[code]
+        for en_passant in (self.en_passant, cache.en_passant):
+            if en_passant != None:
+                changed |= 1 << en_passant
+
+        king = self.kings[own]
+        if king == -1 or changed >> king & 1:
+            return bitboard.FULL
+        stale = changed | 1 << king
+        back = 1 - self.direction(own)
+        rooks = bitboards[ROOK | own] | bitboards[QUEEN | own]
+        bishops = bitboards[BISHOP | own] | bitboards[QUEEN | own]
+        king_rooks = bitboard.rook_attacks(king, 0)
+        king_bishops = bitboard.bishop_attacks(king, 0)
+        for index in squares(changed):
+            behind = bitboard.pawn_push(1 << index, back)
+            stale |= (KNIGHT_ATTACKS[index] & bitboards[KNIGHT | own]) \
+                | ((PAWN_ATTACKS[back][index] | behind | bitboard.pawn_push(behind, back)) & bitboards[PAWN | own]) \
+                | (bitboard.rook_attacks(index, occupied) & rooks) \
+                | (bitboard.bishop_attacks(index, occupied) & bishops)
+            if king_rooks >> index & 1:
+                stale |= king_rooks & bitboard.rook_attacks(index, 0)
+            elif king_bishops >> index & 1:
+                stale |= king_bishops & bitboard.bishop_attacks(index, 0)
+        return stale
+
+    """
+    Generates the legal moves of one side, of the pieces on the squares of starts only (all of them by default).
+    """
+    @metrics.timed("chess_legal_moves_seconds", "legal move generation")
+    def legal_moves(self, colour, board, starts = bitboard.FULL):
+        bitboards = self.bitboards_for(board)
+        own = colour_to_code[colour]
+        enemy = own ^ WHITE
+        occupied = bitboards[BLACK] | bitboards[WHITE]
+        free = ~bitboards[own]
+        moves = []
+
+        king = bitboards[KING | own].bit_length() - 1
+        allowed, pins = self.check_mask(king, own, bitboards, occupied)
+
+        if king != -1 and starts >> king & 1:
+            # The king does not block the attacks on the squares behind it
+            without_king = occupied ^ 1 << king
+            for end in squares(KING_ATTACKS[king] & free):
+                if not self.attacked(end, enemy, bitboards, without_king):
+                    moves.append(king | end << 6)
+        # In double check only the king can move
+        if allowed == 0:
+            return moves
+
+        for start in squares(bitboards[KNIGHT | own] & ~pins.keys_mask & starts):
+            for end in squares(KNIGHT_ATTACKS[start] & free & allowed):
+                moves.append(start | end << 6)
+        for start in squares((bitboards[BISHOP | own] | bitboards[QUEEN | own]) & starts):
+            for end in squares(bitboard.bishop_attacks(start, occupied) & free & allowed & pins.get(start)):
+                moves.append(start | end << 6)
+        for start in squares((bitboards[ROOK | own] | bitboards[QUEEN | own]) & starts):
+            for end in squares(bitboard.rook_attacks(start, occupied) & free & allowed & pins.get(start)):
+                moves.append(start | end << 6)
+
+        direction = self.direction(own)
+        pawns = bitboards[PAWN | own] & starts
+        single = bitboard.pawn_push(pawns, direction) & ~occupied
+        if direction == UP:
+            step = -8
+            double = bitboard.pawn_push(single & bitboard.RANKS[3], direction) & ~occupied
+            last = bitboard.RANKS[8]
         else:
-            for i in [2,3]:
-                if self.get_piece((i,1), board).get_type() != "Entity":
-                    castling_flag_right = False
-            for i in [5,6,7]:
-                if self.get_piece((i,1), board).get_type() != "Entity":
-                    castling_flag_left = False
-        if self.get_piece((8,1), board).get_type() != "rook" or self.get_piece((8,1), board).get_colour != self.team \
-                or self.get_piece((8,1), board).get_untouched() == False:
-                castling_flag_left = False
-        if self.get_piece((1,1), board).get_type() != "rook" or self.get_piece((1,1), board).get_colour != self.team \
-            or self.get_piece((1,1), board).get_untouched() == False:
-            castling_flag_right = False
-            
-        if castling_flag_left == True:
-            possible.append((coords[0]+2, coords[1]))
-        if castling_flag_right == True:
-            possible.append((coords[0]-2, coords[1]))
+            step = 8
+            double = bitboard.pawn_push(single & bitboard.RANKS[6], direction) & ~occupied
+            last = bitboard.RANKS[1]
+        for end in squares(single & allowed):
+            if pins.get(end - step) >> end & 1:
+                if last >> end & 1:
+                    for promotion in promotions:
+                        moves.append(end - step | end << 6 | promotion << 12)
+                else:
+                    moves.append(end - step | end << 6)
+        for end in squares(double & allowed):
+            if pins.get(end - 2 * step) >> end & 1:
+                moves.append(end - 2 * step | end << 6)
+        for start in squares(pawns):
+            for end in squares(PAWN_ATTACKS[direction][start] & bitboards[enemy] & allowed & pins.get(start)):
+                if last >> end & 1:
+                    for promotion in promotions:
+                        moves.append(start | end << 6 | promotion << 12)
+                else:
+                    moves.append(start | end << 6)
+        # The en passant square is only known for the board the moves were played on. Taking en passant
+        # removes two pieces from the row, so these few moves are still tested by playing them.
+        if self.en_passant != None and board is self.board and board[self.en_passant - step] & 15 == PAWN | enemy:
+            for start in squares(PAWN_ATTACKS[1 - direction][self.en_passant] & pawns):
+                if not self.leaves_in_check(start | self.en_passant << 6, board, bitboards):
+                    moves.append(start | self.en_passant << 6)
+
+        if king != -1 and starts >> king & 1 and allowed == bitboard.FULL and not board[king] & MOVED:
+            for end in self.castling_possible_positions(king, board):
+                if not self.attacked((king + end) // 2, enemy, bitboards, occupied) \
+                    and not self.attacked(end, enemy, bitboards, occupied):
+                    moves.append(king | end << 6)
+
+        return moves
+
+    """
+    Works out the squares the pieces of a side may move to while its king is attacked, and the pinned pieces.
+
+    Parameters: king -> the square of the king of the side
+                colour -> the colour code of the side
+    Returns: the bitboard of the squares that take or block the check (all squares when not in check,
+             none in double check) and the Pins of the side
+    """
+    def check_mask(self, king, colour, bitboards, occupied):
+        pins = Pins()
+        if king == -1:
+            return bitboard.FULL, pins
+        enemy = colour ^ WHITE
+        checkers = self.attackers(king, enemy, bitboards, occupied)
+        if checkers == 0:
+            allowed = bitboard.FULL
+        elif checkers & (checkers - 1) == 0:
+            allowed = checkers | bitboard.BETWEEN[king][checkers.bit_length() - 1]
+        else:
+            allowed = 0
+
+        rooks = bitboards[ROOK | enemy] | bitboards[QUEEN | enemy]
+        bishops = bitboards[BISHOP | enemy] | bitboards[QUEEN | enemy]
+        snipers = (bitboard.rook_attacks(king, 0) & rooks) | (bitboard.bishop_attacks(king, 0) & bishops)
+        for sniper in squares(snipers):
+            between = bitboard.BETWEEN[king][sniper]
+            blockers = between & occupied
+            # Exactly one piece between them and it is one of ours
+            if blockers and blockers & (blockers - 1) == 0 and blockers & bitboards[colour]:
+                pins.add(blockers.bit_length() - 1, between | 1 << sniper)
+        return allowed, pins
+
+    """
+    Gets the pieces of the given colour attacking the square.
+
+    Returns: bitboard of the attacking pieces
+    """
+    def attackers(self, index, colour, bitboards, occupied):
+        rooks = bitboards[ROOK | colour] | bitboards[QUEEN | colour]
+        bishops = bitboards[BISHOP | colour] | bitboards[QUEEN | colour]
+        return (KNIGHT_ATTACKS[index] & bitboards[KNIGHT | colour]) \
+            | (KING_ATTACKS[index] & bitboards[KING | colour]) \
+            | (PAWN_ATTACKS[1 - self.direction(colour)][index] & bitboards[PAWN | colour]) \
+            | (bitboard.rook_attacks(index, occupied) & rooks) \
+            | (bitboard.bishop_attacks(index, occupied) & bishops)
+
+    """
+    Checks if the square is attacked by any piece of the given colour, by looking from the square
+    outwards with the attack tables.
+
+    Parameters: index -> the square in question
+                colour -> the colour code of the attacking side
+    Returns: True/False
+    """
+    def attacked(self, index, colour, bitboards, occupied):
+        if KNIGHT_ATTACKS[index] & bitboards[KNIGHT | colour]:
+            return True
+        if KING_ATTACKS[index] & bitboards[KING | colour]:
+            return True
+        # A pawn attacks the square if a pawn of the other side standing there would attack it
+        if PAWN_ATTACKS[1 - self.direction(colour)][index] & bitboards[PAWN | colour]:
+            return True
+        if bitboard.rook_attacks(index, occupied) & (bitboards[ROOK | colour] | bitboards[QUEEN | colour]):
+            return True
+        if bitboard.bishop_attacks(index, occupied) & (bitboards[BISHOP | colour] | bitboards[QUEEN | colour]):
+            return True
+        return False
+
+    """
+    Checks if playing the move would leave the king of the moving side attacked,
+    by updating a copy of the bitboards instead of the array board.
+    """
+    def leaves_in_check(self, move, board, bitboards):
+        start = move & 63
+        end = move >> 6 & 63
+        code = board[start] & 15
+        own = code & WHITE
+        sim = bitboards[:]
+        sim[code] ^= 1 << start | 1 << end
+        sim[own] ^= 1 << start | 1 << end
+        captured = end
+        if code & 7 == PAWN and start % 8 != end % 8 and board[end] == EMPTY:
+            captured = start - start % 8 + end % 8
+        if board[captured] != EMPTY:
+            sim[board[captured] & 15] ^= 1 << captured
+            sim[own ^ WHITE] ^= 1 << captured
+        king = sim[KING | own].bit_length() - 1
+        if king == -1:
+            return False
+        return self.attacked(king, own ^ WHITE, sim, sim[BLACK] | sim[WHITE])
+
+    """
+    Gets all the possible positions if the castling special move is movable. Specified for both teams,
+    the king and rook have to be untouched and on the same row with nothing between them.
+
+    Parameters: index -> the square of the king in question
+    Returns: the possible castling square indexes of the king
+    """
+    def castling_possible_positions(self, index, board):
+        possible = []
+        rook = ROOK | (board[index] & WHITE)
+        # The rays along the row, walked until the first piece, which has to be the rook in the corner
+        for ray in bitboard.RAYS[index][:2]:
+            # The king needs two squares to move to, so it can not castle from next to the rook
+            if len(ray) < 3:
+                continue
+            for i in ray:
+                if board[i] != EMPTY:
+                    break
+            if i == ray[-1] and board[i] == rook:
+                possible.append(ray[1])
         return possible
+
     """
     Used for the rook and the queen, for finding the possible horizontal and vertical positions those given pieces can go
     before they come in contact with the border of the board or an enemy piece
 
-    Parameters: piece -> the piece in question
-    Returns: the possible perpendicular positons that the piece can move to
+    Parameters: index -> the square of the piece in question
+    Returns: the possible perpendicular square indexes that the piece can move to
     """
-    def perpendicular_expansion(self, piece, board):
-        possible = []
-        coords = piece.get_position()
-        x = coords[0]+1
-        y = coords[1]
-        while x < 9 and self.get_piece((x,y), board).get_colour() != piece.get_colour():
-            
-            possible.append((x, coords[1]))
-            if self.get_piece((x,y), board).get_colour() != piece.get_colour() \
-                and self.get_piece((x,y), board).piece == True:
-                break
-            x += 1
-        x = coords[0]-1
-        while x > 0 and self.get_piece((x,y), board).get_colour() != piece.get_colour():            
-            possible.append((x, coords[1]))
-            if self.get_piece((x,y), board).get_colour() != piece.get_colour() \
-                and self.get_piece((x,y), board).piece == True:
-                break
-            x -= 1
-        x = coords[0]
-        y = coords[1] + 1
-        while y < 9 and self.get_piece((x,y), board).get_colour() != piece.get_colour(): 
-            
-            possible.append((coords[0], y))
-            if self.get_piece((x,y), board).get_colour() != piece.get_colour() \
-                and self.get_piece((x,y), board).piece == True:
-                break
-            y += 1
-        x = coords[0]
-        y = coords[1] - 1
-        while y > 0 and self.get_piece((x,y), board).get_colour() != piece.get_colour():
-                
-            
-            possible.append((coords[0], y))
-            if self.get_piece((x,y), board).get_colour() != piece.get_colour() \
-                and self.get_piece((x,y), board).piece == True:
-                break
-            y -= 1
-        y = coords[1]
-        return possible
+    def perpendicular_expansion(self, index, board):
+        bitboards = self.bitboards_for(board)
+        occupied = bitboards[BLACK] | bitboards[WHITE]
+        return list(squares(bitboard.rook_attacks(index, occupied) & ~bitboards[board[index] & WHITE]))
 
     """
     Used for the bishop and the queen, for finding the possible diagonal positions those given pieces can go
     before they come in contact with the border of the board or an enemy piece.
 
-    Parameters: piece -> the piece in question
-    Returns: the possible diagonal positons that the piece can move to
+    Parameters: index -> the square of the piece in question
+    Returns: the possible diagonal square indexes that the piece can move to
     """
-    def diagonal_expansion(self, piece, board):
-        possible = []
-        coords = piece.get_position()
-        x = coords[0]+1
-        y = coords[1]+1
-        while x < 9 and y < 9 and self.get_piece((x,y), board).get_colour() != self.team:
-            possible.append((x,y))
-            if self.get_piece((x,y), board).get_colour() != self.team \
-                and self.get_piece((x,y), board).piece == True:
-                break
-            x += 1
-            y += 1
-        x = coords[0]+1
-        y = coords[1]-1
-        while x < 9 and y > 0 and self.get_piece((x,y), board).get_colour() != self.team:
-            possible.append((x, y))
-            if self.get_piece((x,y), board).get_colour() != self.team \
-                and self.get_piece((x,y), board).piece == True:
-                break
-            x += 1
-            y -= 1
-        x = coords[0]-1
-        y = coords[1]+1
-        while x > 0 and y < 9 and self.get_piece((x,y), board).get_colour() != self.team:
-            possible.append((x, y))
-            if self.get_piece((x,y), board).get_colour() != self.team \
-                and self.get_piece((x,y), board).piece == True:
-                break
-            x -= 1
-            y += 1
-        x = coords[0]-1
-        y = coords[1]-1
-        while x > 0 and y > 0 and self.get_piece((x,y), board).get_colour() != self.team:
-            possible.append((x, y))
-            if self.get_piece((x,y), board).get_colour() != self.team \
-                and self.get_piece((x,y), board).piece == True:
-                break
-            x -= 1
-            y -= 1
-
-        return possible
+    def diagonal_expansion(self, index, board):
+        bitboards = self.bitboards_for(board)
+        occupied = bitboards[BLACK] | bitboards[WHITE]
+        return list(squares(bitboard.bishop_attacks(index, occupied) & ~bitboards[board[index] & WHITE]))
 
     """
-    Moves the specified piece to the specified coordinates, if the coordinates contain a piece there, take it.coords=
-    Also implements the castling special move, if get_positions allows for a castling move.
+    Moves the specified piece to the specified coordinates, if the coordinates contain a piece there, take it.
+    Also implements the castling and en passant special moves, if get_positions allows for them.
+    This works on a copy of the board, see make_move for playing a move in place.
 
     Parameters: piece -> the piece in question
                 coords -> the coordinates the piece will move to
                 board -> the board in question
-
+                promotion -> the type a pawn reaching the last row turns into
+    Returns: the new array board, the Piece objects of this team on it and True
     """
-    def move_piece(self, piece, coords, board = None):
-        n_piece = piece
+    @metrics.timed("chess_move_piece_seconds", "moves on a copy of the board, one copy per call")
+    def move_piece(self, piece, coords, board = None, promotion = "queen"):
         if board == None:
             board = self.board
-        sim = copy.deepcopy(board)
-        #if coords in self.get_positions(piece, board):
-        if n_piece.get_type() == "king" and n_piece.get_untouched() == True and \
-            (n_piece.get_position()[0] - coords[0] < -1 or n_piece.get_position()[0] - coords[0] > 1):
-            #since get_positions already checks if castling is possible, move_piece does not need to check
-            
-            if n_piece.get_position()[0] - coords[0] < -1:
-                index1 = sim.index(self.get_piece((coords[0]-1, coords[1])))
-                index2 = sim.index(self.get_piece((1,1)))
-                sim[index1], sim[index2] = sim[index2], sim[index1]
-            elif n_piece.get_position()[0] - coords[0] > 1:
-                index1 = sim.index(self.get_piece((coords[0]+1, coords[1])))
-                index2 = sim.index(self.get_piece((8,1)))
-                sim[index1], sim[index2] = sim[index2], sim[index1]
-
-            
+        sim = bytearray(board)
+        start = square(piece.get_position())
+        end = square(coords)
+        code = sim[start]
+        #since get_positions already checks if castling is possible, move_piece does not need to check
+        if code & 7 == KING and abs(start - end) == 2:
+            if end < start:
+                corner = end - end % 8
+                sim[end + 1] = sim[corner] | MOVED
+            else:
+                corner = end - end % 8 + 7
+                sim[end - 1] = sim[corner] | MOVED
+            sim[corner] = EMPTY
+        elif code & 7 == PAWN:
+            # A pawn moving sideways onto an empty square takes the pawn next to it en passant
+            if start % 8 != end % 8 and sim[end] == EMPTY:
+                sim[start - start % 8 + end % 8] = EMPTY
+            if end < 8 or end > 55:
+                code = type_to_code[promotion] | (code & WHITE)
+
+        sim[end] = code | MOVED
+        sim[start] = EMPTY
+
+        return sim, self.list_from_board(sim), True
+
+    """
+    Puts the piece code on an empty square and removes the piece on a square, keeping the bitboards,
+    Zobrist key, piece counts and evaluation in step with the array board.
+    """
+    def put_piece(self, index, code):
+        piece = code & 15
+        self._board[index] = code
+        self.key ^= zobrist.PIECES[piece][index]
+        self.bitboards[piece] |= 1 << index
+        self.bitboards[code & WHITE] |= 1 << index
+        self.counts[piece] += 1
+        self.mg += self.mg_table[piece][index]
+        self.eg += self.eg_table[piece][index]
+        self.phase += evaluation.PHASES[code & 7]
+
+    def remove_piece(self, index):
+        code = self._board[index]
+        piece = code & 15
+        self.key ^= zobrist.PIECES[piece][index]
+        self.bitboards[piece] ^= 1 << index
+        self.bitboards[code & WHITE] ^= 1 << index
+        self.counts[piece] -= 1
+        self.mg -= self.mg_table[piece][index]
+        self.eg -= self.eg_table[piece][index]
+        self.phase -= evaluation.PHASES[code & 7]
+        self._board[index] = EMPTY
+        return code
+
+    """
+    Plays the move on this board in place. Everything needed to take it back (the moving piece with its
+    untouched flag, the captured piece and its square, the castling rook, the previous en passant square,
+    castling rights and key) is pushed onto the history, so unmake_move can restore the board without copying it.
+    The turn passes to the other side.
+
+    Parameters: move -> the move in question (see encode_move)
+    """
+    @metrics.timed("chess_make_move_seconds", "moves played in place")
+    def make_move(self, move):
+        start, end, promotion = decode_move(move)
+        board = self._board
+        code = board[start]
+        type = code & 7
+        key = self.key
+        captured_square = end
+        if type == PAWN and start % 8 != end % 8 and board[end] == EMPTY:
+            captured_square = start - start % 8 + end % 8
+        captured = EMPTY
+        if board[captured_square] != EMPTY:
+            captured = self.remove_piece(captured_square)
+
+        self.remove_piece(start)
+        if type == KING:
+            self.kings[code & WHITE] = end
+        if promotion != EMPTY:
+            self.put_piece(end, promotion | (code & WHITE) | MOVED)
         else:
+            self.put_piece(end, code | MOVED)
 
-            index1 = self.hash_index(hash(n_piece), sim)
-            index2 = self.hash_index(hash(self.get_piece(coords, sim)), sim)
-            position1 = n_piece.get_position()
-            if self.get_piece(coords, sim).piece == True:
-                sim[index1], sim[index2] = Piece(position1, "Entity", "neutral"), sim[index1], 
+        castle = None
+        if type == KING and abs(start - end) == 2:
+            if end < start:
+                corner = start - start % 8
             else:
-                sim[index1], sim[index2] = sim[index2], sim[index1]
-                sim[index1].set_position(position1)
-            
-            sim[index2].set_position(coords)
-        
-        
-        return sim, self.list_from_board(sim), True
-        
+                corner = start - start % 8 + 7
+            rook = self.remove_piece(corner)
+            self.put_piece((start + end) // 2, rook | MOVED)
+            castle = (corner, (start + end) // 2, rook)
+
+        self.history.append((move, code, captured, captured_square, self.en_passant, castle, self.castling, key))
+        key = self.key ^ zobrist.SIDE
+        if self.en_passant != None:
+            key ^= zobrist.EN_PASSANT[COORDS[self.en_passant][0]]
+        if type == PAWN and abs(start - end) == 16:
+            self.en_passant = (start + end) // 2
+            key ^= zobrist.EN_PASSANT[COORDS[self.en_passant][0]]
+        else:
+            self.en_passant = None
+        # Only a king or rook leaving its square, or a rook being taken, can change the castling rights
+        if self.castling and (type == KING or start in zobrist.CORNERS or captured_square in zobrist.CORNERS):
+            castling = self.castling_rights(board)
+            key ^= zobrist.CASTLING[self.castling] ^ zobrist.CASTLING[castling]
+            self.castling = castling
+        self.key = key
+        self.turn = team[self.turn]
+
+    """
+    Takes back the last move played with make_move.
+    """
+    def unmake_move(self):
+        move, code, captured, captured_square, en_passant, castle, castling, key = self.history.pop()
+        start, end, promotion = decode_move(move)
+        self.remove_piece(end)
+        self.put_piece(start, code)
+        if code & 7 == KING:
+            self.kings[code & WHITE] = start
+        if captured != EMPTY:
+            self.put_piece(captured_square, captured)
+        if castle != None:
+            corner, rook_square, rook = castle
+            self.remove_piece(rook_square)
+            self.put_piece(corner, rook)
+        self.en_passant = en_passant
+        self.castling = castling
+        self.key = key
+        self.turn = team[self.turn]
+
+    """
+    Finds the move from the square to the square in the legal moves of the piece standing there.
+    """
+    def find_move(self, start, end, promotion = QUEEN):
+        for move in self.moves_from(start):
+            if move & 63 == start and move >> 6 & 63 == end and move >> 12 in (EMPTY, promotion):
+                return move
+
+
+    """
+    Checks if the square is attacked by the given side.
+
+    Parameters: index -> the index of the square in the array board
+                colour -> the colour of the attacking side
+    Returns: True/False
+    """
+    def is_square_attacked(self, index, colour):
+        bitboards = self.bitboards
+        return self.attacked(index, colour_to_code[colour], bitboards, bitboards[BLACK] | bitboards[WHITE])
 
     """
-    Checks if this team is in check
+    Checks if this team is in check, by looking outwards from the king for enemy pieces
 
     Returns: True/False depending if the team is in check
     """
+    @metrics.timed("chess_check_checker_seconds", "checks of the own king")
     def check_checker(self, board = None):
         if board == None:
             board = self.board
-        for i in board:
-            
-            if i.get_type() != "Entity" and (i.get_colour() != self.team and i.get_colour() != "neutral"):
-                for j in self.get_positions(i, board, prune = False):
-                    
-                    if j == self.get_pieces_by_type("king", self.team, board)[0].get_position():
-                        return True
-        
-        return False
+        colour = colour_to_code[self.team]
+        if board is self.board:
+            bitboards = self.bitboards
+            king = self.kings[colour]
+        else:
+            bitboards = self.build_bitboards(board)
+            king = bitboards[KING | colour].bit_length() - 1
+        if king == -1:
+            return False
+
+        return self.attacked(king, colour ^ WHITE, bitboards, bitboards[BLACK] | bitboards[WHITE])
 
     """
-    Prunes all possible move coordinates that would result in a check
+    Prunes all possible move coordinates that would result in a check. The moves are played and
+    taken back on the board itself, other boards are tested on a copy.
     """
+    @metrics.timed("chess_prune_checks_seconds", "pruning of moves that leave the king in check")
     def prune_checks(self, piece, possible, board):
         possible2 = []
+        start = square(piece.get_position())
         for i in possible:
-            board_copy = self.move_piece(piece, i, board)
-            if self.check_checker(board_copy) == False:
+            if board is self.board:
+                self.make_move(encode_move(start, square(i), self.promotion_for(start, square(i))))
+                in_check = self.check_checker()
+                self.unmake_move()
+            else:
+                in_check = self.check_checker(self.move_piece(piece, i, board)[0])
+            if in_check == False:
                 possible2.append(i)
         return possible2
 
     """
-    Checks if this team is in checkmate
+    Gets the promotion of a move made by get_positions, pawns reaching the last row are promoted to a queen.
+    """
+    def promotion_for(self, start, end):
+        if self.board[start] & 7 == PAWN and (end < 8 or end > 55):
+            return QUEEN
+        return EMPTY
+
+    """
+    Checks if this team is in checkmate (or stalemate), which is when it has no legal moves left. Positions in the
+    endgame tablebases that are loaded are looked up first, but only a mate or a marked stalemate is taken from them:
+    a stalemate of the strong side is stored as an ordinary draw, so every other result is checked with has_moves.
 
     Returns: True/False depending if the team is in checkmate
     """
+    @metrics.timed("chess_checkmate_checker_seconds", "checkmate and stalemate checks")
     def checkmate_checker(self):
-        board = self.board
-        pieces = self.pieces
-        checkmate = True
-        for i in pieces:
-            moves = self.get_positions(i, board)
-            for j in moves:
-                new_board = self.move_piece(self.get_piece(i.get_position(), board), j, board)[0]
-                if self.check_checker(new_board) == False:
-                    checkmate = False
-         
-        return checkmate
-         
-            
-   
-
-
-
-
-
-                
-
-
-    
-
-
+        # Imported here, as the tablebases import this module
+        import tablebase
+        if tablebase.tables:
+            result = tablebase.probe(self, self.team)
+            if result == (-1, 0) or result == (0, -1):
+                return True
+        return not self.has_moves()
@@ -1,28 +1,129 @@
+import asyncio
+import collections
 import socket
 
-HEADER = 64
+import framing
+import protocol
+
+"""
+Client library of the game server, in two forms:
+
+Client      -> a blocking text client on a socket, one reply read for every message sent
+AsyncClient -> an asyncio client of the binary format (see protocol.py), for programs that run many players at
+               once, such as the bots of swarm.py
+
+Nothing connects when this module is imported. Run this file for the old greeting demo against a running server.
+"""
+
+HEADER = framing.HEADER
 PORT = 5050
-FORMAT = 'utf-8'
+FORMAT = framing.FORMAT
 DISCONNECT_MESSAGE = "!DISCONNECT"
 SERVER = socket.gethostbyname(socket.gethostname())
 ADDR = (SERVER, PORT)
 
-client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-client.connect(ADDR)
-
-def send(msg):
-    message = msg.encode(FORMAT)
-    msg_length = len(message)
-    send_length = str(msg_length).encode(FORMAT)
-    send_length += b' ' * (HEADER - len(send_length))
-    client.send(send_length)
-    client.send(message)
-    print(client.recv(2048).decode(FORMAT))
-
-send("Hello World!")
-input()
-send("Hello Everyone!")
-input()
-send("Hello Tim!")
-
-send(DISCONNECT_MESSAGE)
\ No newline at end of file
+
+"""
+Client class is a blocking text client: every message is a text command (e.g. !JOIN, !MOVE e2e4) and its reply
+is read before send returns.
+
+Parameters:
+addr -> the (host, port) of the server
+"""
+class Client():
+
+    def __init__(self, addr = ADDR):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect(addr)
+        self.stream = framing.FramedSocket(self.sock)
+
+    """
+    Sends the message and waits for its reply.
+
+    Returns: the reply
+    """
+    def send(self, msg):
+        self.stream.send(msg)
+        return self.stream.receive()
+
+    def receive(self):
+        return self.stream.receive()
+
+    def close(self):
+        self.stream.close()
+
+
+"""
+AsyncClient class is one connection in the binary format. Messages are the tuples of sessions.py both ways, e.g.
+("MOVE", move) out and ("MOVED", move, changes, status) in. Make one with connect.
+
+Parameters:
+reader, writer -> the asyncio streams of the connection
+"""
+class AsyncClient():
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.decoder = protocol.Decoder()
+        self.messages = collections.deque()
+
+    """
+    Sends a message, it is written with the next write of the event loop.
+    """
+    def send(self, message):
+        out = bytearray()
+        protocol.encode_binary(message, out)
+        self.writer.write(out)
+
+    """
+    Waits for the next message of the server.
+
+    Raises: ConnectionError if the server closes the connection
+    """
+    async def receive(self):
+        while len(self.messages) == 0:
+            data = await self.reader.read(64 * 1024)
+            if not data:
+                raise ConnectionError("connection closed")
+            self.messages.extend(self.decoder.feed(data))
+        return self.messages.popleft()
+
+    """
+    Waits for the next message of one of the kinds, dropping the others.
+    """
+    async def expect(self, *kinds):
+        while True:
+            message = await self.receive()
+            if message[0] in kinds:
+                return message
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+"""
+Connects to the server in the binary format and waits for its HELLO.
+
+Returns: the AsyncClient
+"""
+async def connect(host = SERVER, port = PORT):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(bytes([protocol.MAGIC, protocol.VERSION]))
+    client = AsyncClient(reader, writer)
+    await client.expect("HELLO")
+    return client
+
+
+if __name__ == "__main__":
+    client = Client(ADDR)
+    print(client.send("Hello World!"))
+    input()
+    print(client.send("Hello Everyone!"))
+    input()
+    print(client.send("Hello Tim!"))
+    print(client.send(DISCONNECT_MESSAGE))
+    client.close()
@@ -0,0 +1,137 @@
+"""
+Material and piece-square tables of the evaluation. Every piece has a middlegame and an endgame value on every
+square, and the evaluation is tapered between the two by the phase of the game, which goes from 24 with all the
+knights, bishops, rooks and queens on the board down to 0 without them.
+
+ChessBoard adds and takes away the values of a piece whenever it is put on or removed from a square, so the
+evaluation of a position never has to look at the whole board.
+
+The tables are indexed by type (pawn = 1 up to king = 6, as in chess.py) and written from White's side of the board,
+with a8 first and h1 last.
+"""
+
+MG_VALUES = (0, 82, 337, 365, 477, 1025, 0)
+EG_VALUES = (0, 94, 281, 297, 512, 936, 0)
+PHASES = (0, 0, 1, 1, 2, 4, 0)
+MAX_PHASE = 24
+
+PAWN_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     10,  10,  20,  30,  30,  20,  10,  10,
+      5,   5,  10,  25,  25,  10,   5,   5,
+      0,   0,   0,  20,  20,   0,   0,   0,
+      5,  -5, -10,   0,   0, -10,  -5,   5,
+      5,  10,  10, -20, -20,  10,  10,   5,
+      0,   0,   0,   0,   0,   0,   0,   0
+)
+PAWN_END_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+     80,  80,  80,  80,  80,  80,  80,  80,
+     50,  50,  50,  50,  50,  50,  50,  50,
+     30,  30,  30,  30,  30,  30,  30,  30,
+     15,  15,  15,  15,  15,  15,  15,  15,
+      5,   5,   5,   5,   5,   5,   5,   5,
+      0,   0,   0,   0,   0,   0,   0,   0,
+      0,   0,   0,   0,   0,   0,   0,   0
+)
+KNIGHT_TABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50
+)
+BISHOP_TABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20
+)
+ROOK_TABLE = (
+      0,   0,   0,   0,   0,   0,   0,   0,
+      5,  10,  10,  10,  10,  10,  10,   5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+     -5,   0,   0,   0,   0,   0,   0,  -5,
+      0,   0,   0,   5,   5,   0,   0,   0
+)
+QUEEN_TABLE = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+     -5,   0,   5,   5,   5,   5,   0,  -5,
+      0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20
+)
+KING_TABLE = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+     20,  20,   0,   0,   0,   0,  20,  20,
+     20,  30,  10,   0,   0,  10,  30,  20
+)
+KING_END_TABLE = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50
+)
+
+MG_TABLES = (None, PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_TABLE)
+EG_TABLES = (None, PAWN_END_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_END_TABLE)
+
+
+"""
+Builds the tables of a board seen from the given team's perspective, indexed by piece code (type, plus 8 for white)
+and square index of the array board. Values are from White's point of view, so the black pieces count negative.
+
+Returns: the middlegame and endgame tables, each a list of 16 lists of 64 values
+"""
+def piece_tables(team):
+    mg = [[0] * 64 for code in range(16)]
+    eg = [[0] * 64 for code in range(16)]
+    for type in range(1, 7):
+        for index in range(64):
+            # The board of the black team is turned around
+            if team == "black":
+                standard = 63 - index
+            else:
+                standard = index
+            mg[type | 8][index] = MG_VALUES[type] + MG_TABLES[type][standard]
+            eg[type | 8][index] = EG_VALUES[type] + EG_TABLES[type][standard]
+            # Black's pieces use the tables upside down
+            mg[type][index] = -(MG_VALUES[type] + MG_TABLES[type][standard ^ 56])
+            eg[type][index] = -(EG_VALUES[type] + EG_TABLES[type][standard ^ 56])
+    return mg, eg
+
+TABLES = {
+    "white": piece_tables("white"),
+    "black": piece_tables("black")
+}
+
+"""
+Blends the middlegame and endgame scores by the phase of the game.
+"""
+def taper(mg, eg, phase):
+    if phase > MAX_PHASE:
+        phase = MAX_PHASE
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
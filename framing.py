@@ -0,0 +1,121 @@
+"""
+Framing of the text format on a byte stream, shared by the server and the clients. A message is a 64 byte header
+holding its length in ASCII digits padded with spaces, followed by the message as UTF-8.
+
+TCP is a stream: a recv can return any part of what was sent, a header split in two or three messages at once.
+So nothing here trusts the size of one recv. Reads loop until the bytes asked for have arrived, into one buffer
+that is kept for the whole connection, and a message is written with its header in a single sendall.
+
+The stress test in tests/test_framing.py sends frames in pieces cut at random byte boundaries, which must come out
+whole.
+"""
+
+HEADER = 64
+FORMAT = 'utf-8'
+MAX_MESSAGE = 4096
+
+
+class FrameError(Exception):
+    pass
+
+
+def frame(msg):
+    message = msg.encode(FORMAT)
+    send_length = str(len(message)).encode(FORMAT)
+    send_length += b' ' * (HEADER - len(send_length))
+    return send_length + message
+
+"""
+Reads the length of the message from a header.
+
+Raises: FrameError if the header is not a number or the length is more than max_message
+"""
+def parse_header(header, max_message = MAX_MESSAGE):
+    try:
+        length = int(bytes(header).decode(FORMAT))
+    except (ValueError, UnicodeDecodeError):
+        raise FrameError("bad header")
+    if length < 0 or length > max_message:
+        raise FrameError(f"message of {length} bytes is too long")
+    return length
+
+
+"""
+FramedSocket class reads and writes framed messages on a blocking socket.
+
+Parameters:
+sock -> the connected socket
+max_message -> the longest message to accept
+"""
+class FramedSocket():
+
+    def __init__(self, sock, max_message = MAX_MESSAGE):
+        self.sock = sock
+        self.max_message = max_message
+        # One buffer for the whole connection, big enough for the header and the longest message
+        self.buffer = bytearray(HEADER + max_message)
+        self.view = memoryview(self.buffer)
+
+    """
+    Receives exactly size bytes into the start of the buffer.
+
+    Returns: a memoryview of the bytes, only valid until the next read
+    Raises: ConnectionError if the connection closes first
+    """
+    def recv_exact(self, size):
+        view = self.view[:size]
+        received = 0
+        while received < size:
+            count = self.sock.recv_into(view[received:], size - received)
+            if count == 0:
+                raise ConnectionError("connection closed")
+            received += count
+        return view
+
+    """
+    Receives one message.
+
+    Returns: the message string
+    """
+    def receive(self):
+        length = parse_header(self.recv_exact(HEADER), self.max_message)
+        return str(self.recv_exact(length), FORMAT)
+
+    """
+    Sends messages, header and body of all of them in one sendall.
+    """
+    def send(self, *msgs):
+        self.sock.sendall(b"".join(frame(msg) for msg in msgs))
+
+    def close(self):
+        self.view.release()
+        self.sock.close()
+
+
+"""
+Decoder class cuts the framed messages out of a stream fed to it in pieces of any size, for the code that
+receives without blocking. It has the same feed method as protocol.Decoder.
+"""
+class Decoder():
+
+    def __init__(self, max_message = MAX_MESSAGE):
+        self.buffer = bytearray()
+        self.max_message = max_message
+
+    """
+    Adds received bytes and returns the messages they completed.
+    """
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        offset = 0
+        while len(buffer) - offset >= HEADER:
+            length = parse_header(buffer[offset:offset + HEADER], self.max_message)
+            if len(buffer) - offset - HEADER < length:
+                break
+            start = offset + HEADER
+            messages.append(buffer[start:start + length].decode(FORMAT))
+            offset = start + length
+        del buffer[:offset]
+        return messages
@@ -0,0 +1,220 @@
+import argparse
+import gzip
+import mmap
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import chess
+
+"""
+Bulk import of game archives: every game of a PGN file (or every position of a FEN file, one per line) is played
+through the ChessBoard rules to check it, and statistics are collected.
+
+The file is read as a pipeline of generators (lines -> games -> chunks), so only a few chunks are in memory at
+once however large the file is. Plain files are memory-mapped and gzip files are decompressed as they are read.
+The chunks are fanned out to a pool of processes, with at most two chunks per worker waiting, so reading never
+runs ahead of the workers.
+
+Run with: python ingest.py games.pgn[.gz] [--workers N] [--chunk 200] [--limit N]
+"""
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+# Comments, variations, numeric annotations and move numbers are not moves
+NOISE = re.compile(r"\{[^}]*\}|;[^\n]*|\$\d+|\d+\.(\.\.)?")
+TAG = re.compile(r'\[(\w+)\s+"(.*)"\]')
+
+
+"""
+Reads the lines of a file without loading it whole: gzip files are decompressed as they are read and other files
+are memory-mapped.
+"""
+def read_lines(path):
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as file:
+            for line in file:
+                yield line
+        return
+    with open(path, "rb") as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can not be mapped
+            return
+        with data:
+            for line in iter(data.readline, b""):
+                yield line
+
+"""
+Groups the lines of a PGN file into games.
+
+Returns: generator of (tags, movetext) with the tags as a dictionary
+"""
+def read_games(lines):
+    tags = {}
+    movetext = []
+    for line in lines:
+        line = line.decode("utf-8", "replace").strip()
+        if line.startswith("["):
+            # Tags after movetext start the next game
+            if len(movetext) != 0:
+                yield tags, " ".join(movetext)
+                tags = {}
+                movetext = []
+            match = TAG.match(line)
+            if match:
+                tags[match.group(1)] = match.group(2)
+        elif line != "":
+            movetext.append(line)
+    if len(tags) != 0 or len(movetext) != 0:
+        yield tags, " ".join(movetext)
+
+"""
+Reads the positions of a FEN file, one per line, in the same form as read_games.
+"""
+def read_positions(lines):
+    for line in lines:
+        line = line.decode("utf-8", "replace").strip()
+        if line != "" and not line.startswith("#"):
+            yield {"FEN": line}, None
+
+def chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) != 0:
+        yield chunk
+
+"""
+Splits movetext into its SAN moves and the result, dropping comments, variations and move numbers.
+"""
+def san_moves(movetext):
+    text = NOISE.sub(" ", movetext)
+    # Variations can nest, so they are taken out from the inside
+    while "(" in text:
+        new_text = re.sub(r"\([^()]*\)", " ", text)
+        if new_text == text:
+            break
+        text = new_text
+    moves = []
+    result = "*"
+    for token in text.split():
+        if token in RESULTS:
+            result = token
+        else:
+            moves.append(token)
+    return moves, result
+
+
+"""
+Checks a chunk of games on one board, which is reused for every game. Runs in a worker.
+
+Returns: the counters of the chunk
+"""
+def check_games(chunk):
+    board = chess.ChessBoard(team = "white")
+    stats = Counter()
+    errors = []
+    for tags, movetext in chunk:
+        stats["games"] += 1
+        try:
+            board.load_fen(tags.get("FEN", chess.start_fen))
+        except (KeyError, ValueError, IndexError):
+            stats["bad_fen"] += 1
+            errors.append(f"bad FEN {tags.get('FEN')}")
+            continue
+        if movetext == None:
+            # A position: check it by counting its moves
+            stats["positions"] += 1
+            stats["moves"] += len(board.generate_moves(board.turn))
+            continue
+
+        moves, result = san_moves(movetext)
+        stats["result " + result] += 1
+        for ply, san in enumerate(moves):
+            move = board.parse_san(san)
+            if move == None:
+                stats["illegal"] += 1
+                if len(errors) < 10:
+                    errors.append(f"{tags.get('White', '?')} - {tags.get('Black', '?')}: illegal {san} at ply {ply + 1}")
+                break
+            board.make_move(move)
+            stats["plies"] += 1
+        else:
+            stats["valid"] += 1
+    return stats, errors
+
+
+"""
+Streams the file through the pool of workers and prints the progress.
+
+Parameters: path -> the PGN or FEN file, optionally gzipped (.gz)
+            workers -> the number of worker processes, one per CPU if not given
+            chunk -> the number of games sent to a worker at once
+            limit -> the most games to read, all if not given
+Returns: the total counters and some of the errors
+"""
+def run(path, workers = None, chunk = 200, limit = None):
+    lines = read_lines(path)
+    if ".fen" in path or ".epd" in path:
+        games = read_positions(lines)
+    else:
+        games = read_games(lines)
+    if limit != None:
+        games = (game for i, game in zip(range(limit), games))
+
+    stats = Counter()
+    errors = []
+    start = time.perf_counter()
+    reported = start
+    if workers == None:
+        workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        waiting = 2 * workers
+        pending = set()
+        for games_chunk in chunks(games, chunk):
+            # Back pressure: read no further until a worker is free
+            if len(pending) >= waiting:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    add_result(future.result(), stats, errors)
+            pending.add(executor.submit(check_games, games_chunk))
+            now = time.perf_counter()
+            if now - reported > 5:
+                reported = now
+                print(f"[PROGRESS] {stats['games']} games, {stats['games'] / (now - start):.0f} games/sec")
+        for future in pending:
+            add_result(future.result(), stats, errors)
+    elapsed = time.perf_counter() - start
+
+    print(f"[GAMES] {stats['games']} in {elapsed:.2f}s, {stats['games'] / elapsed:.0f} games/sec, "
+          f"{stats['plies'] / elapsed:.0f} plies/sec")
+    print(f"[VALID] {stats['valid']} games, {stats['positions']} positions, {stats['illegal']} with an illegal move, {stats['bad_fen']} bad FENs")
+    for key in sorted(stats):
+        if key.startswith("result "):
+            print(f"[RESULT] {key[7:]}: {stats[key]}")
+    for error in errors[:10]:
+        print(f"[ERROR] {error}")
+    return stats, errors
+
+def add_result(result, stats, errors):
+    chunk_stats, chunk_errors = result
+    stats.update(chunk_stats)
+    if len(errors) < 10:
+        errors += chunk_errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "check the games of a PGN or FEN file with the rules engine")
+    parser.add_argument("path")
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--chunk", type = int, default = 200, help = "games sent to a worker at once")
+    parser.add_argument("--limit", type = int, default = None, help = "the most games to read")
+    args = parser.parse_args()
+    run(args.path, args.workers, args.chunk, args.limit)
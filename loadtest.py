@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import resource
+import time
+
+import framing
+import server
+
+"""
+Load test of the game server. Opens many simulated clients at once from a single process, each sending
+messages with the server's framing, and reports how many connections the server took and the round trip latency
+of the messages.
+
+Run with: python loadtest.py --clients 1000 --messages 20 [--local] [--host HOST] [--port PORT]
+--local starts a server in this process on a free port of 127.0.0.1, so nothing else needs to be running.
+"""
+
+frame = framing.frame
+
+async def read_reply(reader):
+    length = framing.parse_header(await reader.readexactly(framing.HEADER))
+    return (await reader.readexactly(length)).decode(server.FORMAT)
+
+"""
+One simulated client: connects, sends its messages one at a time waiting for each reply, then disconnects.
+The round trip time of every message (in seconds) and the failures are added to results.
+"""
+async def client(host, port, messages, results):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        results["failed"] += 1
+        return
+    results["connected"] += 1
+    try:
+        for i in range(messages):
+            start = time.perf_counter()
+            writer.write(frame(f"Hello {i}"))
+            await read_reply(reader)
+            results["latencies"].append(time.perf_counter() - start)
+        writer.write(frame(server.DISCONNECT_MESSAGE))
+        await read_reply(reader)
+    except (OSError, asyncio.IncompleteReadError):
+        results["errors"] += 1
+    finally:
+        writer.close()
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+"""
+Runs the clients together and prints a report.
+"""
+async def run(clients, messages, host, port, local):
+    local_server = None
+    if local:
+        server.log_messages = False
+        local_server = await asyncio.start_server(server.handle_client, "127.0.0.1", 0,
+                                                  limit = server.READ_LIMIT, backlog = 4096)
+        host, port = local_server.sockets[0].getsockname()[:2]
+
+    results = {"connected": 0, "failed": 0, "errors": 0, "latencies": []}
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, messages, results) for i in range(clients)])
+    elapsed = time.perf_counter() - start
+    if local_server != None:
+        local_server.close()
+        await local_server.wait_closed()
+
+    latencies = sorted(results["latencies"])
+    print(f"[CONNECTIONS] {results['connected']} connected, {results['failed']} failed, {results['errors']} errors")
+    print(f"[MESSAGES] {len(latencies)} in {elapsed:.2f}s, {len(latencies) / elapsed:.0f} per second")
+    print(f"[LATENCY] p50 {percentile(latencies, 0.5) * 1000:.2f}ms, p90 {percentile(latencies, 0.9) * 1000:.2f}ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f}ms, max {percentile(latencies, 1) * 1000:.2f}ms")
+    return results
+
+"""
+Every connection is a file descriptor, so raise the soft limit as far as the hard limit allows.
+"""
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "load test of the game server")
+    parser.add_argument("--clients", type = int, default = 100)
+    parser.add_argument("--messages", type = int, default = 10)
+    parser.add_argument("--host", default = server.SERVER)
+    parser.add_argument("--port", type = int, default = server.PORT)
+    parser.add_argument("--local", action = "store_true", help = "run a server in this process")
+    args = parser.parse_args()
+
+    raise_file_limit()
+    asyncio.run(run(args.clients, args.messages, args.host, args.port, args.local))
@@ -0,0 +1,279 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+
+"""
+Metrics of the rules engine and the server: counters and latency histograms, read as a Prometheus text snapshot
+(see render) that serve hands out on a local port, and a sampling profiler.
+
+Nothing is measured unless the CHESS_METRICS environment variable is set (to anything but 0) when the modules are
+imported. Without it timed gives back the function itself, so the hot paths run exactly as before.
+
+CHESS_METRICS_PORT            -> the local port of the snapshot (default 9100), read with any HTTP client
+CHESS_PROFILE                 -> also start the sampling profiler: the server prints the hottest functions of every
+                                 game when the game ends
+CHESS_PROFILE_INTERVAL        -> the milliseconds between samples (default 5)
+
+Timings are kept by the process that runs the code: with a pool of workers the rules engine runs in the workers,
+so start the server with --workers 0 to see the engine's timings (and profile) in its snapshot.
+"""
+
+ENABLED = os.environ.get("CHESS_METRICS", "0") not in ("", "0")
+PROFILE = ENABLED and os.environ.get("CHESS_PROFILE", "0") not in ("", "0")
+PORT = int(os.environ.get("CHESS_METRICS_PORT", "9100"))
+PROFILE_INTERVAL = float(os.environ.get("CHESS_PROFILE_INTERVAL", "5")) / 1000
+
+# Upper bounds of the histogram buckets in seconds, from 10us to 1s
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0)
+
+# Every counter and histogram by (name, labels), and the functions that give the values of gauges when rendered
+registry = {}
+help_texts = {}
+collectors = []
+profiler = None
+
+
+def label_text(labels, extra = ""):
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra != "":
+        parts.append(extra)
+    if len(parts) == 0:
+        return ""
+    return "{" + ",".join(parts) + "}"
+
+
+"""
+Counter class is a number that only goes up, e.g. the messages received.
+"""
+class Counter():
+    kind = "counter"
+
+    def __init__(self, name, labels = ()):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount = 1):
+        self.value += amount
+
+    def render(self):
+        return [f"{self.name}{label_text(self.labels)} {self.value}"]
+
+
+"""
+Histogram class counts durations in the BUCKETS, with their sum, so the latency can be read at any quantile.
+"""
+class Histogram():
+    kind = "histogram"
+
+    def __init__(self, name, labels = ()):
+        self.name = name
+        self.labels = labels
+        # One count per bucket and one for longer than the last bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self):
+        lines = []
+        total = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), self.counts):
+            total += count
+            bucket = f'le="{bound}"'
+            lines.append(f"{self.name}_bucket{label_text(self.labels, bucket)} {total}")
+        lines.append(f"{self.name}_sum{label_text(self.labels)} {self.sum:.6f}")
+        lines.append(f"{self.name}_count{label_text(self.labels)} {self.count}")
+        return lines
+
+
+def metric(kind, name, help, labels):
+    key = (name, tuple(sorted(labels.items())))
+    if key not in registry:
+        registry[key] = kind(name, key[1])
+        help_texts[name] = help
+    return registry[key]
+
+"""
+Gets the counter of the name and labels, made the first time it is asked for.
+"""
+def counter(name, help = "", **labels):
+    return metric(Counter, name, help, labels)
+
+def histogram(name, help = "", **labels):
+    return metric(Histogram, name, help, labels)
+
+"""
+Adds a function to call for the values of gauges (a dictionary of name -> number) every time a snapshot is made,
+for values that are kept elsewhere such as the counters of the worker pool.
+"""
+def collect(function):
+    collectors.append(function)
+
+"""
+Decorator that times every call of the function (or coroutine function) in the histogram of the name. Without
+CHESS_METRICS the function is given back as it is.
+"""
+def timed(name, help = ""):
+    def decorate(function):
+        if not ENABLED:
+            return function
+        timings = histogram(name, help)
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed_coroutine(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    timings.observe(time.perf_counter() - start)
+            return timed_coroutine
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.observe(time.perf_counter() - start)
+        return timed_function
+    return decorate
+
+
+"""
+Renders every metric in the Prometheus text format.
+"""
+def render():
+    lines = []
+    seen = set()
+    for (name, labels), value in sorted(registry.items(), key = lambda item: item[0]):
+        if name not in seen:
+            seen.add(name)
+            if help_texts[name] != "":
+                lines.append(f"# HELP {name} {help_texts[name]}")
+            lines.append(f"# TYPE {name} {value.kind}")
+        lines += value.render()
+    for function in collectors:
+        for name, value in sorted(function().items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+async def answer(reader, writer):
+    try:
+        # Whatever was asked for, the answer is the snapshot
+        await reader.readuntil(b"\r\n\r\n")
+        body = render().encode("utf-8")
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+"""
+Serves the snapshot over HTTP on the local port, on the running event loop.
+"""
+async def serve(host = "127.0.0.1", port = PORT):
+    server = await asyncio.start_server(answer, host, port)
+    print(f"[METRICS] snapshot served on http://{host}:{port}/metrics")
+    return server
+
+
+"""
+Sampler class is a sampling profiler: a thread that looks at the stack of the thread being profiled every interval
+and counts the function on top of it, so the functions that take the time are counted the most. It costs the
+profiled thread nothing but the switches to the sampling thread.
+
+Parameters:
+interval -> the seconds between samples
+thread_id -> the thread to profile, the thread that makes the Sampler if not given
+"""
+class Sampler(threading.Thread):
+
+    def __init__(self, interval = PROFILE_INTERVAL, thread_id = None):
+        super().__init__(daemon = True)
+        if thread_id == None:
+            thread_id = threading.get_ident()
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = {}
+        self.running = True
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            if frame == None:
+                continue
+            code = frame.f_code
+            name = f"{os.path.basename(code.co_filename)}:{code.co_firstlineno} {code.co_name}"
+            self.samples[name] = self.samples.get(name, 0) + 1
+
+    def stop(self):
+        self.running = False
+
+    """
+    Gets the counts so far, to compare later ones against (see top).
+    """
+    def mark(self):
+        return dict(self.samples)
+
+    """
+    Gets the functions sampled the most since the mark.
+
+    Returns: list of (function, samples), most first
+    """
+    def top(self, mark = None, count = 10):
+        if mark == None:
+            mark = {}
+        counts = []
+        for name, samples in list(self.samples.items()):
+            samples -= mark.get(name, 0)
+            if samples > 0:
+                counts.append((name, samples))
+        counts.sort(key = lambda item: -item[1])
+        return counts[:count]
+
+"""
+Starts the sampling profiler on this thread if CHESS_PROFILE is set.
+
+Returns: the Sampler, or None
+"""
+def start_profiler():
+    global profiler
+    if PROFILE and profiler == None:
+        profiler = Sampler()
+        profiler.start()
+    return profiler
+
+"""
+Gets the mark of the profiler to pass to print_hot later, None if it is not running.
+"""
+def profile_mark():
+    if profiler == None:
+        return None
+    return profiler.mark()
+
+"""
+Prints the functions sampled the most since the mark, e.g. over one game.
+"""
+def print_hot(title, mark, count = 10):
+    if profiler == None or mark == None:
+        return
+    hot = profiler.top(mark, count)
+    total = sum(samples for name, samples in hot)
+    print(f"[PROFILE] {title}: {total} samples of {profiler.interval * 1000:.0f}ms in the top {len(hot)} functions")
+    for name, samples in hot:
+        print(f"[PROFILE]   {samples:>6} {name}")
@@ -0,0 +1,187 @@
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import chess
+import search
+
+"""
+Parallel search over a pool of processes, since Python threads can not run a CPU bound search side by side.
+
+Two ways of splitting the work are offered:
+"split" -> the root moves are dealt out over the workers, each searches its own share and the results are compared
+           at the deepest depth every worker finished
+"lazy"  -> (Lazy SMP) every worker searches all root moves, each in a different order, and they help each other
+           through the transposition table they share
+
+In both, the workers share one transposition table that lives in shared memory (see SharedTable).
+"""
+
+entry_format = struct.Struct("<QQ")
+SCORE_OFFSET = 1 << 19
+
+
+"""
+SharedTable class is a transposition table stored in a block of shared memory, so every process of the pool reads and
+writes the same entries. It has the same probe/store/new_search methods as zobrist.TranspositionTable.
+
+Each slot is 16 bytes: the entry packed into 64 bits (depth, kind, score, move and age) and the key XORed with it.
+No lock is taken, a slot that is half written by another process simply fails the key check and counts as a miss.
+
+Parameters:
+size -> the number of slots, rounded up to a power of two
+name -> the name of an existing block to attach to, a new block is made if not given
+"""
+class SharedTable():
+
+    def __init__(self, size = 1 << 18, name = None):
+        size = 1 << (size - 1).bit_length()
+        self.mask = size - 1
+        if name == None:
+            self.memory = shared_memory.SharedMemory(create = True, size = size * entry_format.size)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name = name)
+            self.owner = False
+        self.name = self.memory.name
+        self.buffer = self.memory.buf
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.mask + 1
+
+    def probe(self, key):
+        check, data = entry_format.unpack_from(self.buffer, (key & self.mask) * entry_format.size)
+        if data != 0 and check ^ data == key:
+            self.hits += 1
+            return (data & 0xFF, (data >> 10 & 0xFFFFF) - SCORE_OFFSET, data >> 8 & 3, data >> 30 & 0x7FFF)
+        self.misses += 1
+        return None
+
+    """
+    Stores the entry (depth, score, kind, move) with the same replacement policy as zobrist.TranspositionTable.
+    """
+    def store(self, key, depth, entry):
+        offset = (key & self.mask) * entry_format.size
+        check, data = entry_format.unpack_from(self.buffer, offset)
+        if data != 0 and check ^ data != key and data >> 45 == self.age and depth < data & 0xFF:
+            return
+        depth, score, kind, move = entry
+        data = min(depth, 0xFF) | kind << 8 | (score + SCORE_OFFSET) << 10 | move << 30 | self.age << 45
+        entry_format.pack_into(self.buffer, offset, key ^ data, data)
+
+    def new_search(self):
+        pass
+
+    def clear(self):
+        self.buffer[:] = bytes(len(self.buffer))
+
+    """
+    Detaches from the shared memory, the process that made the block also frees it.
+    """
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# The shared table of a worker process, attached once when the process starts
+worker_table = None
+
+def attach(name, size):
+    global worker_table
+    worker_table = SharedTable(size, name)
+
+"""
+Runs in a worker process: searches the board with the given root moves.
+
+Returns: the (depth, score, move) of every depth the worker finished and the number of nodes searched
+"""
+def search_moves(board, moves, time_ms, max_depth, age):
+    worker_table.age = age
+    engine = search.Search(board, worker_table)
+    engine.iterate(time_ms, max_depth, moves)
+    return engine.results, engine.nodes
+
+
+"""
+ParallelSearch class keeps a pool of worker processes and their shared table, to be reused for every search.
+
+Parameters:
+workers -> the number of worker processes, one per CPU if not given
+mode -> "split" or "lazy" (see above)
+table_size -> the number of slots of the shared transposition table
+"""
+class ParallelSearch():
+
+    def __init__(self, workers = None, mode = "split", table_size = 1 << 18):
+        if workers == None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.mode = mode
+        self.table = SharedTable(table_size)
+        self.executor = ProcessPoolExecutor(workers, initializer = attach, initargs = (self.table.name, table_size))
+        self.nodes = 0
+
+    """
+    Searches the side to move of the board with all the workers.
+
+    Returns: the best move (or None if there are no legal moves), its score and the depth it was searched to
+    """
+    def iterate(self, board, time_ms, max_depth = 64):
+        moves = board.generate_moves(board.turn)
+        if len(moves) == 0:
+            return None, 0, 0
+        self.table.age = (self.table.age + 1) & 0xFF
+
+        if self.mode == "split":
+            shares = [moves[i::self.workers] for i in range(self.workers)]
+        else:
+            shares = [moves[i % len(moves):] + moves[:i % len(moves)] for i in range(self.workers)]
+        futures = []
+        for share in shares:
+            if len(share) != 0:
+                futures.append(self.executor.submit(search_moves, board, share, time_ms, max_depth, self.table.age))
+
+        results = []
+        self.nodes = 0
+        for future in futures:
+            worker_results, nodes = future.result()
+            results.append(worker_results)
+            self.nodes += nodes
+
+        if self.mode == "split":
+            # Scores of different depths do not compare, so use the deepest depth every worker finished
+            depth = min(len(worker_results) for worker_results in results)
+            best = max((worker_results[depth - 1] for worker_results in results), key = lambda result: result[1])
+        else:
+            best = max((worker_results[-1] for worker_results in results), key = lambda result: result[0])
+        depth, score, move = best
+        return move, score, depth
+
+    def close(self):
+        self.executor.shutdown()
+        self.table.close()
+
+
+"""
+Finds the best move of a position with a pool of workers, like search.best_move.
+For repeated searches keep a ParallelSearch instead, so the pool is only started once.
+"""
+def best_move(board_string, time_ms, team = "white", turn = None, workers = None, mode = "split"):
+    board = chess.ChessBoard(board_string, team)
+    if turn == None:
+        turn = team
+    board.set_turn(turn)
+    engine = ParallelSearch(workers, mode)
+    try:
+        move, score, depth = engine.iterate(board, time_ms)
+    finally:
+        engine.close()
+    if move == None:
+        return None
+    return board.move_name(move)
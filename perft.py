@@ -0,0 +1,254 @@
+import argparse
+import sys
+import time
+import tracemalloc
+
+import chess
+import zobrist
+
+"""
+Benchmark of the ChessBoard move generation. Every position is counted with ChessBoard.perft and compared
+against its well known node counts, so a change to the move generation that breaks a rule shows up as a
+wrong count, and a change that slows it down shows up in the nodes per second.
+
+Run with: python perft.py [--depth N] [--memory] [--cache] [--divide FEN] [--boards N] [--codec N]
+"""
+
+# (name, FEN, node counts from depth 1 upwards)
+POSITIONS = [
+    ("start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+        [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        [48, 2039, 97862, 4085603]),
+    ("rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        [14, 191, 2812, 43238, 674624]),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        [6, 264, 9467, 422333]),
+    ("middlegame", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        [44, 1486, 62379, 2103487]),
+    ("symmetrical", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+        [46, 2079, 89890, 3894594]),
+]
+
+
+"""
+Counts one position to the given depth, from the perspective of the given team.
+
+With cache the board gets a move cache (see ChessBoard.generate_moves), which makes transpositions free, so it
+is off by default to time the move generation itself.
+
+Returns: the node count, the time taken in seconds and the peak memory in bytes (0 unless memory is True)
+"""
+def run(fen, depth, team = "white", memory = False, cache = False):
+    board = chess.ChessBoard(team = team)
+    board.load_fen(fen)
+    if cache:
+        board.move_table = zobrist.TranspositionTable(chess.MOVE_TABLE_SIZE)
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    nodes = board.perft(depth)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return nodes, elapsed, peak
+
+"""
+Checks that the Piece objects of every position can be passed back to the board: their type and colour work as
+the old names in get_pieces_by_type, piece_count and string comparisons, and empty squares have no positions.
+
+Returns: True if every check passed
+"""
+def check_pieces():
+    passed = True
+    for name, fen, counts in POSITIONS:
+        for team in ("white", "black"):
+            board = chess.ChessBoard(team = team)
+            board.load_fen(fen)
+            for i in range(64):
+                piece = board.get_piece(chess.coords_of(i))
+                if not piece.is_piece():
+                    passed = passed and board.get_positions(piece) == []
+                    continue
+                type = piece.get_type()
+                colour = piece.get_colour()
+                same = board.get_pieces_by_type(type, colour)
+                passed = passed and type == str(type) and not type != str(type) and colour == str(colour) \
+                    and chess.code_to_type[chess.type_to_code[type]] == type \
+                    and piece.get_position() in [other.get_position() for other in same] \
+                    and board.piece_count(type, colour) == len(same)
+    print(f"[PIECES] {'passed' if passed else 'FAILED'}")
+    return passed
+
+"""
+Times the paths of the GUI on every piece of this team in every position: get_positions, then prune_checks on the
+board itself (make_move/unmake_move) and on a copy of it (move_piece), and checks that both prunings agree with
+get_positions(prune = True), which takes the squares from the legal moves.
+
+Returns: True if the squares agreed everywhere
+"""
+def gui_paths(teams = ("white", "black")):
+    passed = True
+    calls = 0
+    times = {"get_positions": 0, "prune_checks": 0, "move_piece": 0}
+    for name, fen, counts in POSITIONS:
+        for team in teams:
+            board = chess.ChessBoard(team = team)
+            board.load_fen(fen)
+            board.set_turn(team)
+            copy = bytearray(board.board)
+            for piece in board.pieces:
+                start = time.perf_counter()
+                possible = board.get_positions(piece)
+                times["get_positions"] += time.perf_counter() - start
+                start = time.perf_counter()
+                pruned = board.prune_checks(piece, possible, board.board)
+                times["prune_checks"] += time.perf_counter() - start
+                start = time.perf_counter()
+                copied = board.prune_checks(piece, board.get_positions(piece, copy), copy)
+                times["move_piece"] += time.perf_counter() - start
+                legal = board.get_positions(piece, prune = True)
+                calls += 1
+                if sorted(pruned) != sorted(legal) or sorted(copied) != sorted(legal):
+                    passed = False
+                    print(f"[GUI] MISMATCH {name} {team} {piece}: {sorted(pruned)} {sorted(copied)} {sorted(legal)}")
+    print(f"[GUI] {calls} pieces: " + ", ".join(f"{path} {seconds / calls * 1000000:.1f}us"
+                                               for path, seconds in times.items()))
+    return passed
+
+"""
+Runs every position up to the depth and prints a report.
+
+Returns: True if every count matched
+"""
+def benchmark(depth, teams = ("white", "black"), memory = False, cache = False):
+    passed = True
+    total_nodes = 0
+    total_time = 0
+    print(f"{'position':<14}{'team':<7}{'depth':>6}{'nodes':>10}{'expected':>10}{'seconds':>9}{'nps':>9}{'peak KiB':>10}")
+    for name, fen, counts in POSITIONS:
+        for team in teams:
+            d = min(depth, len(counts))
+            nodes, elapsed, peak = run(fen, d, team, memory, cache)
+            total_nodes += nodes
+            total_time += elapsed
+            status = ""
+            if nodes != counts[d - 1]:
+                passed = False
+                status = "  MISMATCH"
+            print(f"{name:<14}{team:<7}{d:>6}{nodes:>10}{counts[d - 1]:>10}{elapsed:>9.3f}{nodes / elapsed:>9.0f}"
+                  f"{peak / 1024:>10.0f}{status}")
+    print(f"[TOTAL] {total_nodes} nodes in {total_time:.3f}s, {total_nodes / total_time:.0f} nodes per second")
+    return passed
+
+"""
+Measures the memory of boards that are made and kept, as the server keeps one per game: a new board, the Piece
+objects of its team and the Piece objects of all 64 squares.
+
+Returns: dictionary of the bytes per board, per pieces list and per 64 get_piece calls
+"""
+def board_memory(count = 200):
+    def measure(make):
+        tracemalloc.start()
+        kept = [make() for i in range(count)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / count
+
+    board = chess.ChessBoard(team = "white")
+    sizes = {
+        "board": measure(lambda: chess.ChessBoard(team = "white")),
+        "pieces": measure(lambda: board.pieces),
+        "squares": measure(lambda: [board.get_piece(chess.coords_of(i)) for i in range(64)])
+    }
+    print(f"[MEMORY] {sizes['board']:.0f} bytes per board, {sizes['pieces']:.0f} per pieces list, "
+          f"{sizes['squares']:.0f} per 64 get_piece calls")
+    return sizes
+
+"""
+Times the board codec (encode_board, decode_board, flip_board and the FEN conversion) against the conversions it
+replaced, which went through the board one character at a time, on the positions of the benchmark.
+
+Returns: dictionary of (old, new) microseconds per call by conversion
+"""
+def codec_speed(count = 20000):
+    def per_call(function):
+        start = time.perf_counter()
+        for i in range(count):
+            function()
+        return (time.perf_counter() - start) / count * 1000000
+
+    def old_to_string(board):
+        return "".join([chess.code_to_string[i & ~chess.MOVED] for i in board])
+
+    def old_from_string(string):
+        return bytearray(chess.string_to_code[i] for i in string)
+
+    def old_from_fen(fen):
+        string = ""
+        for i in fen.split()[0]:
+            if i.isdigit():
+                string += "~" * int(i)
+            elif i != "/":
+                string += chess.fen_to_string[i]
+        return old_from_string(string[::-1])
+
+    def old_pieces(board):
+        return board.list_from_board()
+
+    times = {}
+    pool = chess.PiecePool()
+    for name, fen, counts in POSITIONS:
+        board = chess.ChessBoard(team = "black")
+        board.load_fen(fen)
+        string = board.convert_to_string()
+        assert chess.decode_board(string) == old_from_string(string)
+        assert chess.decode_board(fen.split()[0].translate(chess.FEN_TO_STRING), True) == old_from_fen(fen)
+        conversions = {
+            "encode": (lambda: old_to_string(board.board), lambda: chess.encode_board(board.board)),
+            "encode flipped": (lambda: old_to_string(board.board)[::-1], lambda: chess.encode_board(board.board, True)),
+            "decode": (lambda: old_from_string(string), lambda: chess.decode_board(string)),
+            "decode flipped": (lambda: old_from_string(string[::-1]), lambda: chess.decode_board(string, True)),
+            "fen board": (lambda: old_from_fen(fen),
+                          lambda: chess.decode_board(fen.split()[0].translate(chess.FEN_TO_STRING), True)),
+            "pieces": (lambda: old_pieces(board), lambda: board.list_from_board(pool = pool))
+        }
+        for conversion, (old, new) in conversions.items():
+            old_time, new_time = times.get(conversion, (0, 0))
+            times[conversion] = (old_time + per_call(old) / len(POSITIONS), new_time + per_call(new) / len(POSITIONS))
+
+    for conversion, (old, new) in times.items():
+        print(f"[CODEC] {conversion:<15}{old:>8.2f}us ->{new:>6.2f}us  {old / new:>5.1f}x")
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "perft benchmark of the ChessBoard move generation")
+    parser.add_argument("--depth", type = int, default = 3)
+    parser.add_argument("--memory", action = "store_true", help = "measure the peak memory (slower)")
+    parser.add_argument("--cache", action = "store_true", help = "give the boards a move cache (not timing generation)")
+    parser.add_argument("--team", choices = ["white", "black"], help = "only run one perspective")
+    parser.add_argument("--divide", metavar = "FEN", help = "print the count of every move of the position")
+    parser.add_argument("--boards", type = int, metavar = "N", help = "measure the memory of N boards instead")
+    parser.add_argument("--codec", type = int, metavar = "N", help = "time N conversions of the board codec instead")
+    args = parser.parse_args()
+
+    if args.boards:
+        board_memory(args.boards)
+    elif args.codec:
+        codec_speed(args.codec)
+    elif args.divide:
+        board = chess.ChessBoard(team = args.team or "white")
+        board.load_fen(args.divide)
+        counts = board.divide(args.depth)
+        for move in sorted(counts):
+            print(f"{move}: {counts[move]}")
+        print(f"[TOTAL] {sum(counts.values())}")
+    else:
+        teams = ("white", "black")
+        if args.team:
+            teams = (args.team,)
+        if not check_pieces() or not gui_paths(teams) or not benchmark(args.depth, teams, args.memory, args.cache):
+            sys.exit(1)
@@ -0,0 +1,320 @@
+import chess
+from framing import frame, FORMAT
+
+"""
+Wire formats of the game server. The sessions give and take messages as tuples, e.g. ("MOVE", "e2e4") or
+("MOVED", move, changes, status), and each connection turns them into bytes in one of two formats:
+
+Text (the first clients): every message is a 64 byte header holding its length in ASCII digits, followed by the
+message as UTF-8 text (see encode_text and decode_text).
+
+Binary: the client opens with the two bytes MAGIC, VERSION and the server answers with a HELLO frame. After that
+every frame is its length as a varint, a byte for its type and the fields of the type:
+
+ACK         -> nothing
+JOIN, HINT, STATS, DISCONNECT, WAITING -> nothing
+MOVE        -> the move in 2 bytes
+START       -> the colour of the player (0 black, 1 white) and the board in 32 bytes, two squares per byte
+MOVED       -> the move in 2 bytes, a byte of flags (1 check) and an (index, piece) byte pair for every square
+               that changed
+ILLEGAL     -> a byte for the reason and the move as it was sent, in ASCII
+BUSY        -> the move in ASCII
+HINT        -> the move in 2 bytes, or nothing if there is no legal move (from the server)
+END         -> a byte for the result
+TEXT, STATS -> UTF-8 text (from the server)
+
+A move is start | end << 6 | promotion << 12 (as in chess.encode_move), with the squares numbered as in the
+board string from the white team's perspective (a8 is 0, h1 is 63) whatever the colour of the player. Pieces are
+the codes of chess.py without the MOVED flag. A move and the reply to it are 13 bytes on the wire instead of about
+160 as text (run this file to measure), and the frames of one turn of the event loop go out in one write (see
+Connection in server.py).
+"""
+
+MAGIC = 0xC5
+VERSION = 1
+VERSIONS = (1,)
+
+HELLO = 0
+ACK = 1
+JOIN = 2
+MOVE = 3
+HINT = 4
+STATS = 5
+DISCONNECT = 6
+WAITING = 7
+START = 8
+MOVED = 9
+ILLEGAL = 10
+BUSY = 11
+END = 12
+TEXT = 13
+
+types = {
+    "HELLO": HELLO,
+    "ACK": ACK,
+    "JOIN": JOIN,
+    "MOVE": MOVE,
+    "HINT": HINT,
+    "STATS": STATS,
+    "DISCONNECT": DISCONNECT,
+    "WAITING": WAITING,
+    "START": START,
+    "MOVED": MOVED,
+    "ILLEGAL": ILLEGAL,
+    "BUSY": BUSY,
+    "END": END,
+    "TEXT": TEXT
+}
+type_names = {value: key for key, value in types.items()}
+
+reasons = ("no-game", "game-over", "not-your-turn", "illegal-move")
+results = ("checkmate black", "checkmate white", "stalemate", "abandoned")
+
+# The text commands of the clients and the messages they stand for
+commands = {
+    "!JOIN": "JOIN",
+    "!HINT": "HINT",
+    "!STATS": "STATS",
+    "!DISCONNECT": "DISCONNECT"
+}
+
+CHECK = 1
+
+
+"""
+Converts between moves and their coordinate notation (e.g. e2e4), with the squares numbered from the white
+team's perspective.
+"""
+def move_to_name(move):
+    start, end, promotion = chess.decode_move(move)
+    name = square_name(start) + square_name(end)
+    if promotion != chess.EMPTY:
+        name += "nbrq"[promotion - chess.KNIGHT]
+    return name
+
+def name_to_move(name):
+    if len(name) not in (4, 5) or name[0] not in "abcdefgh" or name[2] not in "abcdefgh" \
+        or name[1] not in "12345678" or name[3] not in "12345678":
+        return None
+    promotion = chess.EMPTY
+    if len(name) == 5:
+        if name[4] not in "nbrq":
+            return None
+        promotion = "nbrq".index(name[4]) + chess.KNIGHT
+    return chess.encode_move(square_of(name[0:2]), square_of(name[2:4]), promotion)
+
+def square_name(index):
+    return "abcdefgh"[index % 8] + str(8 - index // 8)
+
+def square_of(name):
+    return (8 - int(name[1])) * 8 + "abcdefgh".index(name[0])
+
+
+def write_varint(value, out):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+"""
+Reads a varint from the buffer at the offset.
+
+Returns: the value and the offset after it, or None if the buffer ends first
+"""
+def read_varint(buffer, offset):
+    value = 0
+    shift = 0
+    while offset < len(buffer):
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+        if shift > 28:
+            raise ValueError("varint too long")
+    return None
+
+
+"""
+Packs the 64 squares of a board into 32 bytes, two 4 bit piece codes per byte.
+"""
+def pack_board(board):
+    return bytes((board[i] & 15) << 4 | board[i + 1] & 15 for i in range(0, 64, 2))
+
+def unpack_board(data):
+    board = bytearray(64)
+    for i in range(32):
+        board[2 * i] = data[i] >> 4
+        board[2 * i + 1] = data[i] & 15
+    return board
+
+
+"""
+Encodes one message as a binary frame and adds it to out.
+"""
+def encode_binary(message, out):
+    kind = message[0]
+    payload = bytearray([types[kind]])
+    if kind == "HELLO":
+        payload.append(message[1])
+    elif kind in ("MOVE", "HINT") and len(message) > 1:
+        if message[1] != None:
+            move = message[1]
+            if isinstance(move, str):
+                move = name_to_move(move)
+            payload += move.to_bytes(2, "little")
+    elif kind == "START":
+        payload.append(int(message[1] == "white"))
+        payload += pack_board(message[2])
+    elif kind == "MOVED":
+        move, changes, status = message[1:]
+        payload += move.to_bytes(2, "little")
+        payload.append(CHECK if status == "check" else 0)
+        for index, code in changes:
+            payload.append(index)
+            payload.append(code & 15)
+    elif kind == "ILLEGAL":
+        payload.append(reasons.index(message[2]))
+        payload += message[1].encode(FORMAT)
+    elif kind == "BUSY":
+        payload += message[1].encode(FORMAT)
+    elif kind == "END":
+        payload.append(results.index(message[1]))
+    elif kind in ("TEXT", "STATS") and len(message) > 1:
+        payload += message[1].encode(FORMAT)
+    write_varint(len(payload), out)
+    out += payload
+
+"""
+Encodes several messages into one block of bytes, to be sent with a single call.
+"""
+def encode_batch(messages):
+    out = bytearray()
+    for message in messages:
+        encode_binary(message, out)
+    return bytes(out)
+
+"""
+Decodes the payload of one binary frame (its type byte and fields) into a message.
+"""
+def decode_binary(payload):
+    kind = type_names[payload[0]]
+    data = payload[1:]
+    if kind == "HELLO":
+        return (kind, data[0])
+    if kind in ("MOVE", "HINT"):
+        if len(data) < 2:
+            return (kind,) if kind == "HINT" else (kind, None)
+        return (kind, int.from_bytes(data[:2], "little"))
+    if kind == "START":
+        return (kind, "white" if data[0] else "black", unpack_board(data[1:33]))
+    if kind == "MOVED":
+        changes = [(data[i], data[i + 1]) for i in range(3, len(data) - 1, 2)]
+        return (kind, int.from_bytes(data[:2], "little"), changes, "check" if data[2] & CHECK else "")
+    if kind == "ILLEGAL":
+        return (kind, bytes(data[1:]).decode(FORMAT), reasons[data[0]])
+    if kind == "BUSY":
+        return (kind, bytes(data).decode(FORMAT))
+    if kind == "END":
+        return (kind, results[data[0]])
+    if kind == "TEXT" or kind == "STATS" and len(data) > 0:
+        return (kind, bytes(data).decode(FORMAT))
+    return (kind,)
+
+
+"""
+Decoder class collects the bytes of a binary stream and cuts them into messages, however the frames were split
+or batched by the network.
+
+Parameters:
+max_frame -> the longest frame allowed, a longer one raises ValueError
+"""
+class Decoder():
+
+    def __init__(self, max_frame = 4096):
+        self.buffer = bytearray()
+        self.max_frame = max_frame
+
+    """
+    Adds received bytes and returns the messages of every frame they completed.
+    """
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        offset = 0
+        while True:
+            header = read_varint(buffer, offset)
+            if header == None:
+                break
+            length, start = header
+            if length == 0 or length > self.max_frame:
+                raise ValueError(f"bad frame length {length}")
+            if start + length > len(buffer):
+                break
+            try:
+                messages.append(decode_binary(buffer[start:start + length]))
+            except (KeyError, IndexError, UnicodeDecodeError):
+                raise ValueError("bad frame")
+            offset = start + length
+        del buffer[:offset]
+        return messages
+
+
+"""
+Encodes a message for a text client, from the perspective of the player's colour (the board of a black player is
+inverted, so its indexes are flipped).
+"""
+def encode_text(message, colour = "white"):
+    kind = message[0]
+    if kind == "START":
+        text = chess.encode_board(message[2], colour == "black")
+        msg = f"START {message[1]} {text}"
+    elif kind == "MOVED":
+        move, changes, status = message[1:]
+        diff = []
+        for index, code in changes:
+            if colour == "black":
+                index = 63 - index
+            diff.append(f"{index}:{chess.code_to_string[code & 15]}")
+        msg = f"MOVED {move_to_name(move)} {','.join(diff)}"
+        if status != "":
+            msg += " " + status
+    elif kind == "ACK":
+        msg = "Msg received"
+    elif kind == "HINT":
+        msg = f"HINT {message[1] or 'none'}"
+    elif kind in ("TEXT", "STATS"):
+        msg = message[1] if kind == "TEXT" else "STATS " + message[1]
+    else:
+        msg = " ".join(str(field) for field in message)
+    return frame(msg)
+
+"""
+Decodes the text of a message from a text client into a message.
+"""
+def decode_text(msg):
+    if msg in commands:
+        return (commands[msg],)
+    if msg.startswith("!MOVE "):
+        return ("MOVE", msg[6:].strip())
+    return ("TEXT", msg)
+
+
+if __name__ == "__main__":
+    # Bytes on the wire for each move of a short game, in both formats
+    game = chess.ChessBoard(team = "white")
+    names = ["e2e4", "e7e5", "f1c4", "b8c6", "d1h5", "g8f6", "h5f7"]
+    text_bytes = 0
+    binary_bytes = 0
+    for name in names:
+        move = game.parse_move(name)
+        before = bytes(game.board)
+        game.make_move(move)
+        changes = [(i, game.board[i]) for i in range(64) if (game.board[i] ^ before[i]) & ~chess.MOVED]
+        text_bytes += len(frame("!MOVE " + name)) + len(encode_text(("MOVED", move, changes, "")))
+        binary_bytes += len(encode_batch([("MOVE", move), ("MOVED", move, changes, "")]))
+    print(f"[TEXT] {text_bytes / len(names):.1f} bytes per move")
+    print(f"[BINARY] {binary_bytes / len(names):.1f} bytes per move")
+    print(f"[RATIO] {text_bytes / binary_bytes:.1f} times smaller")
@@ -0,0 +1,382 @@
+import time
+
+import chess
+import tablebase
+import zobrist
+from chess import EMPTY, PAWN, WHITE, BLACK, colour_to_code
+
+"""
+Search engine built on the ChessBoard move generation. It is a negamax alpha-beta search with iterative
+deepening: it searches one half move deeper at a time until the time budget runs out, and answers with the best
+move of the last depth that finished. Captures are searched on in a quiescence search, so a position is not
+judged in the middle of an exchange.
+
+Moves are ordered by the move stored in the transposition table, then captures by most valuable victim and least
+valuable attacker (MVV-LVA), promotions, the killer moves of the ply and the history of quiet moves that
+caused cut-offs before.
+
+Known positions are looked up before anything is searched: the root move comes from the opening book or the
+endgame tablebases if they have the position, and a position of three pieces or less inside the search is scored
+from the tablebases that are loaded.
+"""
+
+MATE = 100000
+INFINITY = 1000000
+MAX_PLY = 128
+
+# Kinds of transposition table entries
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+values = (0, 100, 320, 330, 500, 900, 0)
+
+
+class Timeout(Exception):
+    pass
+
+
+"""
+Search class holds the state of the search of one board: the transposition table, killer moves and history.
+
+Parameters:
+board -> the ChessBoard to search, its side to move is the one searched for
+table -> the TranspositionTable to use, a new one is made if not given
+book -> the book.Book to take the moves of the opening from
+"""
+class Search():
+
+    def __init__(self, board, table = None, book = None):
+        self.board = board
+        # The move cache of the board while it is searched, taken off again after (see iterate)
+        self.move_table = zobrist.TranspositionTable(chess.MOVE_TABLE_SIZE)
+        self.book = book
+        if table == None:
+            table = zobrist.TranspositionTable(1 << 18)
+        self.table = table
+        self.killers = [[0, 0] for i in range(MAX_PLY)]
+        self.history = [[0] * 64 for i in range(64)]
+        self.nodes = 0
+        self.depth = 0
+        self.deadline = None
+
+    """
+    Searches one half move deeper at a time until the time is up.
+
+    Parameters: time_ms -> the time budget in milliseconds
+                max_depth -> the depth to stop at even if there is time left
+                moves -> the root moves to choose from, all legal moves if not given
+    Returns: the best move (or None if there are no legal moves), its score in centipawns for the side to move
+             and the depth that was finished. The result of every finished depth is kept in self.results.
+    """
+    def iterate(self, time_ms, max_depth = 64, moves = None):
+        # A board without a move cache of its own (e.g. the board of a game searched for a hint) only has the
+        # search's for the length of the search, so it does not keep the memory
+        board = self.board
+        previous = board.move_table
+        if previous == None:
+            board.move_table = self.move_table
+        try:
+            return self.deepen(time_ms, max_depth, moves)
+        finally:
+            board.move_table = previous
+
+    def deepen(self, time_ms, max_depth, moves):
+        board = self.board
+        start = time.perf_counter()
+        self.deadline = start + time_ms / 1000
+        self.table.new_search()
+        self.nodes = 0
+        self.results = []
+        self.all_moves = moves == None
+        if moves == None:
+            moves = board.generate_moves(board.turn)
+        moves = list(moves)
+        if len(moves) == 0:
+            return None, 0, 0
+        if self.all_moves:
+            found = self.lookup()
+            if found != None:
+                self.results.append((0, found[1], found[0]))
+                return found[0], found[1], 0
+
+        best_move = moves[0]
+        best_score = 0
+        finished = 0
+        length = len(board.history)
+        for depth in range(1, max_depth + 1):
+            self.depth = depth
+            try:
+                score, move = self.root(depth, moves)
+            except Timeout:
+                # Take back the moves of the search that was cut off
+                while len(board.history) > length:
+                    board.unmake_move()
+                break
+            best_move = move
+            best_score = score
+            finished = depth
+            self.results.append((depth, score, move))
+            # Search the best move first at the next depth
+            moves.remove(move)
+            moves.insert(0, move)
+            if abs(score) > MATE - MAX_PLY:
+                break
+            # The next depth takes several times as long, so it would not finish in the time left
+            if time.perf_counter() - start > (time_ms / 1000) / 2:
+                break
+        return best_move, best_score, finished
+
+    """
+    Looks the root position up in the opening book and the tablebases.
+
+    Returns: (move, score) or None if neither has the position
+    """
+    def lookup(self):
+        board = self.board
+        if self.book != None:
+            move = self.book.choose(board)
+            if move != None:
+                return move, 0
+        if tablebase.tables:
+            result = tablebase.probe(board)
+            move = tablebase.best_move(board)
+            if move != None:
+                return move, self.tablebase_score(result, 0)
+        return None
+
+    def tablebase_score(self, result, ply):
+        outcome, distance = result
+        if outcome == 0:
+            return 0
+        return outcome * (MATE - ply - distance)
+
+    def root(self, depth, moves):
+        board = self.board
+        alpha = -INFINITY
+        best_move = moves[0]
+        for move in moves:
+            board.make_move(move)
+            score = -self.negamax(depth - 1, -INFINITY, -alpha, 1)
+            board.unmake_move()
+            if score > alpha:
+                alpha = score
+                best_move = move
+        # The score is only exact for the position if every move was searched
+        if self.all_moves:
+            self.table.store(board.key, depth, (depth, alpha, EXACT, best_move))
+        return alpha, best_move
+
+    """
+    Searches the position to the depth.
+
+    Parameters: depth -> the number of half moves left to search
+                alpha, beta -> the window of scores that still matter
+                ply -> the number of half moves played since the root
+    Returns: the score of the position for the side to move
+    """
+    def negamax(self, depth, alpha, beta, ply):
+        board = self.board
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_time()
+        if self.repeated():
+            return 0
+        if tablebase.tables and (board.bitboards[WHITE] | board.bitboards[BLACK]).bit_count() <= 3:
+            result = tablebase.probe(board)
+            if result != None:
+                return self.tablebase_score(result, ply)
+
+        colour = board.turn
+        in_check = self.in_check(colour)
+        # Checks are searched one half move further, so the quiescence search is never entered in check
+        if in_check:
+            depth += 1
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self.quiescence(alpha, beta, ply)
+
+        table_move = 0
+        entry = self.table.probe(board.key)
+        if entry != None:
+            entry_depth, score, kind, table_move = entry
+            if entry_depth >= depth:
+                score = from_table(score, ply)
+                if kind == EXACT:
+                    return score
+                if kind == LOWER and score > alpha:
+                    alpha = score
+                elif kind == UPPER and score < beta:
+                    beta = score
+                if alpha >= beta:
+                    return score
+
+        moves = board.generate_moves(colour)
+        if len(moves) == 0:
+            if in_check:
+                return -MATE + ply
+            return 0
+        self.order(moves, table_move, ply)
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = moves[0]
+        for move in moves:
+            board.make_move(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if not self.is_capture(move):
+                            self.add_killer(move, ply)
+                            self.history[move & 63][move >> 6 & 63] += depth * depth
+                        break
+
+        if best_score <= original_alpha:
+            kind = UPPER
+        elif best_score >= beta:
+            kind = LOWER
+        else:
+            kind = EXACT
+        self.table.store(board.key, depth, (depth, to_table(best_score, ply), kind, best_move))
+        return best_score
+
+    """
+    Searches only captures and promotions until the position is quiet. The side to move may also
+    "stand pat" on the static evaluation instead of taking.
+    """
+    def quiescence(self, alpha, beta, ply):
+        board = self.board
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_time()
+
+        stand_pat = self.evaluate()
+        if stand_pat >= beta or ply >= MAX_PLY - 1:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        moves = []
+        for move in board.generate_moves(board.turn):
+            if move >> 12 != EMPTY or self.is_capture(move):
+                moves.append(move)
+        self.order(moves, 0, ply)
+        for move in moves:
+            board.make_move(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def evaluate(self):
+        return self.board.evaluate()
+
+    """
+    Sorts the moves so the ones most likely to cause a cut-off are searched first.
+    """
+    def order(self, moves, table_move, ply):
+        board = self.board.board
+        killers = self.killers[ply]
+        history = self.history
+
+        def score(move):
+            if move == table_move:
+                return 1 << 30
+            start = move & 63
+            end = move >> 6 & 63
+            if board[end] != EMPTY:
+                return (1 << 29) + values[board[end] & 7] * 16 - values[board[start] & 7] // 16
+            if move >> 12 != EMPTY:
+                return (1 << 28) + values[move >> 12]
+            if move == killers[0]:
+                return 1 << 27
+            if move == killers[1]:
+                return (1 << 27) - 1
+            return history[start][end]
+
+        moves.sort(key = score, reverse = True)
+
+    def add_killer(self, move, ply):
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+    def is_capture(self, move):
+        board = self.board.board
+        end = move >> 6 & 63
+        if board[end] != EMPTY:
+            return True
+        start = move & 63
+        # En passant
+        return board[start] & 7 == PAWN and start % 8 != end % 8
+
+    def in_check(self, colour):
+        king = self.board.kings[colour_to_code[colour]]
+        return king != -1 and self.board.is_square_attacked(king, chess.team[colour])
+
+    """
+    Checks if the position came up before with the same side to move, since the last capture or pawn move
+    (which can not be taken back, so nothing before them can repeat).
+    """
+    def repeated(self):
+        history = self.board.history
+        key = self.board.key
+        for i in range(len(history) - 1, -1, -1):
+            move, code, captured = history[i][:3]
+            if captured != EMPTY or code & 7 == PAWN:
+                return False
+            if (len(history) - i) % 2 == 0 and history[i][7] == key:
+                return True
+        return False
+
+    def check_time(self):
+        # The first depth is always finished so there is a move to play
+        if self.depth > 1 and time.perf_counter() > self.deadline:
+            raise Timeout()
+
+
+"""
+Mate scores are stored relative to the position in the transposition table and relative to the root in the search.
+"""
+def to_table(score, ply):
+    if score > MATE - MAX_PLY:
+        return score + ply
+    if score < -MATE + MAX_PLY:
+        return score - ply
+    return score
+
+def from_table(score, ply):
+    if score > MATE - MAX_PLY:
+        return score - ply
+    if score < -MATE + MAX_PLY:
+        return score + ply
+    return score
+
+
+"""
+Finds the best move of a position within the time budget.
+
+Parameters: board_string -> the 64 character board string
+            time_ms -> the time budget in milliseconds
+            team -> the perspective of the board string
+            turn -> the side to move, the team if not given
+            book -> the book.Book to look the opening up in
+Returns: the move in coordinate notation (e.g. e2e4) from the team's perspective, or None if there are no legal moves
+"""
+def best_move(board_string, time_ms, team = "white", turn = None, book = None):
+    board = chess.ChessBoard(board_string, team)
+    if turn == None:
+        turn = team
+    board.set_turn(turn)
+    move, score, depth = Search(board, book = book).iterate(time_ms)
+    if move == None:
+        return None
+    return board.move_name(move)
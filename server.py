@@ -1,45 +1,275 @@
-import socket 
-import threading
+import socket
+import asyncio
+import argparse
+import itertools
+import json
+import time
 
-HEADER = 64
+import framing
+import metrics
+import protocol
+import sessions
+import store
+import tablebase
+import workers
+
+HEADER = framing.HEADER
 PORT = 5050
 SERVER = socket.gethostbyname(socket.gethostname())
 ADDR = (SERVER, PORT)
-FORMAT = 'utf-8'
+FORMAT = framing.FORMAT
 DISCONNECT_MESSAGE = "!DISCONNECT"
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.bind(ADDR)
+# Longest message a client may send, and the most a connection may buffer each way
+MAX_MESSAGE = framing.MAX_MESSAGE
+READ_LIMIT = HEADER + MAX_MESSAGE
+WRITE_LIMIT = 64 * 1024
+
+manager = sessions.SessionManager()
+player_ids = itertools.count(1)
+connections = 0
+log_messages = True
+
+queue_latency = metrics.histogram("server_queue_seconds", "time a reply waits in the outbox before it is written")
+drain_latency = metrics.histogram("server_drain_seconds", "time waiting for a slow client to read its replies")
+messages_sent = metrics.counter("server_messages_sent_total", "messages written to the clients")
+
+
+"""
+Connection class is the writing side of one client, in the client's wire format (see protocol.py).
+
+Messages are not written one at a time: they are collected until the event loop has finished its current turn
+and then written together, so the replies to a move (and the opponent's move arriving in the same turn) cost one
+write call.
+
+Parameters:
+writer -> the asyncio StreamWriter of the client
+binary -> True if the client speaks the binary format
+"""
+class Connection():
+
+    def __init__(self, writer, binary):
+        self.writer = writer
+        self.binary = binary
+        self.player = None
+        self.outbox = []
+        self.writes = 0
+        self.queued = 0.0
 
-msg_list = []
-def handle_client(conn, addr):
-    print(f"[NEW CONNECTION] {addr} connected.")
+    def send(self, message):
+        if len(self.outbox) == 0:
+            asyncio.get_running_loop().call_soon(self.flush)
+            if metrics.ENABLED:
+                self.queued = time.perf_counter()
+        self.outbox.append(message)
 
-    connected = True
-    while connected:
-        msg_length = conn.recv(HEADER).decode(FORMAT)
-        if msg_length:
-            msg_length = int(msg_length)
-            msg = conn.recv(msg_length).decode(FORMAT)
-            msg_list.append((addr, msg))
-            if msg == DISCONNECT_MESSAGE:
-                connected = False
+    def flush(self):
+        messages = self.outbox
+        self.outbox = []
+        if self.writer.is_closing() or len(messages) == 0:
+            return
+        if self.binary:
+            data = protocol.encode_batch(messages)
+        else:
+            colour = self.player.colour or "white"
+            data = b"".join(protocol.encode_text(message, colour) for message in messages)
+        self.writer.write(data)
+        self.writes += 1
+        if metrics.ENABLED:
+            queue_latency.observe(time.perf_counter() - self.queued)
+            messages_sent.inc(len(messages))
 
-            print(f"[{addr}] {msg}")
-            conn.send("Msg received".encode(FORMAT))
 
-    conn.close()
-        
+"""
+Handles one message of a player. Commands (as text / binary):
+!JOIN         / JOIN        -> join the matchmaking queue
+!MOVE <move>  / MOVE        -> play a move (e.g. !MOVE e2e4)
+!HINT         / HINT        -> ask the engine for a move
+!STATS        / STATS       -> get the counters of the server and worker pool as JSON
+!DISCONNECT   / DISCONNECT  -> leave the queue or game and close the connection
+Anything else is only acknowledged.
+"""
+@metrics.timed("server_dispatch_seconds", "handling of one message, with the move check or search it waits for")
+async def dispatch(player, message):
+    kind = message[0]
+    if metrics.ENABLED:
+        metrics.counter("server_messages_received_total", "messages read from the clients", command = kind).inc()
+    if kind == "JOIN":
+        manager.join(player)
+    elif kind == "MOVE":
+        name = message[1]
+        if not isinstance(name, str):
+            name = protocol.move_to_name(name or 0)
+        await manager.move(player, name)
+    elif kind == "HINT":
+        await manager.hint(player)
+    elif kind == "STATS":
+        stats = {"games": len(manager), "waiting": len(manager.waiting), "connections": connections}
+        if manager.offload != None:
+            stats.update(manager.offload.metrics())
+        player.send(("STATS", json.dumps(stats)))
+    elif kind == "DISCONNECT":
+        manager.leave(player)
+        player.send(("ACK",))
+    else:
+        player.send(("ACK",))
 
-def start():
-    server.listen()
-    print(f"[LISTENING] Server is listening on {SERVER}")
+"""
+Reads the messages of a text client: a 64 byte header holding the length of the message, followed by the message.
+first is the start of the header if it was already read.
+"""
+async def read_text(reader, addr, first = b""):
+    header = first + await reader.readexactly(HEADER - len(first))
+    try:
+        msg_length = framing.parse_header(header, MAX_MESSAGE)
+    except framing.FrameError as error:
+        print(f"[{addr}] {error}, closing connection")
+        return None
+    msg = (await reader.readexactly(msg_length)).decode(FORMAT)
+    if log_messages:
+        print(f"[{addr}] {msg}")
+    return [protocol.decode_text(msg)]
+
+"""
+Every connection is a coroutine on the event loop instead of an OS thread, so an idle player only costs its
+buffers. The first byte tells the format of the client: binary clients open with protocol.MAGIC, anything else
+is the length header of a text client.
+"""
+async def handle_client(reader, writer):
+    global connections
+    addr = writer.get_extra_info("peername")
+    connections += 1
+    if log_messages:
+        print(f"[NEW CONNECTION] {addr} connected.")
+        print(f"[ACTIVE CONNECTIONS] {connections}")
+    writer.transport.set_write_buffer_limits(high = WRITE_LIMIT)
+
+    connection = None
+    player = None
+    try:
+        first = await reader.readexactly(1)
+        binary = first[0] == protocol.MAGIC
+        if binary:
+            version = (await reader.readexactly(1))[0]
+            if version not in protocol.VERSIONS:
+                print(f"[{addr}] unknown protocol version {version}, closing connection")
+                return
+            decoder = protocol.Decoder(MAX_MESSAGE)
+        connection = Connection(writer, binary)
+        # Messages to the player are written by whichever connection caused them (e.g. the opponent's move)
+        player = sessions.Player(next(player_ids), connection.send)
+        connection.player = player
+        if binary:
+            player.send(("HELLO", version))
+
+        connected = True
+        while connected:
+            if binary:
+                data = await reader.read(READ_LIMIT)
+                if not data:
+                    break
+                try:
+                    messages = decoder.feed(data)
+                except ValueError as error:
+                    print(f"[{addr}] {error}, closing connection")
+                    break
+            else:
+                messages = await read_text(reader, addr, first)
+                first = b""
+                if messages == None:
+                    break
+            for message in messages:
+                await dispatch(player, message)
+                if message[0] == "DISCONNECT":
+                    connected = False
+                    break
+            connection.flush()
+            # Waits while the client is not reading its replies, so the write buffer stays bounded
+            if metrics.ENABLED:
+                start = time.perf_counter()
+                await writer.drain()
+                drain_latency.observe(time.perf_counter() - start)
+            else:
+                await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        connections -= 1
+        if player != None:
+            manager.leave(player)
+            connection.flush()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+"""
+Starts the server, with the moves checked on a pool of the given number of worker processes (0 checks them on the
+event loop itself), the games kept in the log at store_path (not kept if not given) and the hints looked up in
+the opening book at book_path and the tablebases saved by tablebase.py first.
+"""
+async def start(host = SERVER, port = PORT, worker_count = None, store_path = None, book_path = None):
+    global manager
+    tablebase.load_saved()
+    offload = None
+    if worker_count != 0:
+        offload = workers.Offload(worker_count)
+    game_store = None
+    if store_path != None:
+        game_store = store.GameStore(store_path)
+        asyncio.create_task(sync_store(game_store))
+    manager = sessions.SessionManager(offload = offload, store = game_store, book_path = book_path)
+    if metrics.ENABLED:
+        metrics.collect(gauges)
+        await metrics.serve()
+        metrics.start_profiler()
+    server = await asyncio.start_server(handle_client, host, port, limit = READ_LIMIT, backlog = 1024)
+    print(f"[LISTENING] Server is listening on {host}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if game_store != None:
+            game_store.close()
+
+"""
+The values of the server and its worker pool for the metrics snapshot.
+"""
+def gauges():
+    values = {"server_connections": connections, "server_games": len(manager), "server_waiting": len(manager.waiting)}
+    if manager.offload != None:
+        for name, value in manager.offload.metrics().items():
+            values["workers_" + name] = value
+    return values
+
+"""
+Syncs the game store to the disk on its schedule, so no move waits for the disk.
+"""
+async def sync_store(game_store):
+    loop = asyncio.get_running_loop()
     while True:
-        conn, addr = server.accept()
-        thread = threading.Thread(target=handle_client, args=(conn, addr))
-        thread.start()
-        print(f"[ACTIVE CONNECTIONS] {threading.active_count() - 1}")
+        await asyncio.sleep(game_store.sync_interval)
+        game_store.flush()
+        # fsync waits for the disk, so it runs on a thread while the loop goes on
+        await loop.run_in_executor(None, game_store.fsync)
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "chess game server")
+    parser.add_argument("--host", default = SERVER)
+    parser.add_argument("--port", type = int, default = PORT)
+    parser.add_argument("--workers", type = int, default = None, help = "worker processes, one per CPU if not given")
+    parser.add_argument("--store", default = "games.log", help = "the log file to keep the games in")
+    parser.add_argument("--no-store", action = "store_true", help = "do not keep the games")
+    parser.add_argument("--book", default = None, help = "the opening book file for hints (see book.py)")
+    parser.add_argument("--quiet", action = "store_true", help = "do not print every connection and message")
+    args = parser.parse_args()
+    log_messages = not args.quiet
 
-print("[STARTING] server is starting...")
-start()
\ No newline at end of file
+    print("[STARTING] server is starting...")
+    store_path = args.store
+    if args.no_store:
+        store_path = None
+    asyncio.run(start(args.host, args.port, args.workers, store_path, args.book))
@@ -0,0 +1,248 @@
+import asyncio
+import itertools
+
+import chess
+import metrics
+import workers
+
+"""
+Game sessions of the server: the matchmaking queue, the games being played and the validation of their moves.
+Nothing here touches the network, every player is given a send function that queues a message to its client.
+Messages are tuples, which the connection encodes in the text or binary format of its client (see protocol.py).
+
+Messages sent to the clients:
+("WAITING",)                          -> the player is in the queue
+("START", colour, board)              -> a game started, the board is the array of the ChessBoard (white at the
+                                         bottom)
+("MOVED", move, changes, status)      -> a move was played (by either player), see Game.diff for the changes and
+                                         status is "check" or ""
+("ILLEGAL", name, reason)             -> the player's move was refused
+("BUSY", name)                        -> the server was too busy to check the move in time, it may be sent again
+("HINT", name)                        -> the engine's move for the player, None if there is no legal move
+("END", result)                       -> the game is over: "checkmate <winner>", "stalemate" or "abandoned"
+"""
+
+
+"""
+Player class is one connected client.
+
+Parameters:
+id -> a number unique to the connection
+send -> function that sends a message tuple to the client
+"""
+class Player():
+
+    def __init__(self, id, send):
+        self.id = id
+        self.send = send
+        self.game = None
+        self.colour = None
+
+
+"""
+Game class is one game between two players. The server is the authority on the board: every move is checked against
+the legal moves of the ChessBoard, which is kept from the white team's perspective.
+"""
+class Game():
+
+    def __init__(self, id, white, black):
+        self.id = id
+        self.players = {"white": white, "black": black}
+        self.board = chess.ChessBoard(team = "white")
+        self.moves = []
+        self.result = None
+        # What the sampling profiler had counted when the game started, to print the game's share at its end
+        self.profile = metrics.profile_mark()
+        white.game = self
+        white.colour = "white"
+        black.game = self
+        black.colour = "black"
+
+    def start(self):
+        board = bytes(self.board.board)
+        for colour, player in self.players.items():
+            player.send(("START", colour, board))
+
+    """
+    Checks the cheap conditions of a move before the board is looked at.
+
+    Returns: the reason the move is refused, or None
+    """
+    def refusal(self, player):
+        if self.result != None:
+            return "game-over"
+        if player.colour != self.board.turn:
+            return "not-your-turn"
+        return None
+
+    """
+    Plays a move found legal by workers.validate and sends the change of the board to both players.
+
+    Parameters: player -> the player making the move
+                move -> the move
+                status -> the status after the move from workers.validate
+    """
+    def play(self, player, move, status):
+        board = self.board
+        before = bytes(board.board)
+        board.make_move(move)
+        self.moves.append(board.move_name(move))
+
+        if status == "checkmate":
+            self.result = "checkmate " + player.colour
+        elif status == "stalemate":
+            self.result = "stalemate"
+        if status != "check":
+            status = ""
+        changes = self.diff(before)
+        for other in self.players.values():
+            other.send(("MOVED", move, changes, status))
+        if self.result != None:
+            self.end(self.result)
+
+    """
+    Gets the squares that changed since the board was the given array board, as (index, piece code) pairs with the
+    indexes of the board from the white team's perspective. A move changes two to four squares, so this is far
+    shorter than the whole board.
+    """
+    def diff(self, before):
+        board = self.board.board
+        changes = []
+        for i in range(64):
+            if (board[i] ^ before[i]) & ~chess.MOVED:
+                changes.append((i, board[i] & ~chess.MOVED))
+        return changes
+
+    def end(self, result):
+        self.result = result
+        for player in self.players.values():
+            player.send(("END", result))
+            player.game = None
+
+
+"""
+SessionManager class pairs waiting players into games and finds the game of a player.
+
+The games are spread over shards (dictionaries) by their id, so each shard stays small and a shard could be handed to
+its own worker. Every lookup goes through the player's game or the game id, so it costs the same however many
+games are being played.
+
+Moves are checked, and hints searched, through the offload so the network loop is not held up by them. Every
+game is written to the store as it is played, so it can be loaded again after a restart.
+
+Parameters:
+shards -> the number of shards
+offload -> the workers.Offload to check moves on, they are checked in this process if not given
+store -> the store.GameStore to keep the games in, they are not kept if not given
+book_path -> the opening book file for the hints
+"""
+class SessionManager():
+
+    def __init__(self, shards = 16, offload = None, store = None, book_path = None):
+        self.shards = [{} for i in range(shards)]
+        self.offload = offload
+        self.store = store
+        self.book_path = book_path
+        # Players waiting for a game, in the order they joined (dicts keep their order)
+        self.waiting = {}
+        # Game ids go on from the games already in the store
+        first = 1
+        if store != None:
+            first = store.last_id + 1
+        self.ids = itertools.count(first)
+
+    def shard(self, game_id):
+        return self.shards[game_id % len(self.shards)]
+
+    def get(self, game_id):
+        return self.shard(game_id).get(game_id)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    """
+    Puts the player in the queue, or starts a game with the player that has waited the longest.
+    The player who waited plays white.
+    """
+    def join(self, player):
+        if player.game != None or player.id in self.waiting:
+            return None
+        if len(self.waiting) == 0:
+            self.waiting[player.id] = player
+            player.send(("WAITING",))
+            return None
+        opponent = self.waiting.pop(next(iter(self.waiting)))
+        game = Game(next(self.ids), opponent, player)
+        self.shard(game.id)[game.id] = game
+        if self.store != None:
+            self.store.snapshot(game.id, game.board)
+        game.start()
+        return game
+
+    """
+    Checks the move of the player and plays it if it is legal.
+
+    Returns: True if the move was played
+    """
+    async def move(self, player, name):
+        game = player.game
+        if game == None:
+            player.send(("ILLEGAL", name, "no-game"))
+            return False
+        reason = game.refusal(player)
+        if reason != None:
+            player.send(("ILLEGAL", name, reason))
+            return False
+        try:
+            move, status = await self.call(workers.validate, game.board, name)
+        except (workers.Busy, asyncio.TimeoutError):
+            player.send(("BUSY", name))
+            return False
+        # The game may have ended while the move was being checked (e.g. the opponent left)
+        if player.game != game or game.refusal(player) != None:
+            return False
+        if move == None:
+            player.send(("ILLEGAL", name, "illegal-move"))
+            return False
+        game.play(player, move, status)
+        if self.store != None:
+            self.store.move(game.id, len(game.moves), move, game.board)
+        if game.result != None:
+            self.finish(game)
+        return True
+
+    """
+    Sends the player the engine's move for its side, searched for time_ms milliseconds.
+    """
+    async def hint(self, player, time_ms = 200):
+        game = player.game
+        if game == None or game.refusal(player) != None:
+            player.send(("HINT", None))
+            return
+        try:
+            name = await self.call(workers.best_move, game.board, time_ms, self.book_path)
+        except (workers.Busy, asyncio.TimeoutError):
+            player.send(("BUSY", "hint"))
+            return
+        player.send(("HINT", name))
+
+    async def call(self, function, *args):
+        if self.offload == None:
+            return function(*args)
+        return await self.offload.run(function, *args)
+
+    """
+    Takes the player out of the queue or its game, the opponent is told the game was abandoned.
+    """
+    def leave(self, player):
+        self.waiting.pop(player.id, None)
+        game = player.game
+        if game != None:
+            game.end("abandoned")
+            self.finish(game)
+
+    def finish(self, game):
+        self.shard(game.id).pop(game.id, None)
+        metrics.print_hot(f"game {game.id}", game.profile)
+        if self.store != None:
+            self.store.end(game.id, len(game.moves), game.result)
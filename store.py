@@ -0,0 +1,269 @@
+import os
+import struct
+import time
+
+import chess
+
+"""
+Persistent store of the games of the server: one append-only binary log of every game's moves, with a snapshot
+of the board every few moves and an index of where each game's records are in the file.
+
+Records (little endian, the first byte is the kind):
+b"M" game ply move                                   -> 9 bytes, a move played (ply counts from 1)
+b"S" game ply turn castling en_passant string        -> 74 bytes, the position after ply moves: the 64 character
+                                                        board string from the white team's perspective, the side
+                                                        to move (0 white, 1 black), the castling rights (bits K Q
+                                                        k q) and the en passant square (255 for none)
+b"E" game ply result                                 -> 8 bytes, the game ended (see RESULTS)
+
+To load a position the nearest snapshot at or before it is read and only the moves after it are played, so
+loading costs at most snapshot_every moves whatever the length of the game.
+
+Records are collected in memory and written together, and the file is only fsync'd by sync, which the server
+calls on a schedule (see sync_interval), so no move waits for the disk. A crash loses at most the records since
+the last sync; a record cut off at the end of the file is dropped when the log is opened again. A record of an
+unknown kind can not come from a crash (records are written whole and in order), so it raises CorruptLog and the
+file is left as it is.
+"""
+
+MOVE_RECORD = struct.Struct("<cIHH")
+SNAPSHOT_RECORD = struct.Struct("<cIHBBB64s")
+END_RECORD = struct.Struct("<cIHB")
+records = {b"M": MOVE_RECORD, b"S": SNAPSHOT_RECORD, b"E": END_RECORD}
+
+RESULTS = ("checkmate white", "checkmate black", "stalemate", "abandoned")
+CASTLING = "KQkq"
+NO_SQUARE = 255
+
+
+class CorruptLog(Exception):
+    pass
+
+
+"""
+GameIndex class holds where the records of one game are in the log.
+"""
+class GameIndex():
+
+    def __init__(self):
+        # (ply, offset) of every snapshot, in order of ply
+        self.snapshots = []
+        # offset of the record of every move, moves[ply - 1] is the move of that ply
+        self.moves = []
+        self.result = None
+
+
+"""
+GameStore class appends the games to the log at path and loads them back.
+
+Parameters:
+path -> the file of the log, made if it does not exist
+snapshot_every -> the number of moves between snapshots
+sync_interval -> the seconds between syncs to the disk, for the server's schedule
+buffer_size -> the bytes collected in memory before they are written to the file (without a sync)
+"""
+class GameStore():
+
+    def __init__(self, path, snapshot_every = 16, sync_interval = 1.0, buffer_size = 64 * 1024):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.sync_interval = sync_interval
+        self.buffer_size = buffer_size
+        self.games = {}
+        self.pending = bytearray()
+        self.file = open(path, "a+b")
+        try:
+            self.size = self.scan()
+        except CorruptLog:
+            self.file.close()
+            raise
+        self.syncs = 0
+
+    """
+    Builds the index from the records of the log, dropping a record cut off at the end by a crash.
+
+    Returns: the size of the log
+    Raises: CorruptLog if a record of an unknown kind is found, without changing the file
+    """
+    def scan(self):
+        self.file.seek(0)
+        data = self.file.read()
+        offset = 0
+        while offset < len(data):
+            record = records.get(data[offset:offset + 1])
+            if record == None:
+                raise CorruptLog(f"{self.path}: unknown record {data[offset:offset + 1]!r} at byte {offset}")
+            if offset + record.size > len(data):
+                break
+            self.index(data[offset:offset + 1], record.unpack_from(data, offset), offset)
+            offset += record.size
+        if offset < len(data):
+            self.file.truncate(offset)
+        return offset
+
+    def index(self, kind, fields, offset):
+        game = self.games.setdefault(fields[1], GameIndex())
+        if kind == b"M":
+            game.moves.append(offset)
+        elif kind == b"S":
+            game.snapshots.append((fields[2], offset))
+        else:
+            game.result = RESULTS[fields[3]]
+
+    """
+    The largest game id in the log, so new games can be numbered after it.
+    """
+    @property
+    def last_id(self):
+        return max(self.games, default = 0)
+
+    def append(self, kind, *fields):
+        record = records[kind]
+        offset = self.size + len(self.pending)
+        self.pending += record.pack(kind, *fields)
+        self.index(kind, (kind,) + fields, offset)
+        if len(self.pending) >= self.buffer_size:
+            self.flush()
+
+    """
+    Records the position of a game at its start, or after ply moves.
+
+    Parameters: game_id -> the id of the game
+                board -> the ChessBoard of the game, from the white team's perspective
+                ply -> the number of moves played
+    """
+    def snapshot(self, game_id, board, ply = 0):
+        fields = board.to_fen().split()
+        castling = 0
+        for letter in fields[2].replace("-", ""):
+            castling |= 1 << CASTLING.index(letter)
+        en_passant = NO_SQUARE
+        if board.en_passant != None:
+            en_passant = board.en_passant
+        self.append(b"S", game_id, ply, int(board.turn == "black"), castling, en_passant,
+                    board.convert_to_string().encode("ascii"))
+
+    """
+    Records a move of a game, with a snapshot after it every snapshot_every moves.
+
+    Parameters: ply -> the number of the move in the game, from 1
+                board -> the ChessBoard after the move, for the snapshot
+    """
+    def move(self, game_id, ply, move, board):
+        self.append(b"M", game_id, ply, move)
+        if ply % self.snapshot_every == 0:
+            self.snapshot(game_id, board, ply)
+
+    def end(self, game_id, ply, result):
+        self.append(b"E", game_id, ply, RESULTS.index(result))
+
+    """
+    Writes the records collected in memory to the file.
+    """
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        self.file.write(self.pending)
+        self.file.flush()
+        self.size += len(self.pending)
+        self.pending = bytearray()
+
+    """
+    Writes the records collected in memory and waits for the disk to have them.
+    """
+    def sync(self):
+        self.flush()
+        self.fsync()
+
+    """
+    Waits for the disk to have what was written to the file. It does not touch the records in memory, so it can be
+    run on another thread while moves go on being appended.
+    """
+    def fsync(self):
+        os.fsync(self.file.fileno())
+        self.syncs += 1
+
+    def read(self, offset, record):
+        if offset >= self.size:
+            return record.unpack_from(self.pending, offset - self.size)
+        self.file.seek(offset)
+        return record.unpack(self.file.read(record.size))
+
+    """
+    Loads a game from its nearest snapshot and the moves after it.
+
+    Parameters: game_id -> the id of the game
+                ply -> the number of moves to play, all the moves in the log if not given
+    Returns: the ChessBoard after the moves (from the white team's perspective), or None if the game is not in the log
+    """
+    def load(self, game_id, ply = None):
+        game = self.games.get(game_id)
+        if game == None or len(game.snapshots) == 0:
+            return None
+        if ply == None or ply > len(game.moves):
+            ply = len(game.moves)
+        start, offset = game.snapshots[0]
+        for snapshot_ply, snapshot_offset in game.snapshots:
+            if snapshot_ply <= ply:
+                start, offset = snapshot_ply, snapshot_offset
+
+        kind, id, start, turn, castling, en_passant, string = self.read(offset, SNAPSHOT_RECORD)
+        # The board string has no side to move, castling rights or en passant square, so they are loaded as a FEN
+        board = chess.ChessBoard(string.decode("ascii"), "white")
+        fields = board.to_fen().split()
+        fields[1] = "wb"[turn]
+        fields[2] = "".join(CASTLING[i] for i in range(4) if castling & 1 << i) or "-"
+        if en_passant != NO_SQUARE:
+            fields[3] = board.square_name(en_passant)
+        board.load_fen(" ".join(fields))
+        for i in range(start, ply):
+            board.make_move(self.read(game.moves[i], MOVE_RECORD)[3])
+        return board
+
+    """
+    Gets the moves of a game in coordinate notation, to replay it.
+    """
+    def moves(self, game_id):
+        game = self.games.get(game_id)
+        if game == None:
+            return []
+        board = chess.ChessBoard(team = "white")
+        return [board.move_name(self.read(offset, MOVE_RECORD)[3]) for offset in game.moves]
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description = "write random games to a log and time loading them back")
+    parser.add_argument("path")
+    parser.add_argument("--games", type = int, default = 50)
+    args = parser.parse_args()
+
+    store = GameStore(args.path)
+    first = store.last_id + 1
+    start = time.perf_counter()
+    boards = {}
+    for game_id in range(first, first + args.games):
+        board = chess.ChessBoard(team = "white")
+        store.snapshot(game_id, board)
+        for ply in range(1, 121):
+            moves = board.generate_moves(board.turn)
+            if len(moves) == 0:
+                break
+            board.make_move(random.choice(moves))
+            store.move(game_id, ply, board.history[-1][0], board)
+        boards[game_id] = board.convert_to_string()
+    store.sync()
+    print(f"[WRITE] {args.games} games in {time.perf_counter() - start:.2f}s, log of {store.size} bytes")
+
+    start = time.perf_counter()
+    for game_id, string in boards.items():
+        if store.load(game_id).convert_to_string() != string:
+            raise AssertionError(f"game {game_id} loaded wrong")
+    print(f"[LOAD] {args.games} games in {(time.perf_counter() - start) * 1000 / args.games:.2f}ms each")
+    store.close()
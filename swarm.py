@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import random
+import time
+
+import chess
+import client
+import ingest
+import loadtest
+import search
+import server
+import sessions
+import workers
+
+# Seconds a bot waits before sending a move again after a BUSY reply
+BUSY_BACKOFF = 0.05
+
+"""
+Bot swarm for capacity planning of the game server: thousands of simulated players in one process on asyncio,
+each joining games and playing them out through the binary protocol (see client.py) with its own ChessBoard.
+
+How the bots pick their moves (--moves):
+random -> any legal move
+engine -> the move of search.Search in --engine-ms milliseconds (it runs on the event loop, so keep it short)
+replay -> the moves of recorded games (PGN files, optionally gzipped, given with --replay): the bots look the
+          position up in the games and play one of the moves played there, as often as it was played, and a random
+          move once the game has left them
+
+How long the bots think before each move (--think): none, fixed:S, uniform:A:B, exponential:MEAN or
+lognormal:MU:SIGMA, in seconds.
+
+The report has the moves played per second, the round trip of a move (sent to its MOVED coming back) at p50 and
+p99, and the errors: illegal moves, BUSY replies, timeouts and lost connections.
+
+Run with: python swarm.py --bots 1000 --games 2 [--moves random] [--think exponential:0.5] [--local [--workers N]]
+--local starts a server in this process on a free port of 127.0.0.1, as loadtest.py does.
+"""
+
+
+"""
+Makes the function that gives the think time of every move from its description (see above).
+"""
+def think_times(spec, rng):
+    name, *values = spec.split(":")
+    values = [float(value) for value in values]
+    if name == "none":
+        return lambda: 0
+    if name == "fixed":
+        return lambda: values[0]
+    if name == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if name == "exponential":
+        return lambda: rng.expovariate(1 / values[0])
+    if name == "lognormal":
+        return lambda: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"unknown think time {spec}")
+
+
+"""
+Replay class holds the moves of recorded games by the Zobrist key of the position they were played in, from the
+white team's perspective like the boards of the bots, so a bot can follow any of the games its game is still in.
+"""
+class Replay():
+
+    def __init__(self):
+        # key -> {move: the number of games it was played in}
+        self.positions = {}
+        self.games = 0
+
+    """
+    Adds the games of a PGN file, up to plies half moves of each.
+    """
+    def add_file(self, path, plies = 200):
+        board = chess.ChessBoard(team = "white")
+        for tags, movetext in ingest.read_games(ingest.read_lines(path)):
+            board.load_fen(tags.get("FEN", chess.start_fen))
+            for san in ingest.san_moves(movetext)[0][:plies]:
+                move = board.parse_san(san)
+                if move == None:
+                    break
+                counts = self.positions.setdefault(board.key, {})
+                counts[move] = counts.get(move, 0) + 1
+                board.make_move(move)
+            self.games += 1
+
+    """
+    Picks one of the moves played in the position, as often as it was played.
+
+    Returns: the move, or None if no game reached the position
+    """
+    def choose(self, board, rng):
+        counts = self.positions.get(board.key)
+        if counts == None:
+            return None
+        return rng.choices(list(counts), list(counts.values()))[0]
+
+
+"""
+Makes the function a bot picks its moves with.
+
+Returns: function of the ChessBoard that gives the move, or None if there are no legal moves
+"""
+def move_chooser(kind, rng, replay = None, engine_ms = 10):
+    def random_move(board):
+        moves = board.generate_moves(board.turn)
+        if len(moves) == 0:
+            return None
+        return rng.choice(moves)
+
+    def engine_move(board):
+        name = search.best_move(board.convert_to_string(), engine_ms, "white", board.turn)
+        move = None
+        if name != None:
+            # The engine does not know the castling rights of the game, so its move is checked here
+            move = board.parse_move(name)
+        if move == None:
+            return random_move(board)
+        return move
+
+    def replay_move(board):
+        move = replay.choose(board, rng)
+        if move == None:
+            return random_move(board)
+        return move
+
+    return {"random": random_move, "engine": engine_move, "replay": replay_move}[kind]
+
+
+"""
+Plays one game on the connection, from joining the queue to its END.
+
+Returns: True if the game ended, False if the bot left it (after max_plies half moves or an illegal move)
+"""
+async def play_game(connection, choose, think, results, max_plies, timeout):
+    connection.send(("JOIN",))
+    # Waiting for an opponent can take a while when the swarm is starting
+    start = await asyncio.wait_for(connection.expect("START"), 4 * timeout)
+    colour = start[1]
+    board = chess.ChessBoard(team = "white")
+    plies = 0
+    while True:
+        if board.turn != colour:
+            reply = await asyncio.wait_for(connection.expect("MOVED", "END"), timeout)
+            if reply[0] == "END":
+                return True
+            board.make_move(reply[1])
+            plies += 1
+            continue
+
+        move = choose(board)
+        if move == None:
+            # Mated or stalemated, the END is on its way
+            await asyncio.wait_for(connection.expect("END"), timeout)
+            return True
+        if plies >= max_plies:
+            connection.send(("DISCONNECT",))
+            results["abandoned"] += 1
+            return False
+        await asyncio.sleep(think())
+        sent = time.perf_counter()
+        connection.send(("MOVE", move))
+        reply = await asyncio.wait_for(connection.expect("MOVED", "ILLEGAL", "BUSY", "END"), timeout)
+        if reply[0] == "MOVED":
+            results["latencies"].append(time.perf_counter() - sent)
+            board.make_move(reply[1])
+            plies += 1
+        elif reply[0] == "BUSY":
+            results["busy"] += 1
+            await asyncio.sleep(BUSY_BACKOFF)
+        elif reply[0] == "ILLEGAL":
+            results["illegal"] += 1
+            connection.send(("DISCONNECT",))
+            return False
+        else:
+            return True
+
+"""
+One bot: connects, plays its games one after another and disconnects. A game it left is played on a new
+connection, as leaving closes the connection.
+"""
+async def bot(host, port, games, choose, think, results, max_plies, timeout):
+    connection = None
+    try:
+        for game in range(games):
+            if connection == None:
+                connection = await asyncio.wait_for(client.connect(host, port), timeout)
+                results["connected"] += 1
+            if await play_game(connection, choose, think, results, max_plies, timeout):
+                results["games"] += 1
+            else:
+                await connection.close()
+                connection = None
+        if connection != None:
+            connection.send(("DISCONNECT",))
+    except asyncio.TimeoutError:
+        results["timeouts"] += 1
+    except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+        results["errors"] += 1
+    finally:
+        if connection != None:
+            await connection.close()
+
+"""
+Runs the swarm and prints a report.
+
+Parameters: bots -> the number of bots, two per game
+            games -> the games each bot plays
+            choose -> the move chooser (see move_chooser)
+            think -> the think time function (see think_times)
+            worker_count -> the worker processes of a local server, moves checked on its event loop if 0
+Returns: the results
+"""
+async def run(bots, games, choose, think, host, port, local = False, worker_count = 0, max_plies = 200, timeout = 30):
+    local_server = None
+    offload = None
+    if local:
+        server.log_messages = False
+        if worker_count != 0:
+            offload = workers.Offload(worker_count)
+        server.manager = sessions.SessionManager(offload = offload)
+        local_server = await asyncio.start_server(server.handle_client, "127.0.0.1", 0,
+                                                  limit = server.READ_LIMIT, backlog = 4096)
+        host, port = local_server.sockets[0].getsockname()[:2]
+
+    results = {"connected": 0, "games": 0, "abandoned": 0, "illegal": 0, "busy": 0, "timeouts": 0, "errors": 0,
+               "latencies": []}
+    start = time.perf_counter()
+    await asyncio.gather(*[bot(host, port, games, choose, think, results, max_plies, timeout) for i in range(bots)])
+    elapsed = time.perf_counter() - start
+    if local_server != None:
+        local_server.close()
+        await local_server.wait_closed()
+    if offload != None:
+        offload.close()
+
+    latencies = sorted(results["latencies"])
+    moves = len(latencies)
+    sent = max(moves + results["illegal"] + results["busy"], 1)
+    print(f"[BOTS] {bots} bots, {results['connected']} connections")
+    print(f"[GAMES] {results['games']} finished, {results['abandoned']} left after {max_plies} half moves")
+    print(f"[MOVES] {moves} in {elapsed:.2f}s, {moves / elapsed:.0f} per second")
+    print(f"[LATENCY] p50 {loadtest.percentile(latencies, 0.5) * 1000:.2f}ms, "
+          f"p99 {loadtest.percentile(latencies, 0.99) * 1000:.2f}ms, max {loadtest.percentile(latencies, 1) * 1000:.2f}ms")
+    print(f"[ERRORS] {results['illegal'] / sent:.2%} illegal, {results['busy'] / sent:.2%} busy, "
+          f"{results['timeouts']} timeouts, {results['errors']} connection errors")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "bot swarm load generator for the game server")
+    parser.add_argument("--bots", type = int, default = 100)
+    parser.add_argument("--games", type = int, default = 1, help = "the games each bot plays")
+    parser.add_argument("--moves", choices = ["random", "engine", "replay"], default = "random")
+    parser.add_argument("--replay", nargs = "*", default = [], help = "PGN files of the games to replay")
+    parser.add_argument("--engine-ms", type = int, default = 10, help = "the search time of the engine bots")
+    parser.add_argument("--think", default = "none", help = "think time, e.g. fixed:0.5 or exponential:1")
+    parser.add_argument("--max-plies", type = int, default = 200, help = "half moves before a bot leaves its game")
+    parser.add_argument("--timeout", type = float, default = 30, help = "seconds to wait for any reply")
+    parser.add_argument("--seed", type = int, default = None)
+    parser.add_argument("--host", default = server.SERVER)
+    parser.add_argument("--port", type = int, default = server.PORT)
+    parser.add_argument("--local", action = "store_true", help = "run a server in this process")
+    parser.add_argument("--workers", type = int, default = 0, help = "worker processes of the local server")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    replay = None
+    if args.moves == "replay":
+        replay = Replay()
+        for path in args.replay:
+            replay.add_file(path, args.max_plies)
+        print(f"[REPLAY] {replay.games} games, {len(replay.positions)} positions")
+    choose = move_chooser(args.moves, rng, replay, args.engine_ms)
+
+    loadtest.raise_file_limit()
+    asyncio.run(run(args.bots, args.games, choose, think_times(args.think, rng), args.host, args.port, args.local,
+                    args.workers, args.max_plies, args.timeout))
@@ -0,0 +1,321 @@
+import os
+import time
+from array import array
+
+import chess
+from bitboard import squares, KING_ATTACKS, PAWN_ATTACKS, UP, rook_attacks, queen_attacks
+from chess import EMPTY, PAWN, ROOK, QUEEN, KING, WHITE, BLACK
+
+"""
+Endgame tablebases of a king and one piece against a lone king (KQK, KRK and KPK), built by retrograde analysis.
+
+Every position of a table is numbered by the squares of the strong side's king, the weak side's king and the piece,
+and the side to move. The strong side is taken to be white, on a board from the white team's perspective; any
+other board is mirrored to fit (see normalise). Each entry is one byte:
+
+0          -> a draw
+1 to 253   -> one more than the number of half moves to mate: the side to move wins if it is the strong side,
+              and loses if it is the lone king (1 is the lone king mated)
+STALEMATE  -> the lone king to move has no moves and is not in check
+ILLEGAL    -> not a position (pieces on one square, kings next to each other, the side not to move in check, a
+              pawn on the first or last row)
+
+The tables are built backwards from the mates: a position of the lone king is lost once every move of it leads
+to a position already won, and a position of the strong side is won as soon as one of its moves leads to a lost
+one. Handling the positions in order of their distance to mate makes the distances the shortest ones. The moves
+are made with the same attack tables as ChessBoard.generate_moves, on the squares directly, since building a
+ChessBoard for each of the half a million positions would take minutes.
+
+The tables are saved in DIRECTORY and loaded from there on the next run.
+"""
+
+SIZE = 64 * 64 * 64 * 2
+STALEMATE = 254
+ILLEGAL = 255
+DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+
+names = {QUEEN: "KQK", ROOK: "KRK", PAWN: "KPK"}
+# Tables built or loaded so far, by the type of the piece
+tables = {}
+
+
+def index(strong_king, weak_king, piece, weak_to_move):
+    return ((strong_king << 6 | weak_king) << 6 | piece) << 1 | weak_to_move
+
+def piece_attacks(type, square, occupied):
+    if type == QUEEN:
+        return queen_attacks(square, occupied)
+    if type == ROOK:
+        return rook_attacks(square, occupied)
+    return PAWN_ATTACKS[UP][square]
+
+"""
+Checks that the pieces can stand on the squares with this side to move.
+"""
+def legal(type, strong_king, weak_king, piece, weak_to_move):
+    if strong_king == weak_king or piece == strong_king or piece == weak_king:
+        return False
+    if KING_ATTACKS[strong_king] >> weak_king & 1:
+        return False
+    if type == PAWN and not 8 <= piece < 56:
+        return False
+    occupied = 1 << strong_king | 1 << weak_king | 1 << piece
+    # The lone king can not be in check when the strong side is to move
+    return weak_to_move or not piece_attacks(type, piece, occupied) >> weak_king & 1
+
+"""
+Gets the positions after every move of the side to move.
+
+Returns: the indexes of the positions, whether the lone king can take the piece (a draw), whether the lone king
+         is in check, and the (index, table type) of the positions a pawn promotes into
+"""
+def successors(type, strong_king, weak_king, piece, weak_to_move):
+    positions = []
+    promotions = []
+    if weak_to_move:
+        # Without the lone king in the way, so it can not step back along the line of a checking piece
+        occupied = 1 << strong_king | 1 << piece
+        attacked = KING_ATTACKS[strong_king] | piece_attacks(type, piece, occupied)
+        in_check = attacked >> weak_king & 1 == 1
+        takes = False
+        for end in squares(KING_ATTACKS[weak_king] & ~attacked):
+            if end == piece:
+                takes = True
+            else:
+                positions.append(index(strong_king, end, piece, 0))
+        return positions, takes, in_check, promotions
+
+    occupied = 1 << strong_king | 1 << weak_king | 1 << piece
+    for end in squares(KING_ATTACKS[strong_king] & ~KING_ATTACKS[weak_king] & ~occupied):
+        positions.append(index(end, weak_king, piece, 1))
+    if type == PAWN:
+        end = piece - 8
+        if not occupied >> end & 1:
+            if end < 8:
+                for promotion in (QUEEN, ROOK):
+                    promotions.append((index(strong_king, weak_king, end, 1), promotion))
+            else:
+                positions.append(index(strong_king, weak_king, end, 1))
+                if piece >= 48 and not occupied >> (end - 8) & 1:
+                    positions.append(index(strong_king, weak_king, end - 8, 1))
+    else:
+        for end in squares(piece_attacks(type, piece, occupied) & ~occupied):
+            positions.append(index(strong_king, weak_king, end, 1))
+    return positions, False, False, promotions
+
+
+"""
+Builds the table of the piece type by retrograde analysis. A KPK table needs the KQK and KRK tables for the
+promotions.
+
+Returns: the table as a bytearray of SIZE entries
+"""
+def build(type):
+    table = bytearray([ILLEGAL]) * SIZE
+    # The moves of every position, with the positions they lead to in one array
+    offsets = array("i", bytes(4 * (SIZE + 1)))
+    targets = array("i")
+    # The number of moves of each lone king position that are not yet known to lose
+    remaining = array("i", bytes(4 * SIZE))
+    # buckets[n] holds the positions found to be n half moves from mate
+    buckets = [[] for i in range(256)]
+
+    for position in range(SIZE):
+        offsets[position] = len(targets)
+        weak_to_move = position & 1
+        piece = position >> 1 & 63
+        weak_king = position >> 7 & 63
+        strong_king = position >> 13
+        if not legal(type, strong_king, weak_king, piece, weak_to_move):
+            continue
+        table[position] = 0
+        positions, takes, in_check, promotions = successors(type, strong_king, weak_king, piece, weak_to_move)
+        targets.extend(positions)
+        if weak_to_move:
+            if len(positions) == 0 and not takes:
+                if in_check:
+                    buckets[0].append(position)
+                else:
+                    table[position] = STALEMATE
+            # Taking the piece draws, so such a position is never lost
+            remaining[position] = len(positions) + (SIZE if takes else 0)
+        for promoted, promotion in promotions:
+            value = tables[promotion][promoted]
+            if 0 < value < STALEMATE:
+                buckets[value].append(position)
+    offsets[SIZE] = len(targets)
+
+    # The moves backwards, by inverting the moves forwards
+    counts = array("i", bytes(4 * (SIZE + 1)))
+    for target in targets:
+        counts[target + 1] += 1
+    for position in range(SIZE):
+        counts[position + 1] += counts[position]
+    sources = array("i", bytes(4 * len(targets)))
+    fill = array("i", counts)
+    for position in range(SIZE):
+        for i in range(offsets[position], offsets[position + 1]):
+            target = targets[i]
+            sources[fill[target]] = position
+            fill[target] += 1
+    del targets, fill
+
+    found = bytearray(SIZE)
+    for distance in range(253):
+        for position in buckets[distance]:
+            if found[position]:
+                continue
+            found[position] = 1
+            table[position] = distance + 1
+            for i in range(counts[position], counts[position + 1]):
+                source = sources[i]
+                if found[source]:
+                    continue
+                if source & 1:
+                    remaining[source] -= 1
+                    if remaining[source] == 0:
+                        buckets[distance + 1].append(source)
+                else:
+                    buckets[distance + 1].append(source)
+    return table
+
+"""
+Loads the table of the piece type, building and saving it first if it was never built.
+"""
+def load(type, directory = DIRECTORY):
+    if type in tables:
+        return tables[type]
+    if type == PAWN:
+        load(QUEEN, directory)
+        load(ROOK, directory)
+    path = os.path.join(directory, names[type] + ".bin")
+    if os.path.exists(path):
+        with open(path, "rb") as file:
+            table = file.read()
+    else:
+        start = time.perf_counter()
+        table = bytes(build(type))
+        os.makedirs(directory, exist_ok = True)
+        with open(path, "wb") as file:
+            file.write(table)
+        print(f"[TABLEBASE] built {names[type]} in {time.perf_counter() - start:.1f}s")
+    tables[type] = table
+    return table
+
+"""
+Loads the tables that were built before, without building any. Probes only use loaded tables.
+"""
+def load_saved(directory = DIRECTORY):
+    for type in (QUEEN, ROOK, PAWN):
+        if type not in tables and os.path.exists(os.path.join(directory, names[type] + ".bin")):
+            load(type, directory)
+
+
+"""
+Finds the entry of the board in the tables, mirroring the board so the strong side is white on a board from the
+white team's perspective.
+
+Parameters: board -> the ChessBoard
+            colour -> the side to move, the board's turn if not given
+Returns: (type, index) of the entry, (EMPTY, 0) for two bare kings, or None if no loaded table has the position
+"""
+def normalise(board, colour = None):
+    bitboards = board.bitboards
+    occupied = bitboards[WHITE] | bitboards[BLACK]
+    count = occupied.bit_count()
+    if count == 2:
+        return EMPTY, 0
+    if count != 3:
+        return None
+    for strong in (WHITE, BLACK):
+        for type in (QUEEN, ROOK, PAWN):
+            if bitboards[type | strong] and type in tables:
+                break
+        else:
+            continue
+        break
+    else:
+        return None
+
+    if colour == None:
+        colour = board.turn
+    strong_king = bitboards[KING | strong].bit_length() - 1
+    weak_king = bitboards[KING | strong ^ WHITE].bit_length() - 1
+    piece = bitboards[type | strong].bit_length() - 1
+    # Boards of the black team are the other way up, and a black strong side is mirrored to play up the board
+    flip = 0
+    if board.team == "black":
+        flip = 63
+    if strong == BLACK:
+        flip ^= 56
+    weak_to_move = int(chess.colour_to_code[colour] != strong)
+    return type, index(strong_king ^ flip, weak_king ^ flip, piece ^ flip, weak_to_move)
+
+"""
+Looks the board up in the tablebases.
+
+Returns: None if the position is not in a loaded table, otherwise (result, distance) for the side to move: result
+         is 1 for a win, -1 for a loss and 0 for a draw (distance -1 for a stalemate), and distance is the number of
+         half moves to mate
+"""
+def probe(board, colour = None):
+    found = normalise(board, colour)
+    if found == None:
+        return None
+    type, position = found
+    if type == EMPTY:
+        return 0, 0
+    value = tables[type][position]
+    if value == 0 or value == ILLEGAL:
+        return 0, 0
+    if value == STALEMATE:
+        return 0, -1
+    if position & 1:
+        return -1, value - 1
+    return 1, value - 1
+
+"""
+Finds the best move of the side to move from the tablebases: the fastest mate when winning, the slowest when
+losing and any move that keeps a draw otherwise.
+
+Returns: the move, or None if the position is not in a loaded table or there are no legal moves
+"""
+def best_move(board):
+    if probe(board) == None:
+        return None
+    best = None
+    best_rank = None
+    for move in board.generate_moves(board.turn):
+        board.make_move(move)
+        result = probe(board)
+        board.unmake_move()
+        if result == None:
+            # A promotion to a piece without a table
+            continue
+        outcome, distance = result
+        # Lower is better for the side that moved
+        if outcome == -1:
+            rank = distance - 1000
+        elif outcome == 0:
+            rank = 0
+        else:
+            rank = 1000 - distance
+        if best_rank == None or rank < best_rank:
+            best = move
+            best_rank = rank
+    return best
+
+
+if __name__ == "__main__":
+    for type in (QUEEN, ROOK, PAWN):
+        table = load(type)
+        wins = sum(1 for i in range(0, SIZE, 2) if 0 < table[i] < STALEMATE)
+        longest = max(value for value in table if value < STALEMATE) - 1
+        print(f"[{names[type]}] {wins} won positions with the strong side to move, longest mate {longest} half moves")
+
+    board = chess.ChessBoard(team = "white")
+    board.load_fen("8/8/8/4k3/8/8/8/4K2R w - - 0 1")
+    start = time.perf_counter()
+    for i in range(1000):
+        probe(board)
+    print(f"[PROBE] {(time.perf_counter() - start) * 1000:.2f}us per probe, KRK start: {probe(board)}")
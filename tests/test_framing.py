@@ -0,0 +1,110 @@
+import random
+import socket
+import threading
+
+import pytest
+
+import framing
+from framing import frame, parse_header, FrameError, FramedSocket, Decoder, HEADER, MAX_MESSAGE
+
+"""
+Tests of the framing of the text format: the header checks, short reads, and a stress test that sends random
+messages in pieces cut at random byte boundaries.
+"""
+
+
+def test_parse_header_reads_the_length():
+    assert parse_header(frame("hello")[:HEADER]) == 5
+    assert parse_header(frame("")[:HEADER]) == 0
+
+def test_parse_header_refuses_an_oversize_length():
+    header = frame("x" * (MAX_MESSAGE + 1))[:HEADER]
+    with pytest.raises(FrameError):
+        parse_header(header)
+    assert parse_header(header, max_message = MAX_MESSAGE + 1) == MAX_MESSAGE + 1
+
+def test_parse_header_refuses_a_negative_length():
+    with pytest.raises(FrameError):
+        parse_header(b"-1".ljust(HEADER))
+
+@pytest.mark.parametrize("header", [b"abc".ljust(HEADER), b" " * HEADER, b"\xff\xfe".ljust(HEADER), b"1.5".ljust(HEADER)])
+def test_parse_header_refuses_a_non_numeric_header(header):
+    with pytest.raises(FrameError):
+        parse_header(header)
+
+def test_receive_raises_when_the_connection_closes_in_a_message():
+    left, right = socket.socketpair()
+    left.sendall(frame("hello world")[:HEADER + 4])
+    left.close()
+    reader = FramedSocket(right)
+    with pytest.raises(ConnectionError):
+        reader.receive()
+    reader.close()
+
+def test_receive_raises_when_the_connection_closes_in_a_header():
+    left, right = socket.socketpair()
+    left.sendall(frame("hello")[:10])
+    left.close()
+    reader = FramedSocket(right)
+    with pytest.raises(ConnectionError):
+        reader.receive()
+    reader.close()
+
+def test_decoder_waits_for_the_rest_of_a_short_read():
+    decoder = Decoder()
+    data = frame("hello") + frame("world")
+    assert decoder.feed(data[:HEADER - 1]) == []
+    assert decoder.feed(data[HEADER - 1:HEADER + 2]) == []
+    assert decoder.feed(data[HEADER + 2:HEADER + 7]) == ["hello"]
+    assert decoder.feed(data[HEADER + 7:]) == ["world"]
+
+def test_decoder_refuses_an_oversize_length():
+    with pytest.raises(FrameError):
+        Decoder(max_message = 4).feed(frame("hello"))
+
+
+"""
+Writes data to the socket in pieces cut at random byte boundaries, to mimic the short reads of a busy network.
+"""
+def send_in_pieces(sock, data, rng):
+    offset = 0
+    while offset < len(data):
+        size = rng.randint(1, 97)
+        sock.sendall(data[offset:offset + size])
+        offset += size
+
+"""
+Random messages (the text format, and the binary format of protocol.py) are sent through a socket pair in random
+pieces from another thread, and every message must be read back whole and in order by FramedSocket and by both
+decoders.
+"""
+def test_stress(messages = 2000, seed = 1):
+    import protocol
+
+    rng = random.Random(seed)
+    alphabet = "abcdefgh12345678 !~é"
+    texts = ["".join(rng.choice(alphabet) for i in range(rng.randint(0, 200))) for i in range(messages)]
+    frames = [("MOVE", rng.randrange(1 << 15)) if rng.random() < 0.5 else ("TEXT", text) for text in texts]
+
+    # Blocking reads with FramedSocket
+    left, right = socket.socketpair()
+    data = b"".join(frame(text) for text in texts)
+    sender = threading.Thread(target = send_in_pieces, args = (left, data, rng))
+    sender.start()
+    reader = FramedSocket(right)
+    for text in texts:
+        assert reader.receive() == text
+    sender.join()
+    left.close()
+    reader.close()
+
+    # Feeding the decoders with the stream cut at random boundaries
+    for decoder, data, expected in ((framing.Decoder(), data, texts),
+                                    (protocol.Decoder(), protocol.encode_batch(frames), frames)):
+        received = []
+        offset = 0
+        while offset < len(data):
+            size = rng.randint(1, 97)
+            received += decoder.feed(data[offset:offset + size])
+            offset += size
+        assert received == expected
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import book
+import chess
+import metrics
+import search
+import tablebase
+
+"""
+Executor layer between the network loop of the server and the chess code. Move generation, checkmate detection
+and searches take long enough to stall every other connection on the event loop, so they are sent to a pool of
+processes instead, and the loop only waits for their answers.
+
+The functions run in the pool are at the bottom of this file. They are given the ChessBoard itself, which is
+pickled small (see ChessBoard.__getstate__), and return plain values.
+"""
+
+
+class Busy(Exception):
+    pass
+
+
+"""
+Offload class sends calls to an executor, with a limit on the calls waiting and a timeout for each.
+
+When max_pending calls are already waiting the new call is refused at once with Busy, instead of queuing behind
+them, so a burst of slow positions can not raise the latency of everything else. A call that takes longer than
+the timeout raises asyncio.TimeoutError; it is cancelled if it has not started, otherwise its answer is dropped.
+It still counts as pending until the executor is done with it, so the limit follows the real work of the pool.
+
+Calls that time out, are cancelled by their caller or raise are counted apart from the completed ones. The busy
+time is measured in the worker from when it starts the call, so time spent waiting in the queue is left out.
+
+Parameters:
+workers -> the number of worker processes, one per CPU if not given
+executor -> any concurrent.futures executor to use instead of a pool of processes
+max_pending -> the most calls queued or running at once, four per worker if not given
+timeout -> the seconds to wait for each call
+"""
+class Offload():
+
+    def __init__(self, workers = None, executor = None, max_pending = None, timeout = 2.0):
+        if workers == None:
+            workers = os.cpu_count() or 1
+        if executor == None:
+            executor = ProcessPoolExecutor(workers)
+        if max_pending == None:
+            max_pending = workers * 4
+        self.executor = executor
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.peak = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.errors = 0
+        # Calls a worker finished, answered or not, and the seconds the workers spent on them
+        self.ran = 0
+        self.busy_time = 0.0
+
+    """
+    Runs function(*args) on the executor and waits for its result without blocking the event loop.
+
+    Parameters: timeout -> the seconds to wait, the timeout of the Offload if not given
+    Returns: the result of the function
+    """
+    async def run(self, function, *args, timeout = None):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Busy()
+        if timeout == None:
+            timeout = self.timeout
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(timed_call, function, args)
+        self.pending += 1
+        self.peak = max(self.peak, self.pending)
+        # Set when the caller stops waiting, so a late answer is not counted as completed
+        dropped = [False]
+        # The executor calls this from its own thread, so hand the count back to the loop
+        future.add_done_callback(lambda future: loop.call_soon_threadsafe(self.finished, future, dropped))
+        try:
+            result, seconds = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            return result
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            dropped[0] = True
+            future.cancel()
+            raise
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            dropped[0] = True
+            future.cancel()
+            raise
+
+    def finished(self, future, dropped):
+        self.pending -= 1
+        if future.cancelled():
+            return
+        if future.exception() != None:
+            if not dropped[0]:
+                self.errors += 1
+            return
+        self.ran += 1
+        self.busy_time += future.result()[1]
+        if not dropped[0]:
+            self.completed += 1
+
+    """
+    Gets the counters of the calls, with the queue depth as the number of calls pending now and at most.
+    """
+    def metrics(self):
+        return {
+            "pending": self.pending,
+            "peak": self.peak,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+            "average_ms": round(self.busy_time * 1000 / max(self.ran, 1), 3)
+        }
+
+    def close(self):
+        self.executor.shutdown(wait = False, cancel_futures = True)
+
+"""
+Runs function(*args) in the worker and times it there, from when the worker starts it.
+
+Returns: the result and the seconds it took
+"""
+def timed_call(function, args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+"""
+Checks the move of the side to move and plays it, to find if it ends the game. Runs in a worker, and leaves the
+board as it was so it can also be run in place.
+
+Parameters: board -> the ChessBoard of the game
+            name -> the move in coordinate notation (e.g. e2e4)
+Returns: the move (or None if it is not legal) and the status after it: "checkmate", "stalemate", "check" or ""
+"""
+@metrics.timed("chess_validate_seconds", "checks of a move played by a client")
+def validate(board, name):
+    move = board.parse_move(name)
+    if move == None:
+        return None, ""
+    board.make_move(move)
+    king = board.kings[chess.colour_to_code[board.turn]]
+    in_check = king != -1 and board.is_square_attacked(king, chess.team[board.turn])
+    mated = len(board.generate_moves(board.turn)) == 0
+    board.unmake_move()
+    if mated:
+        if in_check:
+            return move, "checkmate"
+        return move, "stalemate"
+    if in_check:
+        return move, "check"
+    return move, ""
+
+# The opening books opened by this process, by their path
+books = {}
+
+"""
+Searches the board for the best move of the side to move, looking it up in the opening book at book_path and the
+saved tablebases first. Runs in a worker.
+
+Returns: the move in coordinate notation, or None if there are no legal moves
+"""
+@metrics.timed("engine_best_move_seconds", "searches for a hint")
+def best_move(board, time_ms, book_path = None):
+    tablebase.load_saved()
+    opening = None
+    if book_path != None:
+        if book_path not in books:
+            books[book_path] = book.Book(book_path)
+        opening = books[book_path]
+    move, score, depth = search.Search(board, book = opening).iterate(time_ms)
+    if move == None:
+        return None
+    return board.move_name(move)
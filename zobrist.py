@@ -0,0 +1,85 @@
+import random
+
+"""
+Zobrist keys of the ChessBoard positions. The key of a position is the XOR of the key of every piece on its square,
+the side to move, the castling rights, the file of the en passant square and the perspective of the board.
+Because XOR undoes itself, make_move only has to XOR in and out what changed.
+
+The keys come from a fixed seed so that every process (the server, its workers and the clients) agrees on them.
+"""
+generator = random.Random(1168)
+
+PIECES = [[generator.getrandbits(64) for index in range(64)] for code in range(16)]
+SIDE = generator.getrandbits(64)
+CASTLING = [generator.getrandbits(64) for rights in range(16)]
+EN_PASSANT = [0] + [generator.getrandbits(64) for x in range(8)]
+BLACK_TEAM = generator.getrandbits(64)
+
+# The corners of the board, bit i of the castling rights stands for the rook on CORNERS[i]
+CORNERS = (0, 7, 56, 63)
+
+
+"""
+TranspositionTable class is a fixed size cache of positions keyed by their Zobrist key.
+
+Each key has a single slot (the lower bits of the key), so the table never grows past its size. When two positions
+share a slot, the entry searched to the greater depth is kept, unless it is left over from an earlier search
+(see new_search), in which case it is always replaced.
+
+Parameters:
+size -> the number of slots, rounded up to a power of two
+"""
+class TranspositionTable():
+
+    def __init__(self, size = 1 << 16):
+        size = 1 << (size - 1).bit_length()
+        self.mask = size - 1
+        self.keys = [0] * size
+        self.depths = [-1] * size
+        self.ages = [0] * size
+        self.entries = [None] * size
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.mask + 1
+
+    """
+    Gets the entry stored for the key, or None if it is not in the table.
+    """
+    def probe(self, key):
+        slot = key & self.mask
+        if self.keys[slot] == key and self.entries[slot] is not None:
+            self.hits += 1
+            return self.entries[slot]
+        self.misses += 1
+        return None
+
+    """
+    Stores the entry for the key if it is worth more than the entry already in the slot.
+
+    Parameters: key -> the Zobrist key of the position
+                depth -> how deep the entry was searched, 0 for entries that are not search results
+                entry -> the value to store
+    """
+    def store(self, key, depth, entry):
+        slot = key & self.mask
+        if self.keys[slot] == key or self.ages[slot] != self.age or depth >= self.depths[slot]:
+            self.keys[slot] = key
+            self.depths[slot] = depth
+            self.ages[slot] = self.age
+            self.entries[slot] = entry
+
+    """
+    Marks the entries stored so far as old, so they are the first to be replaced.
+    """
+    def new_search(self):
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        size = self.mask + 1
+        self.keys = [0] * size
+        self.depths = [-1] * size
+        self.ages = [0] * size
+        self.entries = [None] * size